@@ -21,12 +21,23 @@ import ConfigParser
 import traceback
 import time
 import fnmatch
+import math
+import heapq
 import urllib
 import urllib2
-import gzip
+import urlparse
+import httplib
+import socket
 import json
 import io
-import ssl 
+import ssl
+import zlib
+import threading
+import contextlib
+import uuid
+import hashlib
+import shutil
+import multiprocessing
 try:
     import cStringIO as sio
 except ImportError as ex:
@@ -37,12 +48,101 @@ try:
 except:
     import pickle
 
+import numpy as np
 import arcpy
 import hostedgp
 import NAUtils as nau
 
 ##Module level variables
 LOG_LEVEL = logging.INFO
+#Number of seconds for which the rest/info and portal self responses are reused. Use 0 to disable caching
+REST_INFO_CACHE_TTL = 300
+PORTAL_SELF_CACHE_TTL = 300
+#Number of seconds for which the travel modes returned by the portal GetTravelModes service are reused for an org
+#and culture. Use 0 to disable caching
+PORTAL_TRAVEL_MODES_CACHE_TTL = 600
+#Number of seconds for which a local server URL that failed to respond is not tried again
+LOCAL_SERVER_RETRY_INTERVAL = 300
+#Number of seconds for which the network dataset extent polygons and their spatial index are kept in memory
+EXTENT_INDEX_CACHE_TTL = 3600
+#Number of seconds after which the workspace containing the extent polygons is checked for changes
+EXTENT_CHANGE_CHECK_INTERVAL = 30
+#Solve OD cost matrix and closest facility requests whose inputs span more than one region by solving the inputs in
+#each region separately and merging the results instead of failing. The inputs are solved this way only if every input
+#is in a region with inputs of every other type and the regions neither overlap nor touch each other, as a route
+#between the regions cannot be found by either network dataset
+MULTI_REGION_FAN_OUT = False
+#Solve OD cost matrix requests with more origins than OD_TILE_ORIGINS or more destinations than OD_TILE_DESTINATIONS
+#by splitting the inputs into tiles that are solved against the same network dataset in a pool of OD_TILE_PROCESSES
+#processes. Tiles are never larger than the maximum origins and destinations supported by the service. Use 0 for a
+#tile size to not split the origins or destinations and 0 processes to use one process per CPU. OD lines with more
+#features than the maximumRecords of the service are returned in pages as in PAGED_OUTPUT_MODE. Requests that save
+#the network analysis layer are not split. Only enable tiling after the integration test in tests/test_nas.py passes
+#against the network dataset used by the service
+OD_TILING = False
+OD_TILE_ORIGINS = 1000
+OD_TILE_DESTINATIONS = 0
+OD_TILE_PROCESSES = 0
+#Pass only the facilities that are among the nearest facilities by straight-line distance to an incident to the
+#closest facility solver. CLOSEST_FACILITY_PREFILTER_FACTOR times the number of facilities to find are kept for each
+#incident and facilities farther than the cutoff from every incident are not passed. A time cutoff is converted to a
+#distance using CLOSEST_FACILITY_PREFILTER_MAXIMUM_SPEED in kilometers per hour. The closest facility by travel can be
+#missed if it is not among the nearest facilities by straight-line distance. The output facilities contain only the
+#facilities passed to the solver, so facilities that are not passed are not returned with their Status
+CLOSEST_FACILITY_PREFILTER = False
+CLOSEST_FACILITY_PREFILTER_FACTOR = 5
+CLOSEST_FACILITY_PREFILTER_MAXIMUM_SPEED = 150
+#Solve service area requests with more facilities than SERVICE_AREA_CHUNK_FACILITIES by splitting the facilities
+#into chunks that are solved against the same network dataset in a pool of SERVICE_AREA_CHUNK_PROCESSES processes.
+#Requests with more facilities than the maximum facilities supported by the service still fail. Requests for polygons
+#that do not overlap are not split as the facility closest to each location is known only when all the facilities are
+#solved together. Requests that save the network analysis layer are not split. Use 0 processes to use one process per
+#CPU
+SERVICE_AREA_CHUNKING = False
+SERVICE_AREA_CHUNK_FACILITIES = 100
+SERVICE_AREA_CHUNK_PROCESSES = 0
+#Solve route requests with stops for more than FIND_ROUTES_BATCH_ROUTES routes by splitting the stops by RouteName
+#into batches that are solved against the same network dataset in a pool of FIND_ROUTES_BATCH_PROCESSES processes.
+#Requests with more stops than the maximum stops supported by the service still fail. Requests that save the route
+#data or the network analysis layer are not split. Use 0 processes to use one process per CPU
+FIND_ROUTES_BATCHING = False
+FIND_ROUTES_BATCH_ROUTES = 500
+FIND_ROUTES_BATCH_PROCESSES = 0
+#Use the outputs from remote tools directly as service outputs instead of copying them, unless the outputs are
+#modified after the solve. The outputs are then stored in the job directory of the remote service and must remain
+#available to the clients of this service for as long as the remote jobs are kept
+PASS_THROUGH_REMOTE_OUTPUTS = False
+#Return outputs with more features than the maximumRecords of the service in pages instead of failing. The offset of
+#the first feature to return is passed as resultOffset in the overrides. The solved outputs are kept in
+#PAGED_RESULTS_FOLDER for PAGED_RESULTS_CACHE_TTL seconds so that the other pages are returned without solving again
+#by any instance of the service that can read the folder. Results are kept per org and user, so the same request from
+#another user is solved again. If PAGED_RESULTS_FOLDER is empty, the results are kept in the jobs directory of the
+#service. Pages returned from a kept result are not metered again.
+PAGED_OUTPUT_MODE = False
+PAGED_RESULTS_CACHE_TTL = 600
+PAGED_RESULTS_FOLDER = ""
+#Number of seconds after which a remote toolbox kept in the remote toolbox registry is checked before it is used
+REMOTE_TOOLBOX_HEALTH_CHECK_INTERVAL = 300
+#Number of seconds for which the parameter info of a remote tool, such as the restrictions supported by the remote
+#service, is reused. Use 0 to disable caching
+REMOTE_TOOL_PARAMETER_INFO_CACHE_TTL = 600
+#Seconds to wait before the first check of a remote tool job status. The wait is doubled after every check up to
+#the maximum poll interval
+REMOTE_TOOL_INITIAL_POLL_INTERVAL = 0.05
+REMOTE_TOOL_MAX_POLL_INTERVAL = 2
+#Number of seconds after which a remote tool job that has not finished is cancelled. Use 0 to wait forever
+REMOTE_TOOL_TIMEOUT = 3600
+#Simplify the directions and route edges using the numpy Douglas-Peucker implementation in generalize_lines instead of
+#arcpy.edit.Generalize. Use benchmark_generalize with the directions and route edges from real solves to compare the
+#time taken and the simplified lines with Generalize before turning this on
+NUMPY_LINE_GENERALIZATION = False
+#Maximum size in bytes of a decoded HTTP response read by make_http_request. Use 0 for no limit
+MAX_HTTP_RESPONSE_SIZE = 0
+#Number of bytes read from an HTTP response at a time
+HTTP_READ_CHUNK_SIZE = 65536
+#URLs used to get rest/info from the local server and whether SSL errors are ignored for each URL
+LOCAL_REST_INFO_URLS = (("http://localhost:6080/arcgis/rest/info", False),
+                        ("https://localhost:6443/arcgis/rest/info", True))
 
 def strip_quotes(value):
     '''Strips the single quote from the start and end of each string value.
@@ -54,11 +154,578 @@ def strip_quotes(value):
     else:
         return value
 
+class ReadOnlyDict(dict):
+    '''A dict that raises a TypeError on any attempt to modify it. Used to share cached objects across requests.'''
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError("{0} object does not support modification".format(self.__class__.__name__))
+
+    __setitem__ = _readOnly
+    __delitem__ = _readOnly
+    clear = _readOnly
+    pop = _readOnly
+    popitem = _readOnly
+    setdefault = _readOnly
+    update = _readOnly
+
+def freeze_json(value):
+    '''Returns a read-only copy of a JSON object. Dicts are converted to ReadOnlyDict and lists to tuples.'''
+
+    if isinstance(value, dict):
+        return ReadOnlyDict((k, freeze_json(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return tuple(freeze_json(v) for v in value)
+    else:
+        return value
+
+def load_json_file(file_path):
+    '''Returns a read-only JSON object with the contents of a UTF-8 encoded JSON file.'''
+
+    with io.open(file_path, "r", encoding="utf-8") as fp:
+        return freeze_json(json.loads(fp.read(), "utf-8"))
+
+class FileCache(object):
+    '''Process wide cache of objects loaded from files. Objects are keyed by the file path and are reloaded when the
+    modification time or the size of the file changes. The loader is a function that accepts a file path and returns
+    the object to cache. Cached objects are shared by all callers and must not be modified.'''
+
+    def __init__(self, loader):
+        '''Constructor'''
+
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path):
+        '''Return the cached object for the file. Load the file if it is not cached or has changed since it was
+        cached.'''
+
+        key = os.path.normcase(os.path.abspath(file_path))
+        file_stat = os.stat(key)
+        signature = (file_stat.st_mtime, file_stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = self.loader(key)
+        with self._lock:
+            self._entries[key] = (signature, value)
+        return value
+
+    def invalidate(self, file_path=None):
+        '''Remove the object cached for a file. If a file path is not specified, remove all cached objects.'''
+
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.normcase(os.path.abspath(file_path)), None)
+
+    def stats(self):
+        '''Return a dict with cache hit and miss counts and the number of cached files.'''
+
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+class TTLCache(object):
+    '''Thread safe cache of objects that expire a fixed number of seconds after they are added. Cached objects are
+    shared by all callers and must not be modified.'''
+
+    def __init__(self, ttl):
+        '''Constructor. ttl is the number of seconds an object is kept. A ttl of 0 disables caching.'''
+
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Return the cached object for the key or None if the key is not cached or has expired'''
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        '''Cache the object for the key'''
+
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[key] = (time.time() + self.ttl, value)
+
+    def invalidate(self, key=None):
+        '''Remove the object cached for the key. If a key is not specified, remove all cached objects.'''
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        '''Remove the objects cached for all keys for which predicate returns True'''
+
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def stats(self):
+        '''Return a dict with cache hit and miss counts and the number of cached objects.'''
+
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+class CircuitBreaker(object):
+    '''Remember which of a set of alternate endpoints responded last and which ones failed recently. An endpoint
+    that failed is skipped for retry_interval seconds unless all the endpoints have failed.'''
+
+    def __init__(self, retry_interval):
+        '''Constructor'''
+
+        self.retryInterval = retry_interval
+        self.preferred = None
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def order(self, endpoints):
+        '''Return the endpoints in the order they should be tried. The endpoint that responded last comes first and
+        endpoints that failed recently are skipped.'''
+
+        now = time.time()
+        with self._lock:
+            ordered = sorted(endpoints, key=lambda endpoint: endpoint != self.preferred)
+            available = [endpoint for endpoint in ordered
+                         if now - self._failures.get(endpoint, 0) >= self.retryInterval]
+        return available or ordered
+
+    def record_success(self, endpoint):
+        '''Remember the endpoint as the one to try first'''
+
+        with self._lock:
+            self.preferred = endpoint
+            self._failures.pop(endpoint, None)
+
+    def record_failure(self, endpoint):
+        '''Skip the endpoint until the retry interval has elapsed'''
+
+        with self._lock:
+            self._failures[endpoint] = time.time()
+            if self.preferred == endpoint:
+                self.preferred = None
+
+##Process wide cache of parsed tool info files
+TOOL_INFO_CACHE = FileCache(load_json_file)
+
+class NetworkDatasetProperties(object):
+    '''Read-only network dataset properties with one section per network dataset. Property names are lower case
+    as written by ConfigParser. Properties stored as pickles are decoded once when the properties are loaded. The
+    properties can also be saved to and loaded from a versioned JSON document.'''
+
+    PICKLED_PROPERTIES = ("attribute_parameter_values", "extent", "travel_modes")
+    JSON_VERSION = 1
+    #Marker for a get call without a default value
+    NO_DEFAULT = object()
+
+    def __init__(self, sections):
+        '''Constructor. sections is a list of (section name, dict of properties) tuples in file order.'''
+
+        self._sectionNames = tuple(name for name, props in sections)
+        self._sections = ReadOnlyDict((name, ReadOnlyDict(props)) for name, props in sections)
+
+    @classmethod
+    def from_config_file(cls, file_path):
+        '''Load the properties from a network dataset properties file written using ConfigParser'''
+
+        parser = ConfigParser.SafeConfigParser()
+        parser.read(file_path)
+        sections = []
+        for section in parser.sections():
+            props = {}
+            for option, value in parser.items(section):
+                if option in cls.PICKLED_PROPERTIES:
+                    #Empty values are not pickled
+                    value = freeze_json(pickle.loads(value)) if value else None
+                props[option] = value
+            sections.append((section, props))
+        return cls(sections)
+
+    @classmethod
+    def from_json_file(cls, file_path):
+        '''Load the properties from a JSON document written using the save method'''
+
+        with io.open(file_path, "rb") as json_fp:
+            properties_json = json.loads(json_fp.read(), "utf-8")
+        version = properties_json.get("version")
+        if version != cls.JSON_VERSION:
+            raise ValueError("Unsupported network dataset properties version {0} in {1}".format(version, file_path))
+        sections = []
+        for network_dataset in properties_json["networkDatasets"]:
+            props = {}
+            for option, value in network_dataset["properties"].iteritems():
+                #Travel modes are stored as a list of [travel mode type, isModeTimeBased, travel mode name]
+                if option == "travel_modes" and value is not None:
+                    value = {(mode_type, is_time_based): name for mode_type, is_time_based, name in value}
+                props[option] = freeze_json(value)
+            sections.append((network_dataset["name"], props))
+        return cls(sections)
+
+    @classmethod
+    def from_file(cls, file_path):
+        '''Load the properties from a JSON document or a ConfigParser file based on the file extension'''
+
+        if os.path.splitext(file_path)[1].lower() == ".json":
+            return cls.from_json_file(file_path)
+        return cls.from_config_file(file_path)
+
+    def save(self, file_path):
+        '''Write the properties as a versioned JSON document'''
+
+        network_datasets = []
+        for section in self._sectionNames:
+            props = dict(self._sections[section])
+            travel_modes = props.get("travel_modes")
+            if travel_modes is not None:
+                props["travel_modes"] = sorted([k[0], k[1], v] for k, v in travel_modes.iteritems())
+            #Attribute parameters are stored as a list of rows ordered by their row id
+            attribute_parameters = props.get("attribute_parameter_values")
+            if isinstance(attribute_parameters, dict):
+                props["attribute_parameter_values"] = [attribute_parameters[k] for k in sorted(attribute_parameters)]
+            network_datasets.append({"name": section, "properties": props})
+        properties_json = {"version": self.JSON_VERSION, "networkDatasets": network_datasets}
+        with io.open(file_path, "wb") as json_fp:
+            json_fp.write(json.dumps(properties_json, encoding="utf-8", sort_keys=True, ensure_ascii=False,
+                                     separators=(",", ":")).encode("utf-8"))
+
+    @property
+    def templateNDS(self):
+        '''The first network dataset is used as the template for all network datasets'''
+        return self._sectionNames[0]
+
+    def sections(self):
+        '''Return the network dataset names in the order they are stored in the file'''
+        return list(self._sectionNames)
+
+    def options(self, section):
+        '''Return the property names for a network dataset'''
+        return self._sections[section].keys()
+
+    def get(self, section, option, default=NO_DEFAULT):
+        '''Return the value of a property for a network dataset. Like ConfigParser, raises NoSectionError or
+        NoOptionError if the network dataset or the property does not exist, unless a default is given'''
+        if not section in self._sections:
+            raise ConfigParser.NoSectionError(section)
+        option = option.lower()
+        props = self._sections[section]
+        if option in props:
+            return props[option]
+        if default is self.NO_DEFAULT:
+            raise ConfigParser.NoOptionError(option, section)
+        return default
+
+class PooledHTTPResponse(object):
+    '''File like response read directly from a pooled connection. The connection is returned to the pool once the
+    response is completely read. Closing a response that is not completely read closes the connection.'''
+
+    def __init__(self, pool, key, connection, response, url):
+        '''Constructor'''
+
+        self.url = url
+        self.reason = response.reason
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+
+    def read(self, amt=None):
+        '''Read and return at most amt bytes, or all the remaining bytes if amt is not specified'''
+
+        if self._connection is None:
+            return ""
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._finish(self._response.will_close)
+        return data
+
+    def info(self):
+        '''Return the response headers'''
+        return self._response.msg
+
+    def getcode(self):
+        '''Return the HTTP status code'''
+        return self._response.status
+
+    def geturl(self):
+        '''Return the URL of the response'''
+        return self.url
+
+    def close(self):
+        '''Close the response'''
+
+        if self._connection is not None:
+            self._finish(True)
+
+    def _finish(self, close_connection):
+        '''Release the connection back to the pool or close it'''
+
+        connection, self._connection = self._connection, None
+        if close_connection:
+            connection.close()
+        else:
+            self._pool._release(self._key, connection)
+
+class HTTPConnectionPool(object):
+    '''Thread safe pool of keep-alive HTTP and HTTPS connections. Idle connections are kept per scheme, host, port
+    and SSL verification mode and are reused by later requests to the same host. The SSL contexts are created once
+    and shared by all connections. Requests that need to go through a proxy are made using urllib2.'''
+
+    REDIRECT_CODES = (301, 302, 303)
+
+    def __init__(self, max_idle_connections=4, max_redirects=10):
+        '''Constructor. max_idle_connections is the number of idle connections kept for each host.'''
+
+        self.maxIdleConnections = max_idle_connections
+        self.maxRedirects = max_redirects
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._sslContexts = {}
+        self._proxies = urllib.getproxies()
+        self._lock = threading.Lock()
+
+    def request(self, url, data=None, headers=None, verify_ssl=True):
+        '''Make a POST request with data, or a GET request if data is None, and return a file like response that
+        supports info() and getcode() as returned by urllib2.urlopen. Like urllib2, raise urllib2.HTTPError for a
+        response with a status other than 2xx and urllib2.URLError if the request could not be made.'''
+
+        headers = dict(headers) if headers else {}
+        headers.setdefault("User-Agent", "Python-urllib/{0}".format(urllib2.__version__))
+        if data is not None:
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        for i in range(self.maxRedirects + 1):
+            url_parts = urlparse.urlsplit(url)
+            scheme = url_parts.scheme.lower()
+            if scheme not in ("http", "https") or self._usesProxy(scheme, url_parts.hostname):
+                return self._urlopen(url, data, headers, verify_ssl)
+            selector = url_parts.path or "/"
+            if url_parts.query:
+                selector = "{0}?{1}".format(selector, url_parts.query)
+            key = (scheme, url_parts.hostname, url_parts.port, verify_ssl or scheme == "http")
+            method = "GET" if data is None else "POST"
+            response = self._send(key, method, selector, data, headers, url)
+            status = response.getcode()
+            if 200 <= status < 300:
+                #The body is not read here so that the caller can read the response incrementally
+                return response
+            try:
+                body = response.read()
+            except (socket.error, httplib.HTTPException) as ex:
+                response.close()
+                raise urllib2.URLError(ex)
+            #Follow redirects the same way as urllib2 by making a GET request to the new location
+            response_headers = response.info()
+            if status in self.REDIRECT_CODES and "location" in response_headers:
+                url = urlparse.urljoin(url, response_headers["location"])
+                data = None
+                headers.pop("Content-Type", None)
+                continue
+            raise urllib2.HTTPError(url, status, response.reason, response_headers, sio.StringIO(body))
+        raise urllib2.HTTPError(url, status, "Too many redirects", response_headers, sio.StringIO(body))
+
+    def close(self):
+        '''Close all the idle connections'''
+
+        with self._lock:
+            idle_connections = [conn for connections in self._idle.itervalues() for conn in connections]
+            self._idle.clear()
+        for connection in idle_connections:
+            connection.close()
+
+    def stats(self):
+        '''Return a dict with the number of connections created and reused and the number of idle connections.'''
+
+        with self._lock:
+            idle_count = sum(len(connections) for connections in self._idle.itervalues())
+            return {"created": self.created, "reused": self.reused, "idle": idle_count}
+
+    def _send(self, key, method, selector, data, headers, url):
+        '''Send the request using a pooled connection and return a PooledHTTPResponse once the response headers are
+        read. The connection is returned to the pool once the response body is read.'''
+
+        connection, is_reused = self._acquire(key)
+        request_sent = False
+        try:
+            try:
+                connection.request(method, selector, data, headers)
+                request_sent = True
+                response = connection.getresponse()
+            except (socket.error, httplib.HTTPException) as ex:
+                connection.close()
+                #The server may have closed the idle connection. Retry once with a new connection, but only if the
+                #server cannot have processed the request, as a POST such as submitJob must not be sent twice. A
+                #GET is retried even if it was sent. Timeouts are not retried.
+                if not is_reused or isinstance(ex, socket.timeout) or (request_sent and method != "GET"):
+                    raise
+                connection = self._connect(key)
+                response = self._sendOnce(connection, method, selector, data, headers)
+        except (socket.error, httplib.HTTPException) as ex:
+            connection.close()
+            raise urllib2.URLError(ex)
+        return PooledHTTPResponse(self, key, connection, response, url)
+
+    def _sendOnce(self, connection, method, selector, data, headers):
+        '''Send the request on a connection and return the response once the response headers are read'''
+
+        connection.request(method, selector, data, headers)
+        return connection.getresponse()
+
+    def _acquire(self, key):
+        '''Return a tuple with an idle connection for the key or a new connection and whether it is reused'''
+
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, connection):
+        '''Keep the connection for reuse unless there are enough idle connections for the key'''
+
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.maxIdleConnections:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def _connect(self, key):
+        '''Create a new connection for the key'''
+
+        scheme, host, port, verify_ssl = key
+        with self._lock:
+            self.created += 1
+        if scheme == "https":
+            return httplib.HTTPSConnection(host, port, context=self._sslContext(verify_ssl))
+        return httplib.HTTPConnection(host, port)
+
+    def _sslContext(self, verify_ssl):
+        '''Return a shared SSL context that verifies certificates if verify_ssl is True'''
+
+        with self._lock:
+            if verify_ssl not in self._sslContexts:
+                if verify_ssl:
+                    self._sslContexts[verify_ssl] = ssl.create_default_context()
+                else:
+                    self._sslContexts[verify_ssl] = ssl._create_unverified_context()
+            return self._sslContexts[verify_ssl]
+
+    def _usesProxy(self, scheme, host):
+        '''Return True if requests to the host must go through a proxy'''
+
+        return scheme in self._proxies and not urllib.proxy_bypass(host)
+
+    def _urlopen(self, url, data, headers, verify_ssl):
+        '''Make the request using urllib2 without pooling the connection'''
+
+        request = urllib2.Request(url, data, headers)
+        if verify_ssl:
+            return urllib2.urlopen(request)
+        return urllib2.urlopen(request, context=self._sslContext(False))
+
+##Process wide pool of HTTP connections used by make_http_request
+HTTP_CONNECTION_POOL = HTTPConnectionPool()
+
+##Process wide caches of responses from the local server and the portal
+REST_INFO_CACHE = TTLCache(REST_INFO_CACHE_TTL)
+PORTAL_SELF_CACHE = TTLCache(PORTAL_SELF_CACHE_TTL)
+PORTAL_TRAVEL_MODES_CACHE = TTLCache(PORTAL_TRAVEL_MODES_CACHE_TTL)
+LOCAL_SERVER_CIRCUIT_BREAKER = CircuitBreaker(LOCAL_SERVER_RETRY_INTERVAL)
+
+##Process wide cache of network dataset extent polygons. The lock ensures that concurrent requests read the extent
+##polygons only once.
+EXTENT_INDEX_CACHE = TTLCache(EXTENT_INDEX_CACHE_TTL)
+EXTENT_INDEX_LOCK = threading.Lock()
+##Lock used to set the process locale once
+LOCALE_LOCK = threading.Lock()
+LOCALE_INITIALIZED = False
+
+##Process wide cache of network dataset properties
+NDS_PROPERTIES_CACHE = FileCache(NetworkDatasetProperties.from_file)
+
+def get_nds_properties_json_file(config_file):
+    '''Return the path of the JSON document stored alongside a network dataset properties file'''
+    return os.path.splitext(config_file)[0] + ".json"
+
+def get_network_dataset_properties(config_file):
+    '''Return the cached network dataset properties for a network dataset properties file. The JSON document
+    stored alongside the properties file is used if it exists, has a supported version and is not older than the
+    properties file, which is the case when only the properties file is written again by an older tool.'''
+
+    json_file = get_nds_properties_json_file(config_file)
+    if os.path.exists(json_file) and (not os.path.exists(config_file) or
+                                      os.path.getmtime(json_file) >= os.path.getmtime(config_file)):
+        try:
+            return NDS_PROPERTIES_CACHE.get(json_file)
+        except ValueError:
+            if not os.path.exists(config_file):
+                raise
+    return NDS_PROPERTIES_CACHE.get(config_file)
+
+def read_json_response(response, content_coding_token="gzip", max_size=0):
+    '''Read a JSON response from a file like response object. A gzip encoded response is decompressed incrementally
+    as it is read so that the compressed response is never held in memory. Raise a ValueError if max_size is greater
+    than 0 and the decoded response is larger than max_size bytes.'''
+
+    decompressor = None
+    if content_coding_token == "gzip" and response.info().get("Content-Encoding") == "gzip":
+        #Add 16 to the window size so that zlib expects a gzip header and trailer
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = []
+    decoded_size = 0
+    try:
+        while True:
+            data = response.read(HTTP_READ_CHUNK_SIZE)
+            if not data:
+                if decompressor:
+                    data = decompressor.flush()
+                    decompressor = None
+                if not data:
+                    break
+            #Limit the output of each decompress call so that a highly compressed response is checked against
+            #max_size before it is fully decompressed
+            while data:
+                if decompressor:
+                    chunk = decompressor.decompress(data, HTTP_READ_CHUNK_SIZE)
+                    data = decompressor.unconsumed_tail
+                else:
+                    chunk, data = data, ""
+                decoded_size += len(chunk)
+                if max_size > 0 and decoded_size > max_size:
+                    raise ValueError("Response from {0} is larger than {1} bytes".format(response.geturl(),
+                                                                                         max_size))
+                chunks.append(chunk)
+    finally:
+        response.close()
+    response_text = "".join(chunks)
+    del chunks[:]
+    return json.loads(response_text)
+
 def make_http_request(url, query_params=None, content_coding_token="gzip", referer=None, headers=None,
-                      ignore_ssl_errors=False):
+                      ignore_ssl_errors=False, max_response_size=None):
     """Makes an HTTP request and returns the JSON response. content_coding_token must be 'gzip' or 'identity'.
     Specify a referer if the requests require it to be specified. headers is dict containing additional values
-    that are passed in the request header
+    that are passed in the request header. max_response_size is the maximum size in bytes of the decoded response
+    and defaults to MAX_HTTP_RESPONSE_SIZE.
     """
  
     response_dict = {}
@@ -67,33 +734,394 @@ def make_http_request(url, query_params=None, content_coding_token="gzip", refer
     if not "f" in query_params:
         query_params["f"] = "json"
  
-    request = urllib2.Request(url)
-    request.add_data(urllib.urlencode(query_params))
-    request.add_header("Accept-Encoding", content_coding_token)
+    data = urllib.urlencode(query_params)
+    request_headers = {"Accept-Encoding": content_coding_token}
     if referer:
-        request.add_header("Referer", referer)
+        request_headers["Referer"] = referer
     if headers:
-        for header in headers:
-            request.add_header(header, headers[header])
-    
+        request_headers.update(headers)
+
+    #Use a pooled connection so that repeated requests to the same host reuse the connection and the SSL session
     if ignore_ssl_errors:
-        response = urllib2.urlopen(request, context=ssl._create_unverified_context())
+        response = HTTP_CONNECTION_POOL.request(url, data, request_headers, verify_ssl=False)
     else:
         try:
-            response = urllib2.urlopen(request)
+            response = HTTP_CONNECTION_POOL.request(url, data, request_headers)
         except urllib2.URLError as ex:
             #revert to default https validation that was used in python 2.7.8 and earlier
-            ssl_context = ssl._create_unverified_context()
-            response = urllib2.urlopen(request, context=ssl_context)         
+            response = HTTP_CONNECTION_POOL.request(url, data, request_headers, verify_ssl=False)
     #If content_coding_token is identity, response does not need any transformation. If content_coding_token is
-    #gzip, the response needs special handling before converting to JSON.
-    if content_coding_token == "gzip":
-        if response.info().get("Content-Encoding") == "gzip":
-            buf = sio.StringIO(response.read())
-            response = gzip.GzipFile(fileobj=buf)
-    response_dict = json.load(response)
+    #gzip, the response is decompressed while it is read.
+    if max_response_size is None:
+        max_response_size = MAX_HTTP_RESPONSE_SIZE
+    response_dict = read_json_response(response, content_coding_token, max_response_size)
     return response_dict
 
+class STRtree(object):
+    '''Read-only R-tree over bounding boxes that is bulk loaded using Sort-Tile-Recursive packing. Each entry is a
+    tuple of (xmin, ymin, xmax, ymax, value).'''
+
+    def __init__(self, entries, node_capacity=8):
+        '''Constructor'''
+
+        self.nodeCapacity = node_capacity
+        self._root = None
+        level = list(entries)
+        is_leaf = True
+        while level:
+            nodes = self._pack(level, is_leaf)
+            if len(nodes) == 1:
+                self._root = nodes[0]
+                break
+            level = nodes
+            is_leaf = False
+
+    def _pack(self, entries, is_leaf):
+        '''Group the entries into nodes. Entries are sorted into vertical slices by the x coordinate of their center
+        and each slice is sorted by the y coordinate of the center before it is split into nodes.'''
+
+        capacity = self.nodeCapacity
+        node_count = int(math.ceil(len(entries) / float(capacity)))
+        slice_size = int(math.ceil(math.sqrt(node_count))) * capacity
+        entries = sorted(entries, key=lambda entry: entry[0] + entry[2])
+        nodes = []
+        for i in range(0, len(entries), slice_size):
+            vertical_slice = sorted(entries[i:i + slice_size], key=lambda entry: entry[1] + entry[3])
+            for j in range(0, len(vertical_slice), capacity):
+                children = vertical_slice[j:j + capacity]
+                nodes.append((min(child[0] for child in children), min(child[1] for child in children),
+                              max(child[2] for child in children), max(child[3] for child in children),
+                              children, is_leaf))
+        return nodes
+
+    def query_point(self, x, y):
+        '''Return the values for all the entries whose bounding box contains the point'''
+
+        values = []
+        stack = [self._root] if self._root else []
+        while stack:
+            xmin, ymin, xmax, ymax, children, is_leaf = stack.pop()
+            if x < xmin or x > xmax or y < ymin or y > ymax:
+                continue
+            if is_leaf:
+                values.extend(child[4] for child in children
+                              if child[0] <= x <= child[2] and child[1] <= y <= child[3])
+            else:
+                stack.extend(children)
+        return values
+
+class KDTree(object):
+    '''Read-only k-d tree over points for nearest neighbour queries. Nodes are split at the median of the coordinate
+    with the largest spread until they have at most leaf_size points.'''
+
+    def __init__(self, points, leaf_size=16):
+        '''Constructor. points is a numpy array with a row for each point and a column for each dimension.'''
+
+        self.points = np.asarray(points, dtype=np.float64)
+        self.leafSize = max(leaf_size, 1)
+        self.indices = np.arange(len(self.points))
+        self._root = self._build(0, len(self.points)) if len(self.points) else None
+
+    def _build(self, start, end):
+        '''Return the node for the points at indices[start:end]. A node is a tuple of the minimum and maximum
+        coordinates of its points, the start and end positions of its points and its two child nodes, which are None
+        for a leaf.'''
+
+        node_points = self.points[self.indices[start:end]]
+        lower = node_points.min(axis=0)
+        upper = node_points.max(axis=0)
+        if end - start <= self.leafSize:
+            return (lower, upper, start, end, None, None)
+        dimension = int(np.argmax(upper - lower))
+        middle = (end - start) // 2
+        #argpartition is not available in the numpy installed with older ArcGIS releases
+        order = np.argsort(node_points[:, dimension])
+        self.indices[start:end] = self.indices[start:end][order]
+        return (lower, upper, start, end, self._build(start, start + middle), self._build(start + middle, end))
+
+    def query(self, point, k, max_distance=float("inf")):
+        '''Return the indices of the k points nearest to the point, ordered by distance. Points farther than
+        max_distance are not returned.'''
+
+        point = np.asarray(point, dtype=np.float64)
+        #Heap of (-distance, index) tuples with the nearest points found so far
+        nearest = []
+        #Heap of (minimum distance, sequence, node) tuples with the nodes to visit
+        nodes = [(0.0, 0, self._root)] if self._root and k > 0 else []
+        sequence = 0
+        while nodes:
+            node_distance, node_sequence, node = heapq.heappop(nodes)
+            if node_distance > max_distance or (len(nearest) == k and node_distance > -nearest[0][0]):
+                break
+            lower, upper, start, end, left, right = node
+            if left is None:
+                indices = self.indices[start:end]
+                distances = np.sqrt(((self.points[indices] - point) ** 2).sum(axis=1))
+                for distance, index in zip(distances.tolist(), indices.tolist()):
+                    if distance > max_distance:
+                        continue
+                    if len(nearest) < k:
+                        heapq.heappush(nearest, (-distance, index))
+                    elif distance < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-distance, index))
+                continue
+            for child in (left, right):
+                sequence += 1
+                offsets = np.maximum(child[0] - point, 0) + np.maximum(point - child[1], 0)
+                heapq.heappush(nodes, (math.sqrt(float((offsets ** 2).sum())), sequence, child))
+        return [index for distance, index in sorted(nearest, reverse=True)]
+
+def get_polygon_rings(polygon):
+    '''Return the rings of an arcpy polygon as lists of (x, y) tuples'''
+
+    rings = []
+    for part in polygon:
+        ring = []
+        for point in part:
+            #A None point separates the exterior ring of a part from its interior rings
+            if point is None:
+                if ring:
+                    rings.append(ring)
+                ring = []
+            else:
+                ring.append((point.X, point.Y))
+        if ring:
+            rings.append(ring)
+    return rings
+
+def point_in_rings(x, y, rings):
+    '''Return True if the point is inside the polygon formed by the rings using the even-odd ray casting rule.'''
+
+    inside = False
+    for ring in rings:
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            x1, y1 = x2, y2
+    return inside
+
+def get_ring_edges(rings):
+    '''Return the edges of all the rings as a tuple of numpy arrays with the start x, start y, end x and end y
+    coordinates of each edge'''
+
+    starts = []
+    ends = []
+    for ring in rings:
+        starts.extend(ring[-1:] + ring[:-1])
+        ends.extend(ring)
+    starts = np.array(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.array(ends, dtype=np.float64).reshape(-1, 2)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+def points_in_polygon_block(x, y, edges):
+    '''Return a boolean numpy array that is True for the points given by the numpy arrays x and y that are inside the
+    polygon formed by the edges returned from get_ring_edges. Uses the even-odd ray casting rule vectorized over
+    points and edges.'''
+
+    x1, y1, x2, y2 = edges
+    px = x[:, np.newaxis]
+    py = y[:, np.newaxis]
+    straddles = (y1 > py) != (y2 > py)
+    #Horizontal edges never straddle the ray, so their division by zero does not affect the result
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossings = straddles & (px < (x2 - x1) * (py - y1) / (y2 - y1) + x1)
+    return crossings.sum(axis=1) % 2 == 1
+
+def points_in_polygon(x, y, edges, max_elements=1000000):
+    '''Return a boolean numpy array that is True for the points given by the numpy arrays x and y that are inside the
+    polygon formed by the edges returned from get_ring_edges. Points are tested in blocks so that the intermediate
+    arrays have at most max_elements elements.'''
+
+    block_size = max(1, max_elements // max(len(edges[0]), 1))
+    inside = np.zeros(len(x), dtype=bool)
+    for start in range(0, len(x), block_size):
+        inside[start:start + block_size] = points_in_polygon_block(x[start:start + block_size],
+                                                                   y[start:start + block_size], edges)
+    return inside
+
+def all_points_in_polygon(x, y, edges, max_elements=1000000):
+    '''Return True if all the points given by the numpy arrays x and y are inside the polygon formed by the edges
+    returned from get_ring_edges. Points are tested in blocks so that the intermediate arrays have at most
+    max_elements elements and the test stops at the first block with a point outside the polygon.'''
+
+    block_size = max(1, max_elements // max(len(edges[0]), 1))
+    for start in range(0, len(x), block_size):
+        if not points_in_polygon_block(x[start:start + block_size], y[start:start + block_size], edges).all():
+            return False
+    return True
+
+def get_workspace_signature(catalog_path):
+    '''Return a value that changes when the files storing a dataset change. For a dataset in a file geodatabase, the
+    files in the geodatabase folder are checked. Returns None if the dataset is not stored in the file system.'''
+
+    path = catalog_path
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    try:
+        if os.path.isdir(path):
+            #Lock files are created and removed by every process reading the geodatabase
+            file_paths = [os.path.join(path, name) for name in os.listdir(path) if not name.lower().endswith(".lock")]
+        else:
+            file_paths = [path]
+    except OSError as ex:
+        return None
+    file_stats = []
+    for file_path in file_paths:
+        try:
+            file_stats.append(os.stat(file_path))
+        except OSError as ex:
+            #The file was removed after the folder was listed
+            continue
+    return (len(file_stats), max([file_stat.st_mtime for file_stat in file_stats] or [0]),
+            sum(file_stat.st_size for file_stat in file_stats))
+
+class NetworkDatasetExtents(object):
+    '''In memory copy of the network dataset extent polygons with a spatial index over their extents and a lookup of
+    regions by name. Regions are stored in the order they are read from the extent polygons.'''
+
+    def __init__(self, extent_polygons, extent_polygon_fields):
+        '''Read the polygons and the extent polygon fields from the extent polygons feature layer. The extent
+        polygon fields are the region name, remote connection, GP service and rank fields.'''
+
+        desc = arcpy.Describe(extent_polygons)
+        self.spatialReference = desc.spatialReference
+        self.catalogPath = desc.catalogPath
+        self.signature = get_workspace_signature(self.catalogPath)
+        self._checkedAt = time.time()
+        self._lock = threading.Lock()
+        #Connection files for remote network datasets are stored in the folder containing the workspace. The extent
+        #polygons can be stored in a feature dataset within the workspace.
+        workspace_path = os.path.dirname(self.catalogPath)
+        if arcpy.Describe(workspace_path).dataType == "FeatureDataset":
+            workspace_path = os.path.dirname(workspace_path)
+        self.connectionFilesFolder = os.path.dirname(workspace_path)
+        self.shapes = []
+        self.rings = []
+        self.edges = []
+        self.extents = []
+        self.rows = []
+        #Region name -> (network dataset name, connection file, GP service name)
+        self.regions = {}
+        entries = []
+        with arcpy.da.SearchCursor(extent_polygons, ["SHAPE@"] + list(extent_polygon_fields)) as cursor:
+            for row in cursor:
+                region_name = row[1]
+                if region_name not in self.regions:
+                    self.regions[region_name] = (region_name,) + self._getRemoteConnection(row[3])
+                shape = row[0]
+                if not shape:
+                    continue
+                extent = shape.extent
+                entries.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax, len(self.rows)))
+                rings = get_polygon_rings(shape)
+                self.shapes.append(shape)
+                self.rings.append(rings)
+                self.edges.append(get_ring_edges(rings))
+                self.extents.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+                self.rows.append(tuple(row[1:]))
+        self.index = STRtree(entries)
+
+    def _getRemoteConnection(self, gp_service):
+        '''Return a tuple with the connection file and the service name for a remote network dataset. Both are
+        empty strings for a local network dataset.'''
+
+        if not gp_service:
+            return ("", "")
+        connection_file_name, service_name = gp_service.split(";", 1)
+        return (os.path.join(self.connectionFilesFolder, connection_file_name), service_name)
+
+    def is_stale(self):
+        '''Return True if the files storing the extent polygons have changed since they were read. The files are
+        checked at most once every EXTENT_CHANGE_CHECK_INTERVAL seconds.'''
+
+        with self._lock:
+            now = time.time()
+            if now - self._checkedAt < EXTENT_CHANGE_CHECK_INTERVAL:
+                return False
+            self._checkedAt = now
+        return get_workspace_signature(self.catalogPath) != self.signature
+
+    def find(self, x, y):
+        '''Return the positions of the regions that contain the point in the order the regions were read'''
+
+        return sorted(i for i in self.index.query_point(x, y) if point_in_rings(x, y, self.rings[i]))
+
+    def contains_all(self, region, x, y):
+        '''Return True if the region contains all the points given by the numpy arrays x and y'''
+
+        if not len(x):
+            return True
+        xmin, ymin, xmax, ymax = self.extents[region]
+        if x.min() < xmin or x.max() > xmax or y.min() < ymin or y.max() > ymax:
+            return False
+        return all_points_in_polygon(x, y, self.edges[region])
+
+    def disjoint(self, region_names):
+        '''Return True if the polygons of each named region neither overlap nor touch the polygons of the other named
+        regions'''
+
+        regions = [region for region in range(len(self.rows)) if self.rows[region][0] in region_names]
+        for index, first_region in enumerate(regions):
+            first_xmin, first_ymin, first_xmax, first_ymax = self.extents[first_region]
+            for second_region in regions[index + 1:]:
+                if self.rows[first_region][0] == self.rows[second_region][0]:
+                    continue
+                xmin, ymin, xmax, ymax = self.extents[second_region]
+                if xmin > first_xmax or xmax < first_xmin or ymin > first_ymax or ymax < first_ymin:
+                    continue
+                if not self.shapes[first_region].disjoint(self.shapes[second_region]):
+                    return False
+        return True
+
+    def assign(self, x, y):
+        '''Return a numpy array with the position of the region with the lowest rank that contains each point given by
+        the numpy arrays x and y. Ties are broken by the order in which the regions were read. The position is -1 for
+        points that are not in any region.'''
+
+        assigned_regions = np.empty(len(x), dtype=np.int32)
+        assigned_regions.fill(-1)
+        #sort by rank field (fourth field) so that a point is assigned to the first region that contains it
+        for region in sorted(range(len(self.rows)), key=lambda region: (self.rows[region][3], region)):
+            xmin, ymin, xmax, ymax = self.extents[region]
+            candidates = np.flatnonzero((assigned_regions == -1) & (x >= xmin) & (x <= xmax) & (y >= ymin) &
+                                        (y <= ymax))
+            if len(candidates):
+                inside = points_in_polygon(x[candidates], y[candidates], self.edges[region])
+                assigned_regions[candidates[inside]] = region
+        return assigned_regions
+
+def get_network_dataset_extents(extent_polygons, extent_polygon_fields):
+    '''Return the cached NetworkDatasetExtents for the extent polygons feature layer. The returned object is not
+    modified after it is created, so it can be used by concurrent requests.'''
+
+    key = (extent_polygons, tuple(extent_polygon_fields))
+    extents = EXTENT_INDEX_CACHE.get(key)
+    if extents is not None and not extents.is_stale():
+        return extents
+    with EXTENT_INDEX_LOCK:
+        #Another request might have read the extent polygons while this request was waiting for the lock
+        cached_extents = EXTENT_INDEX_CACHE.get(key)
+        if cached_extents is not None and cached_extents is not extents:
+            return cached_extents
+        extents = NetworkDatasetExtents(extent_polygons, extent_polygon_fields)
+        EXTENT_INDEX_CACHE.set(key, extents)
+    return extents
+
+def read_point_coordinates(points, spatial_reference):
+    '''Return a tuple of numpy arrays with the x and y coordinates of all the features in the point feature classes
+    projected to the spatial reference. Features with empty geometries are skipped.'''
+
+    coordinate_fields = ["SHAPE@X", "SHAPE@Y"]
+    arrays = [arcpy.da.FeatureClassToNumPyArray(input_points, coordinate_fields, "", spatial_reference,
+                                                skip_nulls=True)
+              for input_points in points]
+    coordinates = np.concatenate(arrays)
+    return (coordinates["SHAPE@X"].astype(np.float64), coordinates["SHAPE@Y"].astype(np.float64))
+
 def select_nds_extent_polygons(extentPolygons,extentPolygonFields,points):
     '''Select NDS based on polygons of network dataset extents. ExtentPolygons is assumed to be a feature layer.
     For remote NDS return the connection file and service name in addition to the name. points is a list of all
@@ -103,69 +1131,43 @@ def select_nds_extent_polygons(extentPolygons,extentPolygonFields,points):
     we return empty network dataset. If the first point falls in only one extent, return the network dataset.
     If first point falls in more than on extent, then combine all the inputs. If all inputs are in a single extent,
     use the network dataset. If all inputs are in two extents, use the network dataset with lower rank. 
-    If all inputs are not within any extent fail with a message saying that all points are not in a single extent.'''
+    If all inputs are not within any extent fail with a message saying that all points are not in a single extent.
+    The extent polygons are read once and searched using an in memory spatial index. The selection on the
+    extent polygons layer and the arcpy environment settings are not used or modified, so regions can be selected
+    by concurrent requests in the same process.'''
     
     outputNDS = ""
     connectionFile = ""
     serviceName = ""
-    remoteConnectionInfo = None
-    selectedRowCount = 0
-    
-    #Get a list of point shapes. Always project geometry to spatial reference of extent polygons
-    sr = arcpy.Describe(extentPolygons).spatialReference
+
+    extents = get_network_dataset_extents(extentPolygons, extentPolygonFields)
+    #Get the point coordinates. Always project geometry to spatial reference of extent polygons
+    sr = extents.spatialReference
     #We assume that if the first demand point falls within the network dataset extent all 
     #all points from all inputs are within the same extent 
-    with arcpy.da.SearchCursor(points[0], "SHAPE@", "", sr) as cursor:
-        firstPoint = cursor.next()[0]    
-    #We assume that extentPolygons is a feature layer
-    #If output coordinate system is set, we need to use the coordinate system of extent polygons.
-    origOutputSR = arcpy.env.outputCoordinateSystem
-    arcpy.env.outputCoordinateSystem = sr
-    layerWithSelection = arcpy.management.SelectLayerByLocation(extentPolygons, "COMPLETELY_CONTAINS",
-                                                                firstPoint).getOutput(0)
-    
-    with arcpy.da.SearchCursor(layerWithSelection, extentPolygonFields) as cursor:
-        for row in cursor:
-            #For most cases, we should have only one selected row if the point falls into any polygon
-            selectedRowCount += 1
-            if selectedRowCount == 1:
-                outputNDS = row[0]
-                remoteConnectionInfo = row[1:3]
-            else:
-                #The first point falls in multiple polygons. Create a multipoint with all the inputs
-                ptList = []
-                for inputPoint in points:
-                    with arcpy.da.SearchCursor(inputPoint, "SHAPE@", "", sr) as cursor:
-                        ptList += [row[0].firstPoint for row in cursor]
-                inputMultiPoint = arcpy.Multipoint(arcpy.Array(ptList), sr)
-                #Check if multipoint is in at least one region. If yes select the region with highest rank
-                #Otherwise return an error
-                overlappingExtentsLayer = arcpy.management.SelectLayerByLocation(extentPolygons, "COMPLETELY_CONTAINS",
-                                                                                 inputMultiPoint).getOutput(0)
-                arcpy.management.Delete(inputMultiPoint)
-                with arcpy.da.SearchCursor(overlappingExtentsLayer, extentPolygonFields) as cursor:
-                    #sort by rank field (fourth field in the cursor)
-                    sorted_cursor = sorted(cursor, key=lambda row: row[3])
-                if len(sorted_cursor):
-                    #pick the first row
-                    first_row = sorted_cursor[0]
-                    outputNDS = first_row[0]
-                    remoteConnectionInfo = first_row[1:3]
-                else:
-                    arcpy.AddIDMessage("ERROR", 30140)
-                    raise InputError 
-                #break out of loop in case we have more than 2 polygons that contain input points
-                break
-    #Check if the selected NDS is remote
-    if remoteConnectionInfo and remoteConnectionInfo[-1]:
-        #Connection file is in same workspace as layer
-        connection_file_name, serviceName = remoteConnectionInfo[-1].split(";", 1)
-        connectionFile = os.path.join(os.path.dirname(layerWithSelection.workspacePath),
-                                      connection_file_name)
-        
-
-    arcpy.management.SelectLayerByAttribute(extentPolygons, "CLEAR_SELECTION")
-    arcpy.env.outputCoordinateSystem = origOutputSR
+    with arcpy.da.SearchCursor(points[0], "SHAPE@XY", "", sr) as cursor:
+        first_x, first_y = cursor.next()[0]
+    regions = extents.find(first_x, first_y)
+
+    #For most cases, we should have only one region if the point falls into any polygon
+    if len(regions) == 1:
+        outputNDS = extents.rows[regions[0]][0]
+    elif len(regions) > 1:
+        #The first point falls in multiple polygons. Check if all the inputs are in at least one of these regions. If
+        #yes select the region with highest rank. Otherwise return an error. The projected coordinates are read
+        #once and tested against each region with vectorized ray casting.
+        input_x, input_y = read_point_coordinates(points, sr)
+        containing_regions = [region for region in regions if extents.contains_all(region, input_x, input_y)]
+        if containing_regions:
+            #sort by rank field (fourth field) keeping the order in which the regions were read for ties
+            first_region = min(containing_regions, key=lambda region: (extents.rows[region][3], region))
+            outputNDS = extents.rows[first_region][0]
+        else:
+            arcpy.AddIDMessage("ERROR", 30140)
+            raise InputError 
+    #Get the connection file and service name if the selected NDS is remote
+    if outputNDS:
+        outputNDS, connectionFile, serviceName = extents.regions[outputNDS]
     
     #Fail if the points do not fall in any network datasets    
     if outputNDS == "":
@@ -174,35 +1176,582 @@ def select_nds_extent_polygons(extentPolygons,extentPolygonFields,points):
     
     return (outputNDS, connectionFile, serviceName)
 
-def add_remote_toolbox(connection_file, service):
-    '''Adds a remote toolbox using the ags connection file and returns the remote tool name and the path to the toolbox.
-    The remote tool name can be used with arcpy.gp to call the tool. The toolbox path can be used to remove the toolbox
-    after execution of the remote tool'''
-
-    #Get the service_name and task_name and task_alias from the service
-    service_name, task_name = service.split(";")
-    task_alias = service_name.split("/")[-1]
-    #Add the remote toolbox
-    tbx = "{0};{1}".format(connection_file, service_name)
-    tbx_added = False
+def get_request_signature(task_name, tool_parameters, identity=()):
+    '''Return a signature that is the same for requests to a task with the same parameter values from the same
+    identity, such as the org and user making the request. Feature sets and record sets are included by their
+    contents, so that requests with the same inputs have the same signature.'''
+
+    signature = hashlib.sha1(task_name.encode("utf-8"))
+    signature.update(repr(tuple(identity)))
+    for param_name in sorted(tool_parameters):
+        param_value = tool_parameters[param_name]
+        signature.update(param_name.encode("utf-8"))
+        #Feature sets and record sets can be saved to a dataset
+        if not hasattr(param_value, "save"):
+            signature.update(repr(param_value))
+            continue
+        desc = arcpy.Describe(param_value)
+        field_names = [field.name for field in desc.fields if not field.type in ("OID", "Geometry")]
+        if hasattr(desc, "shapeType"):
+            field_names.append("SHAPE@WKB")
+        with arcpy.da.SearchCursor(param_value, field_names) as cursor:
+            for row in cursor:
+                signature.update(repr([bytes(value) if isinstance(value, bytearray) else value for value in row]))
+    return signature.hexdigest()
+
+def get_paged_results_folder():
+    '''Return the folder in which the results returned in pages are kept. The scratch folder of a geoprocessing
+    service job is in a folder named using the job id within the jobs directory of the service, which can be read by
+    every instance of the service.'''
+
+    if PAGED_RESULTS_FOLDER:
+        return PAGED_RESULTS_FOLDER
+    return os.path.join(os.path.dirname(os.path.dirname(arcpy.env.scratchFolder)), "PagedResults")
+
+def read_paged_result_manifest(result_folder):
+    '''Return the manifest of a kept result or None if the result is not completely written'''
+
+    try:
+        with io.open(os.path.join(result_folder, "result.json"), "rb") as json_fp:
+            return json.loads(json_fp.read(), "utf-8")
+    except (IOError, OSError, ValueError) as ex:
+        return None
+
+def delete_paged_result(result_folder):
+    '''Delete a kept result. Errors are ignored as the result can be deleted by another instance at the same
+    time.'''
+
     try:
-        arcpy.gp.addToolbox(tbx)
+        workspace = os.path.join(result_folder, "Result.gdb")
+        if arcpy.Exists(workspace):
+            arcpy.management.Delete(workspace)
+    except Exception as ex:
+        pass
+    shutil.rmtree(result_folder, True)
+
+def load_paged_result(signature):
+    '''Return a dict with whether the solve succeeded and a dict with the output path and whether the output is
+    returned in pages for each output name, for an unexpired result kept by save_paged_result. Returns None if no such
+    result is kept.'''
+
+    results_folder = get_paged_results_folder()
+    if not os.path.isdir(results_folder):
+        return None
+    now = time.time()
+    for folder_name in fnmatch.filter(os.listdir(results_folder), signature + "_*"):
+        result_folder = os.path.join(results_folder, folder_name)
+        manifest = read_paged_result_manifest(result_folder)
+        if manifest is None or manifest["expires"] < now:
+            continue
+        outputs = {}
+        for output_name, (output, is_paged) in manifest["outputs"].iteritems():
+            outputs[output_name] = (os.path.join(result_folder, output) if output else output, is_paged)
+        return {"solveSucceeded": manifest["solveSucceeded"], "outputs": outputs}
+    return None
+
+def save_paged_result(signature, solve_succeeded, outputs):
+    '''Keep the outputs of a result returned in pages in a new folder in the paged results folder named using the
+    request signature. outputs is a dict with a tuple of the output dataset or file and whether the output is returned
+    in pages for each output name. Returns a dict of the same form with the kept outputs. The manifest describing the
+    result is written last so that a partially written result is never read. Expired results are deleted.'''
+
+    results_folder = get_paged_results_folder()
+    now = time.time()
+    if os.path.isdir(results_folder):
+        for folder_name in os.listdir(results_folder):
+            result_folder = os.path.join(results_folder, folder_name)
+            manifest = read_paged_result_manifest(result_folder)
+            try:
+                if manifest is None:
+                    #Results still being written by other requests are deleted only once they are older than the TTL
+                    expired = now - os.path.getmtime(result_folder) > PAGED_RESULTS_CACHE_TTL
+                else:
+                    expired = manifest["expires"] < now
+            except OSError as ex:
+                #The result was deleted by another request
+                continue
+            if expired:
+                delete_paged_result(result_folder)
+
+    result_folder = os.path.join(results_folder, "{0}_{1}".format(signature, uuid.uuid4().hex))
+    os.makedirs(result_folder)
+    workspace = arcpy.management.CreateFileGDB(result_folder, "Result.gdb").getOutput(0)
+    kept_outputs = {}
+    manifest_outputs = {}
+    for output_name, (output, is_paged) in outputs.iteritems():
+        kept_output = ""
+        if not output:
+            pass
+        elif os.path.isfile(output):
+            #Layer files and route data are files
+            kept_output = os.path.basename(output)
+            shutil.copy2(output, os.path.join(result_folder, kept_output))
+        else:
+            kept_output = os.path.join(os.path.basename(workspace), output_name)
+            if arcpy.Describe(output).dataType == "Table":
+                arcpy.management.CopyRows(output, os.path.join(result_folder, kept_output))
+            else:
+                arcpy.management.CopyFeatures(output, os.path.join(result_folder, kept_output))
+        manifest_outputs[output_name] = (kept_output, is_paged)
+        kept_outputs[output_name] = (os.path.join(result_folder, kept_output) if kept_output else output, is_paged)
+    manifest = {"expires": now + PAGED_RESULTS_CACHE_TTL, "solveSucceeded": solve_succeeded,
+                "outputs": manifest_outputs}
+    with io.open(os.path.join(result_folder, "result.json"), "wb") as json_fp:
+        json_fp.write(json.dumps(manifest, encoding="utf-8", ensure_ascii=False).encode("utf-8"))
+    return kept_outputs
+
+def write_feature_blocks(features, workspace, name, block_size):
+    '''Copy the features in ObjectID order into feature classes in the workspace with at most block_size features
+    each. The feature classes are named using name followed by the block number. Returns the list of feature class
+    paths. All the features are copied into one feature class if block_size is 0.'''
+
+    with arcpy.da.SearchCursor(features, ["OID@"]) as cursor:
+        oids = sorted(row[0] for row in cursor)
+    block_size = block_size or len(oids) or 1
+    oid_field = arcpy.AddFieldDelimiters(features, arcpy.Describe(features).OIDFieldName)
+    blocks = []
+    for start in range(0, max(len(oids), 1), block_size):
+        block_oids = oids[start:start + block_size] or [0]
+        where_clause = u"{0} >= {1} AND {0} <= {2}".format(oid_field, block_oids[0], block_oids[-1])
+        block = os.path.join(workspace, "{0}{1}".format(name, len(blocks)))
+        arcpy.analysis.Select(features, block, where_clause)
+        blocks.append(block)
+    return blocks
+
+def write_feature_subsets(features, workspace, name, oid_subsets):
+    '''Copy the features with each list of ObjectIDs into a feature class in the workspace. The feature classes are
+    named using name followed by the subset number and store the features in ObjectID order. Returns the list of
+    feature class paths.'''
+
+    oid_field = arcpy.AddFieldDelimiters(features, arcpy.Describe(features).OIDFieldName)
+    subsets = []
+    for oids in oid_subsets:
+        where_clause = u"{0} IN ({1})".format(oid_field, ",".join(str(oid) for oid in oids))
+        subset = os.path.join(workspace, "{0}{1}".format(name, len(subsets)))
+        arcpy.analysis.Select(features, subset, where_clause)
+        subsets.append(subset)
+    return subsets
+
+def read_rows_in_merge_order(datasets, field_names):
+    '''Yield a tuple with the position of the dataset, the ObjectID and a list with the values of field_names for
+    each row in the datasets. The rows are read one dataset after the other in ObjectID order, which is the order in
+    which Merge appends them to its output.'''
+
+    for position, dataset in enumerate(datasets):
+        sql_clause = (None, "ORDER BY {0}".format(arcpy.Describe(dataset).OIDFieldName))
+        with arcpy.da.SearchCursor(dataset, ["OID@"] + list(field_names), sql_clause=sql_clause) as cursor:
+            for row in cursor:
+                yield position, row[0], list(row[1:])
+
+def iter_merged_rows(merged_rows, datasets, field_names):
+    '''Yield a tuple with the position of the dataset the row was merged from, the ObjectID of the row in that
+    dataset and the row for each row from merged_rows, which iterates over the output of Merge in ObjectID order. The
+    last values in each row are the values of field_names. Raises arcpy.ExecuteError if the rows are not the rows from
+    the datasets in the order returned by read_rows_in_merge_order.'''
+
+    dataset_rows = read_rows_in_merge_order(datasets, field_names)
+    value_count = len(field_names)
+    for row in merged_rows:
+        position, oid, values = next(dataset_rows, (None, None, None))
+        if values is None or list(row[len(row) - value_count:]) != values:
+            break
+        yield position, oid, row
+    else:
+        if next(dataset_rows, None) is None:
+            return
+    arcpy.AddError(u"The merged features are not stored in the order of the outputs they are merged from")
+    raise arcpy.ExecuteError
+
+def check_merged_oids(merged_output, datasets, field_names):
+    '''Raise arcpy.ExecuteError unless the ObjectIDs in merged_output and in each of the datasets merged into it start
+    at 1 without gaps, so that the ObjectID of a merged row is its ObjectID in its dataset plus the number of rows in
+    the previous datasets. The order of the merged rows is checked by comparing the values of field_names.'''
+
+    dataset_counts = [0] * len(datasets)
+    sql_clause = (None, "ORDER BY {0}".format(arcpy.Describe(merged_output).OIDFieldName))
+    with arcpy.da.SearchCursor(merged_output, ["OID@"] + list(field_names), sql_clause=sql_clause) as cursor:
+        for merged_oid, (position, oid, row) in enumerate(iter_merged_rows(cursor, datasets, field_names), 1):
+            dataset_counts[position] += 1
+            if row[0] != merged_oid or oid != dataset_counts[position]:
+                arcpy.AddError(u"The ObjectIDs of the features in {0} do not start at 1 without gaps".format(
+                               merged_output))
+                raise arcpy.ExecuteError
+
+def offset_merged_oid_fields(merged_output, datasets, field_names, referenced_output, referenced_datasets):
+    '''Update the fields in merged_output, which is merged from datasets, that store ObjectIDs of features in
+    referenced_output, which is merged from referenced_datasets in the same order. The values from each dataset are
+    offset by the number of features in the referenced datasets before the referenced dataset at the same position.
+    Raises arcpy.ExecuteError if the merged rows are not in the order of the datasets or if the ObjectIDs in
+    referenced_output do not start at 1 without gaps.'''
+
+    check_merged_oids(referenced_output, referenced_datasets, ["SHAPE@XY"])
+    referenced_counts = [int(arcpy.management.GetCount(dataset).getOutput(0)) for dataset in referenced_datasets]
+    offsets = np.cumsum([0] + referenced_counts[:-1])
+    sql_clause = (None, "ORDER BY {0}".format(arcpy.Describe(merged_output).OIDFieldName))
+    with arcpy.da.UpdateCursor(merged_output, field_names, sql_clause=sql_clause) as cursor:
+        for position, oid, row in iter_merged_rows(cursor, datasets, field_names):
+            cursor.updateRow([value + int(offsets[position]) if value is not None else None for value in row])
+
+def nearest_point_candidates(points, candidate_points, candidate_count, max_distance=None):
+    '''Return a sorted numpy array with the ObjectIDs of the features from candidate_points that are among the
+    candidate_count features nearest by straight-line distance to any feature from points. Features farther than
+    max_distance meters from every feature in points are not returned. Distances are measured along chords of a sphere
+    with the semi-minor axis of the WGS 1984 spheroid as the radius, which are shorter than the distance travelled
+    between the features.'''
+
+    radius = 6356752.3142
+    sr = arcpy.SpatialReference(4326)
+    def read_sphere_coordinates(input_points):
+        '''Return the ObjectIDs and the coordinates on the sphere of the features'''
+
+        features = arcpy.da.FeatureClassToNumPyArray(input_points, ["OID@", "SHAPE@X", "SHAPE@Y"], "", sr,
+                                                     skip_nulls=True)
+        longitudes = np.radians(features["SHAPE@X"].astype(np.float64))
+        latitudes = np.radians(features["SHAPE@Y"].astype(np.float64))
+        coordinates = np.column_stack((np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes),
+                                       np.sin(latitudes))) * radius
+        return features["OID@"], coordinates
+
+    candidate_oids, candidate_coordinates = read_sphere_coordinates(candidate_points)
+    point_oids, point_coordinates = read_sphere_coordinates(points)
+    tree = KDTree(candidate_coordinates)
+    if max_distance is None:
+        max_distance = float("inf")
+    selected = np.zeros(len(candidate_oids), dtype=bool)
+    for coordinates in point_coordinates:
+        selected[tree.query(coordinates, candidate_count, max_distance)] = True
+    return np.sort(candidate_oids[selected])
+
+def partition_inputs_by_region(extentPolygons, extentPolygonFields, points):
+    '''Partition the features from the point feature classes by the regions from the network dataset extent polygons.
+    Each feature is assigned to the region with the lowest rank that contains it. Returns a list of tuples with the
+    region name and a list with a numpy array of ObjectIDs for each point feature class, ordered by the rank of the
+    regions. Only regions that contain features from every point feature class are returned, as the features in
+    other regions cannot be solved. Also returns the number of features that are not in any returned region. Returns
+    an empty list if one region contains all the features.'''
+
+    extents = get_network_dataset_extents(extentPolygons, extentPolygonFields)
+    sr = extents.spatialReference
+    feature_count = 0
+    point_features = []
+    for input_points in points:
+        feature_count += int(arcpy.management.GetCount(input_points).getOutput(0))
+        features = arcpy.da.FeatureClassToNumPyArray(input_points, ["OID@", "SHAPE@X", "SHAPE@Y"], "", sr,
+                                                     skip_nulls=True)
+        point_features.append((features, features["SHAPE@X"].astype(np.float64),
+                               features["SHAPE@Y"].astype(np.float64)))
+    all_x = np.concatenate([x for features, x, y in point_features])
+    all_y = np.concatenate([y for features, x, y in point_features])
+    if any(extents.contains_all(region, all_x, all_y) for region in range(len(extents.rows))):
+        return [], 0
+
+    region_names = []
+    region_oids = {}
+    for point_index, (features, x, y) in enumerate(point_features):
+        assigned_regions = extents.assign(x, y)
+        #Regions with the same name are treated as one region
+        assigned_names = {}
+        for region in np.unique(assigned_regions):
+            if region != -1:
+                region_name = extents.rows[region][0]
+                assigned_names.setdefault(region_name, []).append(region)
+        for region_name, regions in assigned_names.iteritems():
+            if region_name not in region_oids:
+                region_names.append((min((extents.rows[region][3], region) for region in regions), region_name))
+                region_oids[region_name] = [np.empty(0, dtype=features["OID@"].dtype) for i in range(len(points))]
+            region_oids[region_name][point_index] = features["OID@"][np.in1d(assigned_regions, regions)]
+
+    partitions = []
+    partitioned_count = 0
+    for rank, region_name in sorted(region_names):
+        oids = region_oids[region_name]
+        if all(len(point_oids) for point_oids in oids):
+            partitions.append((region_name, oids))
+            partitioned_count += sum(len(point_oids) for point_oids in oids)
+    return partitions, feature_count - partitioned_count
+
+class RemoteToolboxRegistry(object):
+    '''Process wide registry of remote toolboxes added using arcpy.gp.addToolbox. A remote toolbox is added the first
+    time it is used and kept for later requests instead of being added and removed for every request. A toolbox is
+    checked at most once every health_check_interval seconds and is added again if its tool is no longer available
+    or if executing its tool failed. Remote toolboxes from different connection files can provide tools with the
+    same name. Such toolboxes are swapped when they are used, waiting until the tool is not being executed.'''
+
+    def __init__(self, health_check_interval):
+        '''Constructor'''
+
+        self.healthCheckInterval = health_check_interval
+        self.added = 0
+        self.executions = 0
+        #toolbox -> dict with the tool name, the time of the last check and whether the toolbox must be added again
+        self._toolboxes = {}
+        #tool name -> toolbox that provides the tool
+        self._owners = {}
+        #tool name -> number of requests executing the tool
+        self._inUse = {}
+        #tool names whose toolbox is being added
+        self._adding = set()
+        self._condition = threading.Condition()
+
+    def add(self, connection_file, service):
+        '''Add the remote toolbox if it is not already added and return the remote tool name and the toolbox path'''
+
+        #Get the service_name and task_name and task_alias from the service
+        service_name, task_name = service.split(";")
+        task_alias = service_name.split("/")[-1]
+        tbx = "{0};{1}".format(connection_file, service_name)
         remote_tool_name = u"{0}_{1}".format(task_name, task_alias)
+        self._ensure(tbx, remote_tool_name)
         return remote_tool_name, tbx
-    except Exception as ex:
-        raise arcpy.ExecuteError
 
-def execute_remote_tool(tbx, task_name, task_params):
-    '''Executes a remote GP tool and returns the result object from the tool execution. Removes the remote toolbox
-    after execution'''
-    tool = getattr(arcpy.gp, task_name)
-    result = tool(*task_params)
-    while result.status < 4:
-        time.sleep(1)
-    #Remove the toolbox
-    arcpy.gp.removeToolbox(tbx)
+    @contextlib.contextmanager
+    def lease(self, tbx, remote_tool_name):
+        '''Context manager that makes sure the toolbox provides the remote tool while the tool is executed. If the
+        execution raises an exception, the toolbox is added again the next time it is used.'''
+
+        self._ensure(tbx, remote_tool_name, lease=True)
+        try:
+            yield
+        except Exception:
+            with self._condition:
+                if tbx in self._toolboxes:
+                    self._toolboxes[tbx]["stale"] = True
+            raise
+        finally:
+            with self._condition:
+                self._inUse[remote_tool_name] -= 1
+                self._condition.notify_all()
+
+    def invalidate(self, tbx=None):
+        '''Mark a toolbox, or all toolboxes if a toolbox is not specified, to be added again when next used'''
+
+        with self._condition:
+            for toolbox in ([tbx] if tbx else self._toolboxes.keys()):
+                if toolbox in self._toolboxes:
+                    self._toolboxes[toolbox]["stale"] = True
+
+    def stats(self):
+        '''Return a dict with the number of times toolboxes were added, the number of tool executions and the number of
+        registered toolboxes'''
+
+        with self._condition:
+            return {"added": self.added, "executions": self.executions, "toolboxes": len(self._toolboxes)}
+
+    def _ensure(self, tbx, remote_tool_name, lease=False):
+        '''Add the toolbox if needed. If lease is True, the tool is counted as being executed once the toolbox
+        provides it. Adding a toolbox fetches the service metadata from the server, so the toolbox is added without
+        holding the condition lock. Only the requests for the same tool wait while the toolbox is added.'''
+
+        with self._condition:
+            while True:
+                if not remote_tool_name in self._adding:
+                    if not self._needsAdd(tbx, remote_tool_name):
+                        if lease:
+                            self._inUse[remote_tool_name] = self._inUse.get(remote_tool_name, 0) + 1
+                            self.executions += 1
+                        return
+                    #Wait until no request is executing the tool before replacing the toolbox that provides it
+                    if not self._inUse.get(remote_tool_name, 0):
+                        break
+                self._condition.wait()
+            #Reserve the tool so that other requests for it wait until the toolbox is added
+            self._adding.add(remote_tool_name)
+            owner = self._owners.pop(remote_tool_name, None)
+            if owner:
+                self._toolboxes.pop(owner, None)
+            self._toolboxes.pop(tbx, None)
+
+        try:
+            if owner:
+                self._remove(owner)
+            arcpy.gp.addToolbox(tbx)
+        except Exception as ex:
+            with self._condition:
+                self._adding.discard(remote_tool_name)
+                self._condition.notify_all()
+            raise arcpy.ExecuteError(u"Failed to add the remote toolbox {0}. {1}".format(tbx, ex))
+
+        with self._condition:
+            self._adding.discard(remote_tool_name)
+            self.added += 1
+            self._owners[remote_tool_name] = tbx
+            self._toolboxes[tbx] = {"toolName": remote_tool_name, "checkedAt": time.time(), "stale": False}
+            if lease:
+                self._inUse[remote_tool_name] = self._inUse.get(remote_tool_name, 0) + 1
+                self.executions += 1
+            self._condition.notify_all()
+
+    def _needsAdd(self, tbx, remote_tool_name):
+        '''Return True if the toolbox must be added before its tool can be used. Must be called with the condition
+        lock held.'''
+
+        toolbox = self._toolboxes.get(tbx)
+        if not toolbox or toolbox["stale"] or self._owners.get(remote_tool_name) != tbx:
+            return True
+        now = time.time()
+        if now - toolbox["checkedAt"] >= self.healthCheckInterval:
+            toolbox["checkedAt"] = now
+            if not hasattr(arcpy.gp, remote_tool_name):
+                return True
+        return False
+
+    def _remove(self, tbx):
+        '''Remove the toolbox from arcpy.gp. Called after the toolbox is removed from the registry.'''
+
+        try:
+            arcpy.gp.removeToolbox(tbx)
+        except Exception as ex:
+            pass
+
+##Process wide registry of remote toolboxes
+REMOTE_TOOLBOX_REGISTRY = RemoteToolboxRegistry(REMOTE_TOOLBOX_HEALTH_CHECK_INTERVAL)
+
+def add_remote_toolbox(connection_file, service):
+    '''Adds a remote toolbox using the ags connection file and returns the remote tool name and the path to the toolbox.
+    The remote tool name can be used with arcpy.gp to call the tool. The toolbox is kept in the remote toolbox registry
+    so that later requests do not have to add it again.'''
+
+    return REMOTE_TOOLBOX_REGISTRY.add(connection_file, service)
+
+def wait_for_result(result, timeout=None, poll_timings=None):
+    '''Wait for a result from a remote tool to finish. The status is checked after REMOTE_TOOL_INITIAL_POLL_INTERVAL
+    seconds and the interval is doubled after every check up to REMOTE_TOOL_MAX_POLL_INTERVAL seconds. Returns False
+    if the result has not finished within timeout seconds. If poll_timings is a list, a tuple with the seconds since
+    the start of the wait and the status is appended to it for every check.'''
+
+    if timeout is None:
+        timeout = REMOTE_TOOL_TIMEOUT
+    start_time = time.time()
+    poll_interval = REMOTE_TOOL_INITIAL_POLL_INTERVAL
+    while True:
+        status = result.status
+        elapsed_time = time.time() - start_time
+        if poll_timings is not None:
+            poll_timings.append((elapsed_time, status))
+        if status >= 4:
+            return True
+        if timeout > 0 and elapsed_time >= timeout:
+            return False
+        if timeout > 0:
+            poll_interval = min(poll_interval, timeout - elapsed_time)
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, REMOTE_TOOL_MAX_POLL_INTERVAL)
+
+def submit_remote_tool(tbx, task_name, task_params):
+    '''Submits a job to a remote GP tool and returns the result object without waiting for the job to finish. The
+    toolbox only needs to provide the tool while the job is submitted, so jobs for tools with the same name from
+    different remote toolboxes can run at the same time. Use wait_for_result to wait for the job.'''
+
+    with REMOTE_TOOLBOX_REGISTRY.lease(tbx, task_name):
+        tool = getattr(arcpy.gp, task_name)
+        return tool(*task_params)
+
+def execute_remote_tool(tbx, task_name, task_params, timeout=None, poll_timings=None):
+    '''Executes a remote GP tool and returns the result object from the tool execution. The remote toolbox is not
+    removed after execution so that it can be reused by later requests. The remote job is cancelled and an error is
+    raised if it does not finish within timeout seconds, which defaults to REMOTE_TOOL_TIMEOUT.'''
+
+    if timeout is None:
+        timeout = REMOTE_TOOL_TIMEOUT
+    #Wait for the job without holding the lease so that a timeout does not mark the toolbox to be added again and
+    #tools with the same name from other remote toolboxes are not blocked while the job runs
+    result = submit_remote_tool(tbx, task_name, task_params)
+    if not wait_for_result(result, timeout, poll_timings):
+        try:
+            result.cancel()
+        except Exception as ex:
+            pass
+        arcpy.AddError(u"The remote tool {0} did not finish within {1} seconds and was cancelled".format(task_name,
+                                                                                                         timeout))
+        raise arcpy.ExecuteError
     return result
 
+class ProcessToolResult(object):
+    '''Copy of the messages and outputs from a tool result that can be returned from a pool process. Provides the
+    members of an arcpy Result object that are used by the services.'''
+
+    def __init__(self, messages, outputs=(), max_severity=None):
+        '''Constructor. messages is a list of (severity, message) tuples.'''
+
+        self.messages = list(messages)
+        self.outputs = list(outputs)
+        self.messageCount = len(self.messages)
+        self.outputCount = len(self.outputs)
+        self.maxSeverity = max([severity for severity, message in self.messages] + [max_severity or 0])
+
+    @classmethod
+    def combine(cls, results, outputs=()):
+        '''Return a result with the messages from all the results and the outputs'''
+
+        return cls([message for result in results for message in result.messages], outputs,
+                   max(result.maxSeverity for result in results))
+
+    def getMessages(self, severity=None):
+        '''Return the messages with the severity separated by new lines. Return all the messages if severity is
+        None.'''
+
+        return u"\n".join(message for message_severity, message in self.messages
+                           if severity is None or message_severity == severity)
+
+    def getMessage(self, index):
+        '''Return the message at the index'''
+
+        return self.messages[index][1]
+
+    def getOutput(self, index):
+        '''Return the output at the index'''
+
+        return self.outputs[index]
+
+def execute_tool_in_process(tool_task):
+    '''Execute a tool in a pool process. tool_task is a tuple with the name of the tool, a dict of tool parameters
+    and the file geodatabase for the tool outputs, which is created if it does not exist. Returns a
+    ProcessToolResult.'''
+
+    tool_name, tool_parameters, output_workspace = tool_task
+    arcpy.CheckOutExtension("network")
+    try:
+        if not arcpy.Exists(output_workspace):
+            arcpy.management.CreateFileGDB(*os.path.split(output_workspace))
+        result = getattr(arcpy, tool_name)(**tool_parameters)
+    except arcpy.ExecuteError:
+        messages = [(arcpy.GetSeverity(i), arcpy.GetMessage(i)) for i in range(arcpy.GetMessageCount())]
+        return ProcessToolResult(messages, max_severity=2)
+    messages = [(result.getSeverity(i), result.getMessage(i)) for i in range(result.messageCount)]
+    outputs = [result.getOutput(i) for i in range(result.outputCount)]
+    return ProcessToolResult(messages, [output if isinstance(output, basestring) else unicode(output)
+                                        for output in outputs])
+
+def execute_tools_in_process_pool(tool_name, tool_parameters_list, output_workspaces, processes=0):
+    '''Execute a tool once for each dict of tool parameters in a pool of processes and return a ProcessToolResult
+    for each execution in the same order. Each execution writes its outputs to the file geodatabase at the same
+    position in output_workspaces. The pool uses one process per CPU if processes is 0. The tool parameters must not
+    refer to layers or in memory datasets as these are not available in the pool processes.'''
+
+    processes = min(processes or multiprocessing.cpu_count(), len(tool_parameters_list))
+    if os.name == "nt" and not os.path.basename(sys.executable).lower().startswith("python"):
+        #Within a server or desktop process, start the pool processes with the Python installed with ArcGIS
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(execute_tool_in_process, [(tool_name, tool_parameters, output_workspace)
+                                                  for tool_parameters, output_workspace in zip(tool_parameters_list,
+                                                                                               output_workspaces)],
+                        chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def split_restrictions(remote_tool_nds_restrictions, input_restrictions):
+    '''Return a tuple with the input restrictions that are supported by a remote tool and a tuple with the input
+    restrictions that are not supported. remote_tool_nds_restrictions is the filter list of the restriction
+    parameter on the remote tool.'''
+
+    remote_tool_nds_restrictions_set = set(remote_tool_nds_restrictions)
+    input_restrictions_set = set(input_restrictions)
+    return (tuple(input_restrictions_set.intersection(remote_tool_nds_restrictions_set)),
+            tuple(input_restrictions_set.difference(remote_tool_nds_restrictions_set)))
+
 def get_valid_restrictions_remote_tool(remote_tool_restriction_param, input_restrictions):
     '''Returns a list of restriction attribute names that are valid for a remote tool. Outputs a warning message
     if some of the input restrictions are not valid for use with remote tool.
@@ -210,33 +1759,78 @@ def get_valid_restrictions_remote_tool(remote_tool_restriction_param, input_rest
     input_restrictions is a list of restrictions that will be passed to the remote tool. if all input restrictions are 
     valid, then input_restrictions is returned as is.'''
 
-    remote_tool_nds_restrictions = remote_tool_restriction_param.filter.list
-    remote_tool_nds_restrictions_set = set(remote_tool_nds_restrictions)
-    input_restrictions_set = set(input_restrictions)
-    remote_tool_unsupported_restrictions = list(input_restrictions_set.difference(remote_tool_nds_restrictions_set))
+    restrictions = split_restrictions(remote_tool_restriction_param.filter.list, input_restrictions)
+    return get_supported_restrictions(restrictions, input_restrictions)
+
+def get_supported_restrictions(restrictions, input_restrictions):
+    '''Return the supported restrictions from the tuple returned by split_restrictions. Outputs a warning message
+    if some of the input restrictions are not supported.'''
+
+    remote_tool_input_restrictions, remote_tool_unsupported_restrictions = restrictions
     if remote_tool_unsupported_restrictions:
-        remote_tool_input_restrictions = list(input_restrictions_set.intersection(remote_tool_nds_restrictions_set))
         #add warning message for ignoring un-supported restrictions
         arcpy.AddIDMessage("WARNING", 30113, ", ".join(remote_tool_unsupported_restrictions))
-        return remote_tool_input_restrictions
+        return list(remote_tool_input_restrictions)
     else:
         return input_restrictions
 
+##Process wide caches of the filter lists of remote tool parameters and of the input restrictions that are supported
+##by a remote tool
+REMOTE_TOOL_PARAMETER_INFO_CACHE = TTLCache(REMOTE_TOOL_PARAMETER_INFO_CACHE_TTL)
+REMOTE_TOOL_RESTRICTIONS_CACHE = TTLCache(REMOTE_TOOL_PARAMETER_INFO_CACHE_TTL)
+
+def get_remote_tool_filter_lists(tbx, remote_tool_name):
+    '''Return a tuple with the filter list of each parameter of a remote tool from a toolbox added using
+    add_remote_toolbox. The filter lists are cached for the remote service so that the parameter info is not
+    requested for every execution.'''
+
+    key = (tbx, remote_tool_name)
+    filter_lists = REMOTE_TOOL_PARAMETER_INFO_CACHE.get(key)
+    if filter_lists is None:
+        #Make sure that the parameter info is read from the tool provided by this toolbox
+        with REMOTE_TOOLBOX_REGISTRY.lease(tbx, remote_tool_name):
+            remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
+        filter_lists = tuple(tuple(param.filter.list or ()) for param in remote_tool_param_info)
+        REMOTE_TOOL_PARAMETER_INFO_CACHE.set(key, filter_lists)
+    return filter_lists
+
+def get_valid_restrictions_remote_service(tbx, remote_tool_name, restriction_param_index, input_restrictions):
+    '''Returns a list of restriction attribute names that are valid for the restriction parameter at
+    restriction_param_index on a remote tool from a toolbox added using add_remote_toolbox. Outputs a warning
+    message if some of the input restrictions are not valid. The supported and unsupported restrictions are cached
+    for the remote service and the set of input restrictions.'''
+
+    key = (tbx, remote_tool_name, restriction_param_index, frozenset(input_restrictions))
+    restrictions = REMOTE_TOOL_RESTRICTIONS_CACHE.get(key)
+    if restrictions is None:
+        filter_lists = get_remote_tool_filter_lists(tbx, remote_tool_name)
+        restrictions = split_restrictions(filter_lists[restriction_param_index], input_restrictions)
+        REMOTE_TOOL_RESTRICTIONS_CACHE.set(key, restrictions)
+    return get_supported_restrictions(restrictions, input_restrictions)
+
 def get_rest_info():
     '''Return a dictionary containing rest/info response when running in ArcGIS Server context. Returns an empty
-    dictionary otherwise'''
+    dictionary otherwise. The response is cached for REST_INFO_CACHE_TTL seconds and must not be modified.'''
 
     rest_info = {}
     running_on_server = arcpy.GetInstallInfo().get('ProductName', "").lower() == 'server'
     if running_on_server:
-        try:
-            rest_info = make_http_request("http://localhost:6080/arcgis/rest/info")
-        except Exception as ex:
-            #try with https in case the server is configured as https only.
+        cached_rest_info = REST_INFO_CACHE.get("rest_info")
+        if cached_rest_info is not None:
+            return cached_rest_info
+        #Try the URL that worked last time first so that a https only server does not pay for a failed http request
+        ignore_ssl_errors_by_url = dict(LOCAL_REST_INFO_URLS)
+        for url in LOCAL_SERVER_CIRCUIT_BREAKER.order([url for url, ignore_ssl_errors in LOCAL_REST_INFO_URLS]):
             try:
-                rest_info = make_http_request("https://localhost:6443/arcgis/rest/info", ignore_ssl_errors=True)
+                rest_info = make_http_request(url, ignore_ssl_errors=ignore_ssl_errors_by_url[url])
             except Exception as ex:
+                LOCAL_SERVER_CIRCUIT_BREAKER.record_failure(url)
                 rest_info = {}
+                continue
+            LOCAL_SERVER_CIRCUIT_BREAKER.record_success(url)
+            rest_info = freeze_json(rest_info)
+            REST_INFO_CACHE.set("rest_info", rest_info)
+            break
     return rest_info
 
 def init_hostedgp():
@@ -254,15 +1848,31 @@ def init_hostedgp():
             arcpy.AddMessage("error function: {}, error message: {}".format(ex.func, ex.errmsg))
         return None
 
+def get_request_token():
+    '''Return the token used to make the current geoprocessing service request. Returns an empty string if the
+    request does not use a token or if not running as a geoprocessing service.'''
+
+    try:
+        return json.loads(arcpy.gp._arc_object.serverrequestproperties()).get("token", "")
+    except Exception as ex:
+        return ""
+
 def get_portal_self(hgp=None):
     '''Return a dictionary containing self response from a portal that the server federates to. Returns an empty
-    dictionary if not running on server or running on a non-federated server'''
+    dictionary if not running on server or running on a non-federated server. The response is cached per request
+    token for PORTAL_SELF_CACHE_TTL seconds and must not be modified.'''
 
     portal_self = {}
+    cache_key = get_request_token()
+    cached_portal_self = PORTAL_SELF_CACHE.get(cache_key)
+    if cached_portal_self is not None:
+        return cached_portal_self
     try:
         if not hgp:
             hgp = init_hostedgp()
-        portal_self = json.loads(hgp.GetSelf())
+        portal_self = freeze_json(json.loads(hgp.GetSelf()))
+        if portal_self:
+            PORTAL_SELF_CACHE.set(cache_key, portal_self)
     except Exception as ex:
         if LOG_LEVEL == logging.DEBUG:
             arcpy.AddMessage("An error occured when using hostedgp")
@@ -270,13 +1880,67 @@ def get_portal_self(hgp=None):
         portal_self = {}
     return portal_self
 
+def get_portal_org_and_culture(portal_self):
+    '''Return a tuple with the org id and the culture from a portal self response. The org id is an empty string if
+    it cannot be determined and the culture defaults to en.'''
+
+    org_id = ""
+    culture = "en"
+    if "id" in portal_self:
+        #OAuth and non-OAuth based user logins should have id property in portal self response
+        org_id = portal_self.get("id", "")
+        #Get the language defined for the user
+        if "user" in portal_self:
+            culture = portal_self["user"].get("culture","en")
+            #Some users in orgs can have null cultures. Use the culture defined for the org in such cases.
+            if not culture:
+                culture = portal_self.get("culture", "en")
+    elif "appInfo" in portal_self:
+        #This block should be executed only when app logins are used
+        app_info = portal_self["appInfo"]
+        org_id = app_info.get("orgId", "")
+        #If appInfo does not have a culture, use default en culture
+        culture = app_info.get("culture", "en")
+
+    #If for some reason we get a null culture, use en
+    if not culture:
+        culture = "en"
+    return org_id, culture
+
+def get_request_identity():
+    '''Return a tuple with the org id and the user name, or the app id for app logins, of the user making the current
+    request from the portal self response. The request token is used as the user if the portal self response does not
+    identify the user. Returns empty strings for anonymous requests.'''
+
+    portal_self = get_portal_self()
+    org_id = get_portal_org_and_culture(portal_self)[0]
+    user_name = ""
+    if "user" in portal_self:
+        user_name = portal_self["user"].get("username", "")
+    elif "appInfo" in portal_self:
+        user_name = portal_self["appInfo"].get("appId", "")
+    if not user_name:
+        user_name = get_request_token()
+    return org_id, user_name
+
+def invalidate_portal_travel_modes(org_id=None):
+    '''Remove the cached portal travel modes for an org. If an org id is not specified, remove the cached travel
+    modes for all orgs.'''
+
+    PORTAL_TRAVEL_MODES_CACHE.invalidate_if(lambda key: org_id is None or key[1] == org_id)
+
 def str_to_float(input_str):
     '''converts a string to a float'''
 
     #set the locale for all categories to the users default setting. This is required on some OS like German
-    #and Russian to read the appropriate decimal separator 
-
-    locale.setlocale(locale.LC_ALL, '')
+    #and Russian to read the appropriate decimal separator. The locale is process wide, so set it only once instead
+    #of on every call that could run concurrently with other requests.
+    global LOCALE_INITIALIZED
+    if not LOCALE_INITIALIZED:
+        with LOCALE_LOCK:
+            if not LOCALE_INITIALIZED:
+                locale.setlocale(locale.LC_ALL, '')
+                LOCALE_INITIALIZED = True
     try:
         return locale.atof(input_str)
     except UnicodeDecodeError:
@@ -291,6 +1955,216 @@ def str_to_float(input_str):
         else:
             raise
 
+def str_to_int(input_str, default=None):
+    '''converts a string containing a whole number to an int. Returns default if the string is empty or is not a
+    number.'''
+
+    if input_str is None or input_str == "":
+        return default
+    try:
+        return int(str_to_float(input_str))
+    except (ValueError, TypeError) as ex:
+        return default
+
+##Number of meters in the linear units used for the route line simplification tolerance
+LINEAR_UNIT_METERS = {
+    "millimeters": 0.001,
+    "centimeters": 0.01,
+    "decimeters": 0.1,
+    "meters": 1.0,
+    "kilometers": 1000.0,
+    "inches": 0.0254,
+    "feet": 0.3048,
+    "yards": 0.9144,
+    "miles": 1609.344,
+    "nauticalmiles": 1852.0,
+}
+
+def get_xy_tolerance(linear_unit, spatial_reference):
+    '''Convert a linear unit string such as "10 Meters" to the units of the spatial reference. For a geographic
+    spatial reference, the distance is converted to degrees along the equator. Returns None if the linear unit
+    cannot be converted.'''
+
+    try:
+        value, unit = linear_unit.strip().split(" ", 1)
+        value = str_to_float(value)
+    except (ValueError, AttributeError) as ex:
+        return None
+    unit = unit.strip().lower().replace(" ", "")
+    if spatial_reference.type == "Geographic":
+        if unit == "decimaldegrees":
+            return value
+        meters_per_unit = spatial_reference.semiMajorAxis * spatial_reference.radiansPerUnit
+    elif spatial_reference.type == "Projected":
+        meters_per_unit = spatial_reference.metersPerUnit
+    else:
+        return None
+    if not unit in LINEAR_UNIT_METERS or not meters_per_unit:
+        return None
+    return value * LINEAR_UNIT_METERS[unit] / meters_per_unit
+
+def simplify_line(coordinates, tolerance):
+    '''Return a boolean numpy array that is True for the vertices kept when the line given by the numpy array of
+    coordinates is simplified using the Douglas-Peucker algorithm. A vertex is kept if it is farther than tolerance
+    from the segment between the vertices kept before and after it. The first and the last vertex are always kept.
+    Only the first two columns of coordinates (x and y) are used.'''
+
+    vertex_count = len(coordinates)
+    keep = np.zeros(vertex_count, dtype=bool)
+    if vertex_count < 3:
+        keep.fill(True)
+        return keep
+    keep[0] = keep[-1] = True
+    x = coordinates[:, 0]
+    y = coordinates[:, 1]
+    tolerance_squared = tolerance * tolerance
+    segments = [(0, vertex_count - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+        #Distances from the vertices between start and end to the segment, computed for all the vertices at once
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        length_squared = dx * dx + dy * dy
+        if length_squared > 0:
+            t = np.clip((px * dx + py * dy) / length_squared, 0.0, 1.0)
+            px = px - t * dx
+            py = py - t * dy
+        distances_squared = px * px + py * py
+        farthest = int(np.argmax(distances_squared))
+        if distances_squared[farthest] > tolerance_squared:
+            vertex = start + 1 + farthest
+            keep[vertex] = True
+            segments.append((start, vertex))
+            segments.append((vertex, end))
+    return keep
+
+def generalize_lines(features, tolerance, use_numpy=None):
+    '''Simplify the line features in place using the Douglas-Peucker algorithm like arcpy.edit.Generalize. The
+    geometries are read and written as JSON in a single update cursor pass and the vertices of each path are
+    simplified with numpy. z and m values of the kept vertices are preserved. tolerance is a linear unit string
+    such as "10 Meters". arcpy.edit.Generalize is used unless use_numpy, which defaults to
+    NUMPY_LINE_GENERALIZATION, is True, or if the tolerance is not specified or cannot be converted to the units of
+    the spatial reference of the features.'''
+
+    if use_numpy is None:
+        use_numpy = NUMPY_LINE_GENERALIZATION
+    xy_tolerance = None
+    if tolerance and use_numpy:
+        xy_tolerance = get_xy_tolerance(tolerance, arcpy.Describe(features).spatialReference)
+    if xy_tolerance is None:
+        arcpy.edit.Generalize(features, tolerance)
+        return
+    with arcpy.da.UpdateCursor(features, ["SHAPE@JSON"]) as cursor:
+        for row in cursor:
+            if not row[0]:
+                continue
+            geometry = json.loads(row[0])
+            paths = geometry.get("paths")
+            if not paths or max(len(path) for path in paths) < 3:
+                continue
+            simplified_paths = []
+            for path in paths:
+                #null z or m values are read as nan and are not used for the simplification
+                keep = simplify_line(np.array(path, dtype=np.float64), xy_tolerance)
+                simplified_paths.append([vertex for vertex, keep_vertex in zip(path, keep) if keep_vertex])
+            geometry["paths"] = simplified_paths
+            cursor.updateRow([json.dumps(geometry)])
+
+def benchmark_generalize(features, tolerance, repeat=3):
+    '''Compare generalize_lines with arcpy.edit.Generalize on copies of the line features, such as the directions
+    or route edges from a solve, simplified with the tolerance. Returns a dict with the best time in seconds from
+    repeat runs and the number of vertices after simplification for each method, and the number of features whose
+    simplified geometries differ between the methods. Run this from a python window on a server with outputs from
+    real solves before setting NUMPY_LINE_GENERALIZATION.'''
+
+    def vertex_count(lines):
+        '''Return the total number of vertices in the line features'''
+
+        with arcpy.da.SearchCursor(lines, ["SHAPE@"]) as cursor:
+            return sum(row[0].pointCount for row in cursor if row[0])
+
+    methods = (("generalize_lines", lambda lines, tolerance: generalize_lines(lines, tolerance, True)),
+               ("Generalize", arcpy.edit.Generalize))
+    results = {}
+    simplified_lines = []
+    try:
+        for method_name, method in methods:
+            timings = []
+            for i in range(repeat):
+                lines = os.path.join("in_memory", "BenchmarkLines{0}".format(uuid.uuid4().hex))
+                arcpy.management.CopyFeatures(features, lines)
+                start_time = time.time()
+                method(lines, tolerance)
+                timings.append(time.time() - start_time)
+                if i < repeat - 1:
+                    arcpy.management.Delete(lines)
+            simplified_lines.append(lines)
+            results[method_name] = {"seconds": min(timings), "vertices": vertex_count(lines)}
+        results["input vertices"] = vertex_count(features)
+
+        #Compare the geometries simplified by each method feature by feature
+        different_count = 0
+        sql_clause = (None, "ORDER BY {0}".format(arcpy.Describe(simplified_lines[0]).OIDFieldName))
+        with arcpy.da.SearchCursor(simplified_lines[0], ["SHAPE@"], sql_clause=sql_clause) as first_cursor:
+            with arcpy.da.SearchCursor(simplified_lines[1], ["SHAPE@"], sql_clause=sql_clause) as second_cursor:
+                for (first_shape,), (second_shape,) in zip(first_cursor, second_cursor):
+                    if bool(first_shape) != bool(second_shape) or (first_shape and
+                                                                   not first_shape.equals(second_shape)):
+                        different_count += 1
+        results["different features"] = different_count
+    finally:
+        for lines in simplified_lines:
+            arcpy.management.Delete(lines)
+    return results
+
+class TableStatistics(object):
+    '''Statistics for a table or feature class collected in a single cursor pass. These are the row count, a
+    histogram of the values in each histogram field and the number of non null values in each count field. Use
+    GetCount instead when only the row count is needed.'''
+
+    def __init__(self, dataset, histogram_fields=(), count_fields=()):
+        '''Read the rows from the dataset and collect the statistics'''
+
+        self.count = 0
+        #field name -> dict of value -> number of rows with the value
+        self.histograms = dict((field_name, {}) for field_name in histogram_fields)
+        #field name -> number of rows with a non null value
+        self.nonNullCounts = dict((field_name, 0) for field_name in count_fields)
+
+        cursor_fields = list(histogram_fields) + list(count_fields)
+        histograms = [self.histograms[field_name] for field_name in histogram_fields]
+        count_field_positions = range(len(histograms), len(cursor_fields))
+        non_null_counts = [0] * len(count_fields)
+        if not cursor_fields:
+            cursor_fields.append("OID@")
+        with arcpy.da.SearchCursor(dataset, cursor_fields) as cursor:
+            for row in cursor:
+                self.count += 1
+                for histogram, value in zip(histograms, row):
+                    histogram[value] = histogram.get(value, 0) + 1
+                for i, position in enumerate(count_field_positions):
+                    if row[position] is not None:
+                        non_null_counts[i] += 1
+        self.nonNullCounts.update(zip(count_fields, non_null_counts))
+
+    def count_values(self, field_name, values, exclude=False):
+        '''Return the number of rows whose value in the histogram field is in values. If exclude is True, return the
+        number of rows with a non null value that is not in values.'''
+
+        histogram = self.histograms[field_name]
+        if exclude:
+            return sum(count for value, count in histogram.iteritems() if value is not None and not value in values)
+        return sum(histogram.get(value, 0) for value in values)
+
+def log_usage_metering(code, name, num_objects):
+    '''Record a usage metering message with the server'''
+
+    arcpy.gp._arc_object.LogUsageMetering(code, name, num_objects)
+
 class Logger(object):
     '''Log GP messages. If a log file is provided, log messages to the file.'''
 
@@ -377,7 +2251,7 @@ class NetworkAnalysisTool(object):
         
         #TODO: MAke this as static class attribute
         self.attributeParameterFields = ("AttributeName", "ParameterName", "ParameterValue")
-        self.parser = ConfigParser.SafeConfigParser()
+        self.ndsProperties = None
 
         #Store frequently used tool parameter indices as instance attributes. These must be overwritten in the derived
         #class 
@@ -471,10 +2345,10 @@ class NetworkAnalysisTool(object):
             config_file = os.path.join(supporting_files_folder_param_value, self.NETWORK_DATASET_PROPERTIES_FILENAME)
             if os.path.exists(config_file):
                 config_file_exists = True
-                self.parser.read(config_file)
+                self.ndsProperties = get_network_dataset_properties(config_file)
                 #Set the network datasets param value based on all the section names
                 if not self.networkDatasetsParam.valueAsText and not self.networkDatasetsParam.altered:
-                    self.networkDatasetsParam.values = [[section] for section in self.parser.sections()]
+                    self.networkDatasetsParam.values = [[section] for section in self.ndsProperties.sections()]
 
         #Remove any single quotes from network dataset names
         network_datasets_param_value = self.networkDatasetsParam.valueAsText
@@ -641,11 +2515,10 @@ class NetworkAnalysisTool(object):
         template_nds = networks[0]
 
         #Read template network dataset properties from the properties file
-        all_restrictions = self.parser.get(template_nds, "restrictions").split(";")
-        all_default_restrictions = self.parser.get(template_nds, "default_restrictions").split(";")
-        all_attr_params = self.parser.get(template_nds, "attribute_parameter_values")
-        all_attr_params = pickle.loads(all_attr_params)
-        all_travel_modes = pickle.loads(self.parser.get(template_nds, "travel_modes"))
+        all_restrictions = self.ndsProperties.get(template_nds, "restrictions").split(";")
+        all_default_restrictions = self.ndsProperties.get(template_nds, "default_restrictions").split(";")
+        all_attr_params = self.ndsProperties.get(template_nds, "attribute_parameter_values")
+        all_travel_modes = self.ndsProperties.get(template_nds, "travel_modes")
         if all_travel_modes:
             all_travel_modes = list({k[0] for k in all_travel_modes})
         else:
@@ -665,7 +2538,7 @@ class NetworkAnalysisTool(object):
 
         #Update tool parameters in custom travel mode category with values from default custom travel mode for
         #template network dataset layer
-        self._setTravelModeSettings(self.parser.get(template_nds, "default_custom_travel_mode"))
+        self._setTravelModeSettings(self.ndsProperties.get(template_nds, "default_custom_travel_mode"))
 
         return
 
@@ -898,6 +2771,8 @@ class NetworkAnalysisService(object):
     MAX_WALKING_MODE_DISTANCE_MILES = 50
     #Base classes should copy this list and provide correct value for thrid element
     EXTENT_FIELDS = ["RegionName", "RemoteConnection", "GPService", "Rank"]
+    #Services that can solve inputs spanning more than one region when MULTI_REGION_FAN_OUT is True
+    SUPPORTS_MULTI_REGION_FAN_OUT = False
 
     VRP_SERVICE_CAPABILITIES_KEYWORDS = {
         "maximumFeaturesAffectedByPointBarriers": "MAXIMUM POINT BARRIERS", 
@@ -946,6 +2821,8 @@ class NetworkAnalysisService(object):
 
         #names used by the instance
         self.logger = Logger(LOG_LEVEL)
+        #(code, name, number of objects) usage metering records recorded when the request is solved
+        self.usageMeteringRecords = []
 
         #Store parameters common to all services as instance attributes
 
@@ -977,6 +2854,21 @@ class NetworkAnalysisService(object):
         self.overrides = kwargs.get("Overrides", None)
         self.serviceCapabilities = kwargs.get("Service_Capabilities", None)
 
+        #In paged output mode, the offset of the first output feature to return is passed as resultOffset in the
+        #overrides. Remove it from the overrides passed to the solver.
+        self.toolParameters = kwargs
+        self.resultOffset = None
+        self.pagedOutputs = []
+        self.pagedResultSignature = None
+        if self._isPagedOutputMode() and self.overrides:
+            try:
+                overrides = json.loads(self.overrides)
+            except ValueError as ex:
+                overrides = None
+            if isinstance(overrides, dict) and "resultOffset" in overrides:
+                self.resultOffset = max(str_to_int(unicode(overrides.pop("resultOffset")), 0), 0)
+                self.overrides = json.dumps(overrides) if overrides else None
+
         #Derived outputs
         self.outputGeodatabase = kwargs.get("Output_Geodatabase", "in_memory")
         self.solveSucceeded = False
@@ -984,6 +2876,9 @@ class NetworkAnalysisService(object):
 
         #Other instance attributes
         self.toolResult = None
+        #Inputs and outputs for each region when the inputs in each region are solved separately
+        self.regionInputs = None
+        self.regionOutputs = []
         self.isCustomTravelMode = True if self.travelMode and self.travelMode.upper() == "CUSTOM" else False
         #Assume measurement units are time based for tools such as solve VRP that do not support measurement units
         self.isMeasurementUnitsTimeBased = True
@@ -991,10 +2886,11 @@ class NetworkAnalysisService(object):
             self.isMeasurementUnitsTimeBased = False
         self.supportedTravelModeNames = None
 
-        #Read the tool info from the tool info json file
-        with io.open(self.serviceCapabilities, "r", encoding="utf-8") as fp:
-            self.toolInfoJSON = json.loads(fp.read(), "utf-8")
+        #Read the tool info from the tool info json file. The parsed tool info is cached for the process and is
+        #read-only.
+        self.toolInfoJSON = TOOL_INFO_CACHE.get(self.serviceCapabilities)
         self.templateNDSDescription = self.toolInfoJSON["networkDataset"]
+        self.logger.debug(u"Tool info cache statistics: {0}".format(TOOL_INFO_CACHE.stats()))
 
         #Get the maximum records set for the service
         service_properties = json.loads(arcpy.gp._arc_object.serviceproperties())
@@ -1032,12 +2928,13 @@ class NetworkAnalysisService(object):
                     value = nau.convert_units(value, value_units, nds_attribute_units)
                     service_limits[value_limit_name] = str_to_float(value)
         
-        service_limits = self.toolInfoJSON["serviceLimits"][self.HELPER_SERVICES_KEY][tool_name]
+        #Copy the limits as the cached tool info is read-only and the limits are modified when converting units
+        service_limits = dict(self.toolInfoJSON["serviceLimits"][self.HELPER_SERVICES_KEY][tool_name])
         
         #Determine the distance and time attribute units
         if self.isCustomTravelMode:
-            distance_attribute_units = self.parser.get(self.templateNDS, "distance_attribute_units")
-            time_attribute_units = self.parser.get(self.templateNDS, "time_attribute_units")
+            distance_attribute_units = self.ndsProperties.get(self.templateNDS, "distance_attribute_units")
+            time_attribute_units = self.ndsProperties.get(self.templateNDS, "time_attribute_units")
         else:
             #Get units based on time and distance attribute from the travel mode
             nds_cost_attribute_units = {attr["name"] : attr["units"]
@@ -1085,18 +2982,22 @@ class NetworkAnalysisService(object):
             if self.analysisRegion in self.networkDatasets:
                 output_nds = self.analysisRegion
             else:
-                #Use the remote services
-                where_clause = "{0} = '{1}'".format(self.EXTENT_FIELDS[0], self.analysisRegion)
-                with arcpy.da.SearchCursor(self.networkDatasetExtents, self.EXTENT_FIELDS, where_clause) as cursor:
-                    row = cursor.next()
-                output_nds = row[0]
-                connection_file_name, service_name = row[2].split(";", 1)
-                desc_extent_layer = arcpy.Describe(self.networkDatasetExtents)
-                connection_file = os.path.join(os.path.dirname(os.path.dirname(desc_extent_layer.catalogPath)),
-                                               connection_file_name)
+                #Use the remote services. Regions are looked up by name from the cached extent polygons.
+                extents = get_network_dataset_extents(self.networkDatasetExtents, self.EXTENT_FIELDS)
+                if not self.analysisRegion in extents.regions:
+                    raise InputError(u"The analysis region {0} is not a valid region".format(self.analysisRegion))
+                output_nds, connection_file, service_name = extents.regions[self.analysisRegion]
         else:
             #use extent polygons 
             if self.networkDatasetExtents:
+                if MULTI_REGION_FAN_OUT and self.SUPPORTS_MULTI_REGION_FAN_OUT:
+                    self.regionInputs = self._partitionInputsByRegion(analysis_inputs)
+                if self.regionInputs:
+                    self.connectionFile = ""
+                    self.serviceName = ""
+                    self.outputNDS = u";".join(region_input[1] for region_input in self.regionInputs)
+                    self.logger.debug(u"Network datasets used for analysis: {0}".format(self.outputNDS))
+                    return
                 output_nds, connection_file, service_name = select_nds_extent_polygons(self.networkDatasetExtents,
                                                                                        self.EXTENT_FIELDS, 
                                                                                        analysis_inputs)
@@ -1108,8 +3009,192 @@ class NetworkAnalysisService(object):
         self.serviceName = service_name
         self.logger.debug(u"Network dataset used for analysis: {0}".format(self.outputNDS))
 
+    def _partitionInputsByRegion(self, analysis_inputs):
+        '''Return a list with a tuple for each region that contains features from all the analysis inputs. The tuple
+        has the region name, the network dataset name, the connection file, the GP service name and a feature layer
+        for each analysis input with the features in the region. Returns None if the inputs are not in more than one
+        region. Fails if the inputs in the regions cannot be solved independently of each other.'''
+
+        partitions, unassigned_count = partition_inputs_by_region(self.networkDatasetExtents, self.EXTENT_FIELDS,
+                                                                  analysis_inputs)
+        if len(partitions) < 2:
+            return None
+        #Solving each region separately gives the same results as solving all the inputs together only if no route
+        #can be found between the regions and no input is left out. Otherwise a closest facility across a region
+        #boundary or an OD line between regions would be missed.
+        extents = get_network_dataset_extents(self.networkDatasetExtents, self.EXTENT_FIELDS)
+        if unassigned_count or not extents.disjoint(set(region_name for region_name, input_oids in partitions)):
+            self.logger.debug(u"The inputs span regions that cannot be solved separately. {0} input features are not "
+                              u"in a region that contains the other inputs".format(unassigned_count))
+            arcpy.AddIDMessage("ERROR", 30140)
+            raise InputError
+        region_inputs = []
+        for region_name, input_oids in partitions:
+            output_nds, connection_file, service_name = extents.regions[region_name]
+            region_layers = []
+            for analysis_input, oids in zip(analysis_inputs, input_oids):
+                oid_field = arcpy.Describe(analysis_input).OIDFieldName
+                where_clause = u"{0} IN ({1})".format(arcpy.AddFieldDelimiters(analysis_input, oid_field),
+                                                      ",".join(str(oid) for oid in oids))
+                region_layer = "RegionInputs{0}".format(uuid.uuid4().hex)
+                arcpy.management.MakeFeatureLayer(analysis_input, region_layer, where_clause)
+                region_layers.append(region_layer)
+            region_inputs.append((region_name, os.path.basename(output_nds), connection_file, service_name,
+                                  region_layers))
+        return region_inputs
+
+    def _executeRegions(self, get_task_params, get_tool_parameters, remote_output_indices, local_output_indices,
+                        outputs, id_fields=None):
+        '''Solve the inputs in each region returned by _partitionInputsByRegion and merge the results into outputs.
+        Jobs for remote regions are submitted first so that they run at the same time as each other and as the
+        local regions, which are solved one after the other. get_task_params(remote_toolbox, remote_tool_name,
+        *region_inputs) returns the remote tool parameters and get_tool_parameters(network_dataset, *region_inputs,
+        output_suffix=suffix) returns the big button tool parameters for the inputs in a region. The output indices
+        give the position of the solve status followed by the position of each output in the tool result.
+        id_fields maps the position of an output in outputs to a list of tuples with a field name and the position
+        of the output whose ObjectIDs are stored in the field. The field values are updated to refer to the
+        features in the merged output.'''
+
+        remote_jobs = []
+        self.regionOutputs = []
+        try:
+            for region_name, network_dataset, connection_file, service_name, region_inputs in self.regionInputs:
+                if connection_file:
+                    self.logger.debug(u"Submitting {0} inputs to remote service {1} from {2}".format(region_name,
+                                      service_name, connection_file))
+                    remote_tool_name, remote_toolbox = add_remote_toolbox(connection_file, service_name)
+                    task_params = get_task_params(remote_toolbox, remote_tool_name, *region_inputs)
+                    result = submit_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                    remote_jobs.append((network_dataset, remote_tool_name, result))
+
+            for index, region_input in enumerate(self.regionInputs):
+                region_name, network_dataset, connection_file, service_name, region_inputs = region_input
+                if not connection_file:
+                    self.logger.debug(u"Solving {0} inputs using {1}".format(region_name, network_dataset))
+                    self._checkWalkingExtent(*region_inputs)
+                    tool_parameters = get_tool_parameters(network_dataset, *region_inputs,
+                                                          output_suffix="_{0}".format(index))
+                    self._executeBigButtonTool(tool_parameters)
+                    self.regionOutputs.append((network_dataset, self.toolResult,
+                                               [self.toolResult.getOutput(i) for i in local_output_indices]))
+
+            while remote_jobs:
+                network_dataset, remote_tool_name, result = remote_jobs[0]
+                if not wait_for_result(result):
+                    arcpy.AddError(u"The remote tool {0} did not finish within {1} seconds and was cancelled".format(
+                                   remote_tool_name, REMOTE_TOOL_TIMEOUT))
+                    raise arcpy.ExecuteError
+                remote_jobs.pop(0)
+                #report errors and exit in case the remote tool failed.
+                if result.maxSeverity == 2:
+                    error_messages = result.getMessages(1) + result.getMessages(2)
+                    raise InputError(error_messages)
+                self.regionOutputs.append((network_dataset, result,
+                                           [result.getOutput(i) for i in remote_output_indices]))
+        finally:
+            #Cancel the remote jobs that are still running if solving any region failed
+            for network_dataset, remote_tool_name, result in remote_jobs:
+                try:
+                    result.cancel()
+                except Exception as ex:
+                    pass
+            for region_input in self.regionInputs:
+                for region_layer in region_input[4]:
+                    arcpy.management.Delete(region_layer)
+
+        self.toolResult = self.regionOutputs[-1][1]
+        self.solveSucceeded = any(region_output[2][0].lower() == 'true' for region_output in self.regionOutputs)
+        for output_index, output in enumerate(outputs, 1):
+            arcpy.management.Merge([region_output[2][output_index] for region_output in self.regionOutputs], output)
+        for output_index, fields in (id_fields or {}).iteritems():
+            self._offsetMergedIDs(outputs, output_index, fields)
+        if self.saveLayerFile:
+            self.logger.warning("The network analysis layer is not saved when the inputs are solved in more than one "
+                                "region")
+
+    def _offsetMergedIDs(self, merged_outputs, output_index, fields):
+        '''Update the fields in the merged output at output_index that store ObjectIDs of features from other merged
+        outputs, given as a list of tuples with the field name and the position of the other output. The values for
+        the features from each region are offset by the number of features merged from the previous regions. Fails
+        if the merged outputs are not in the order of the regions or if the ObjectIDs of the other outputs do not
+        start at 1 without gaps.'''
+
+        #The first region output is the solve status
+        region_outputs = [region_output[2][1:] for region_output in self.regionOutputs]
+        merged_output = merged_outputs[output_index]
+        field_names = [field.name for field in arcpy.ListFields(merged_output)]
+        offsets = []
+        for field_name, referenced_output_index in fields:
+            if not field_name in field_names:
+                continue
+            referenced_outputs = [outputs[referenced_output_index] for outputs in region_outputs]
+            check_merged_oids(merged_outputs[referenced_output_index], referenced_outputs, ["SHAPE@XY"])
+            referenced_counts = [int(arcpy.management.GetCount(referenced_output).getOutput(0))
+                                 for referenced_output in referenced_outputs]
+            offsets.append((field_name, np.cumsum([0] + referenced_counts[:-1])))
+        if not offsets:
+            return
+        cursor_fields = [field_name for field_name, region_offsets in offsets]
+        oid_field = arcpy.Describe(merged_output).OIDFieldName
+        sql_clause = (None, "ORDER BY {0}".format(oid_field))
+        with arcpy.da.UpdateCursor(merged_output, cursor_fields, sql_clause=sql_clause) as cursor:
+            for region, oid, row in iter_merged_rows(cursor, [outputs[output_index] for outputs in region_outputs],
+                                                     cursor_fields):
+                cursor.updateRow([value + int(region_offsets[region]) if value is not None else None
+                                  for value, (field_name, region_offsets) in zip(row, offsets)])
+
+    @contextlib.contextmanager
+    def _processPoolWorkspace(self):
+        '''Create a folder in the scratch folder with a file geodatabase for the inputs solved in a pool of
+        processes. Yields the folder and the inputs geodatabase. The geodatabases in the folder are deleted on
+        exit.'''
+
+        folder = os.path.join(arcpy.env.scratchFolder, "ProcessPool{0}".format(uuid.uuid4().hex))
+        os.makedirs(folder)
+        try:
+            inputs_workspace = arcpy.management.CreateFileGDB(folder, "Inputs.gdb").getOutput(0)
+            yield folder, inputs_workspace
+        finally:
+            for workspace_name in os.listdir(folder):
+                workspace = os.path.join(folder, workspace_name)
+                if workspace_name.lower().endswith(".gdb") and arcpy.Exists(workspace):
+                    arcpy.management.Delete(workspace)
+
+    def _executeInProcessPool(self, tool_parameters, task_parameters, inputs_workspace, output_workspaces,
+                              processes=0):
+        '''Execute the big button tool in a pool of processes once for each dict in task_parameters, which holds the
+        parameters that differ from tool_parameters for an execution. The outputs from each execution are written to
+        the file geodatabase at the same position in output_workspaces. Returns a ProcessToolResult for each
+        execution and sets toolResult to a result with the messages from all the executions. Fails if any execution
+        failed.'''
+
+        #The pool processes cannot use the network dataset layer or inputs held in memory. Use the catalog path of
+        #the network dataset and save feature sets and record sets to the inputs workspace.
+        tool_parameters = dict(tool_parameters)
+        tool_parameters["Network_Dataset"] = arcpy.Describe(tool_parameters["Network_Dataset"]).catalogPath
+        tool_parameters["Save_Output_Network_Analysis_Layer"] = False
+        for param_name, param_value in tool_parameters.items():
+            if hasattr(param_value, "save"):
+                saved_value = os.path.join(inputs_workspace, param_name)
+                param_value.save(saved_value)
+                tool_parameters[param_name] = saved_value
+        tool_parameters_list = [dict(tool_parameters, **parameters) for parameters in task_parameters]
+        tool_results = execute_tools_in_process_pool(self.TOOL_NAME, tool_parameters_list, output_workspaces,
+                                                     processes)
+
+        #Fail if any execution failed
+        for tool_result in tool_results:
+            if tool_result.maxSeverity == 2:
+                self._logToolResultMessages(tool_result)
+        self.toolResult = ProcessToolResult.combine(tool_results)
+        if self.saveLayerFile:
+            self.logger.warning("The network analysis layer is not saved when the inputs are solved in a pool of "
+                                "processes")
+        return tool_results
+
     def _getNetworkDatasetProperties(self):
-        """Return the properties from all the network datasets as a ConfigParser object"""
+        """Read the properties for all the network datasets from the network dataset properties file. Write the file
+        if it does not exist."""
 
         def get_network_properties(network):
             '''returns a dict containing network dataset properties'''
@@ -1278,11 +3363,12 @@ class NetworkAnalysisService(object):
             return network_properties
         
         #Instance attributes set in this method
-        self.parser = None
+        self.ndsProperties = None
         self.templateNDS = ""
         
-        #Write the network dataset properties file if it does not exist
-        if not os.path.exists(self.networkDatasetPropertiesFile):
+        #Write the network dataset properties file if neither the file nor its JSON document exists
+        if not (os.path.exists(self.networkDatasetPropertiesFile) or
+                os.path.exists(get_nds_properties_json_file(self.networkDatasetPropertiesFile))):
             parser = ConfigParser.SafeConfigParser() 
             for network in self.networkDatasets:
                 network_props = get_network_properties(network)
@@ -1295,21 +3381,24 @@ class NetworkAnalysisService(object):
             with open(self.networkDatasetPropertiesFile, "w", 0) as config_file:
                 parser.write(config_file)
         
-        #return a parser object that has read the properties file
-        self.parser = ConfigParser.SafeConfigParser()
+        #The properties are parsed once per process and read again only if the file changes
         self.logger.debug("Reading network dataset properties from {0}".format(self.networkDatasetPropertiesFile))
-        self.parser.read(self.networkDatasetPropertiesFile)
-        self.templateNDS = self.parser.sections()[0]
+        self.ndsProperties = get_network_dataset_properties(self.networkDatasetPropertiesFile)
+        self.logger.debug("Network dataset properties cache: {0}".format(NDS_PROPERTIES_CACHE.stats()))
+        self.templateNDS = self.ndsProperties.templateNDS
 
-    def _getToolParametersFromNDSProperties(self):
-        '''Return a list of big button tool parameters whose values are stored in the network dataset properties file '''
+    def _getToolParametersFromNDSProperties(self, network_dataset=None):
+        '''Return a list of big button tool parameters whose values are stored in the network dataset properties file.
+        The properties are read for the network dataset used for the analysis if network_dataset is not given.'''
 
+        if network_dataset is None:
+            network_dataset = self.outputNDS
         #Get the time attribute, distance attribute and feature locator where clause from config file
         nds_property_values = [] 
         for prop in self.NDS_PROPERTY_NAMES:
             option = prop.lower()
-            if option in self.parser.options(self.outputNDS):
-                option_value = self.parser.get(self.outputNDS, option)
+            if option in self.ndsProperties.options(network_dataset):
+                option_value = self.ndsProperties.get(network_dataset, option)
                 nds_property_values.append((prop, option_value))
 
         return  nds_property_values
@@ -1359,23 +3448,39 @@ class NetworkAnalysisService(object):
                 travel_mode = self._getNDSTravelModeJSON(travel_mode_name)
                 return travel_mode
 
-            #Call GetTravelModes service using REST and get a dict of travel mode names and travel mode JSON
-            gp_server_request_props = json.loads(arcpy.gp._arc_object.serverrequestproperties())
-            token = gp_server_request_props.get("token", "")
-            referer = gp_server_request_props.get("referer", "")
-
-            get_travel_modes_url = u"{0}/GetTravelModes/execute".format(routing_utilities_url)
-            request_parameters = {"token" : token}
-
-            get_travel_modes_response = make_http_request(get_travel_modes_url, request_parameters, "gzip", referer)
-            result_rows = get_travel_modes_response["results"][0]["value"]["features"]
-            supported_travel_modes = {}
-            for row in result_rows:
-                attributes = row["attributes"]
-                travel_mode_json = attributes["TravelMode"]
-                self.supportedTravelModeNames.append(attributes["Name"])
-                supported_travel_modes[attributes["Name"].upper()] = travel_mode_json
-                supported_travel_modes[attributes["AltName"].upper()] = travel_mode_json 
+            #The travel modes returned by the portal are the same for all users in an org that use the same culture.
+            #So reuse the travel modes from an earlier request if possible.
+            org_id, culture = get_portal_org_and_culture(portal_self)
+            cache_key = (routing_utilities_url, org_id, culture)
+            cached_travel_modes = PORTAL_TRAVEL_MODES_CACHE.get(cache_key) if org_id else None
+            if cached_travel_modes is None:
+                #Call GetTravelModes service using REST and get a dict of travel mode names and travel mode JSON
+                gp_server_request_props = json.loads(arcpy.gp._arc_object.serverrequestproperties())
+                token = gp_server_request_props.get("token", "")
+                referer = gp_server_request_props.get("referer", "")
+
+                get_travel_modes_url = u"{0}/GetTravelModes/execute".format(routing_utilities_url)
+                request_parameters = {"token" : token}
+
+                get_travel_modes_response = make_http_request(get_travel_modes_url, request_parameters, "gzip",
+                                                              referer)
+                result_rows = get_travel_modes_response["results"][0]["value"]["features"]
+                supported_travel_mode_names = []
+                supported_travel_modes = {}
+                for row in result_rows:
+                    attributes = row["attributes"]
+                    travel_mode_json = attributes["TravelMode"]
+                    supported_travel_mode_names.append(attributes["Name"])
+                    supported_travel_modes[attributes["Name"].upper()] = travel_mode_json
+                    supported_travel_modes[attributes["AltName"].upper()] = travel_mode_json
+                cached_travel_modes = (tuple(supported_travel_mode_names), ReadOnlyDict(supported_travel_modes))
+                if org_id:
+                    PORTAL_TRAVEL_MODES_CACHE.set(cache_key, cached_travel_modes)
+            else:
+                self.logger.debug(u"Using cached portal travel modes for org {0} and culture {1}".format(org_id,
+                                                                                                     culture))
+            supported_travel_mode_names, supported_travel_modes = cached_travel_modes
+            self.supportedTravelModeNames = list(supported_travel_mode_names)
             travel_mode = supported_travel_modes.get(travel_mode_name.upper(), "")
         except Exception as ex:
             self.logger.warning("Failed to get a list of supported travel modes from the portal")
@@ -1399,14 +3504,14 @@ class NetworkAnalysisService(object):
         #Create a mapping of cost attributes from the network dataset and the values of impedance parameter
         #For all network datasets, assume the cost attributes to be same as those that are found in the first section
         impedance_parameter_mappings = {
-            "Drive Time" : self.parser.get(self.templateNDS, "time_attribute"),
-            "Truck Time" : self.parser.get(self.templateNDS, "truck_time_attribute"),
-            "Walk Time" : self.parser.get(self.templateNDS, "walk_time_attribute"),
-            "Travel Distance" : self.parser.get(self.templateNDS, "distance_attribute"),
+            "Drive Time" : self.ndsProperties.get(self.templateNDS, "time_attribute"),
+            "Truck Time" : self.ndsProperties.get(self.templateNDS, "truck_time_attribute"),
+            "Walk Time" : self.ndsProperties.get(self.templateNDS, "walk_time_attribute"),
+            "Travel Distance" : self.ndsProperties.get(self.templateNDS, "distance_attribute"),
         }
         #Get network dataset travel mode name
         #If the travel mode is JSON string pass the JSON to the big button tool
-        nds_travel_modes = pickle.loads(self.parser.get(self.templateNDS, "travel_modes"))
+        nds_travel_modes = self.ndsProperties.get(self.templateNDS, "travel_modes")
         self.portalTravelMode = nds_travel_modes.get((self.travelMode.upper(), self.isMeasurementUnitsTimeBased),
                                                      self.travelMode)
 
@@ -1439,8 +3544,8 @@ class NetworkAnalysisService(object):
         #distance based
         self.customTravelModeDistanceAttribute = impedance_parameter_mappings["Travel Distance"]
         self.customTravelModeTimeAttribute = impedance_parameter_mappings["Drive Time"]
-        self.walkingRestriction = self.parser.get(self.templateNDS, "walking_restriction")
-        trucking_restriction = self.parser.get(self.templateNDS, "trucking_restriction")
+        self.walkingRestriction = self.ndsProperties.get(self.templateNDS, "walking_restriction")
+        trucking_restriction = self.ndsProperties.get(self.templateNDS, "trucking_restriction")
         is_custom_travel_mode_impedance_time_based = False
         self.customTravelModeImpedanceAttribute = self.customTravelModeDistanceAttribute
         if self.impedance != "Travel Distance":
@@ -1449,7 +3554,7 @@ class NetworkAnalysisService(object):
             is_custom_travel_mode_impedance_time_based = True
 
         ##Check for failure conditions when using custom travel modes
-        non_walking_restrictions = self.parser.get(self.templateNDS, "non_walking_restrictions").split(";")
+        non_walking_restrictions = self.ndsProperties.get(self.templateNDS, "non_walking_restrictions").split(";")
         if self.isCustomTravelMode:
             #Fail if break units and impedance are not compatible
             if self.measurementUnits:
@@ -1494,21 +3599,146 @@ class NetworkAnalysisService(object):
                                int(self.MAX_WALKING_MODE_DISTANCE_MILES / self.METER_TO_MILES / 1000))
             raise InputError
     
-    def _checkMaxOutputFeatures(self, analysis_output, error_message_code=30142):
+    def _isPagedOutputMode(self):
+        '''Return True if outputs with more features than the maximum number of records that can be returned by the
+        service are returned in pages'''
+
+        return PAGED_OUTPUT_MODE
+
+    def _checkMaxOutputFeatures(self, analysis_output, error_message_code=30142, output_features_count=None):
         '''Check if the count of output features exceeds the maximum number of records that can be successfully 
-        returned by the service'''
+        returned by the service. In paged output mode, the output is returned in pages by _returnOutputPages
+        instead. The count of output features is read from the output if it is not given.'''
 
-        output_features_count = int(arcpy.management.GetCount(analysis_output).getOutput(0))
+        if output_features_count is None:
+            output_features_count = int(arcpy.management.GetCount(analysis_output).getOutput(0))
         if output_features_count > self.maxFeatures:
+            if self._isPagedOutputMode():
+                self.pagedOutputs.append(analysis_output)
+                return
             arcpy.AddIDMessage("ERROR", error_message_code, output_features_count, self.maxFeatures)
             raise arcpy.ExecuteError
 
+    def _getOutputPage(self, analysis_output):
+        '''Return a feature class in the scratch workspace with at most the maximum number of records that can be
+        returned by the service, starting at the result offset, from the analysis output'''
+
+        offset = self.resultOffset or 0
+        oids = np.sort(arcpy.da.FeatureClassToNumPyArray(analysis_output, ["OID@"])["OID@"])
+        page_oids = oids[offset:offset + self.maxFeatures]
+        oid_field = arcpy.AddFieldDelimiters(analysis_output, arcpy.Describe(analysis_output).OIDFieldName)
+        if len(page_oids):
+            where_clause = u"{0} >= {1} AND {0} <= {2}".format(oid_field, page_oids[0], page_oids[-1])
+        else:
+            where_clause = u"{0} < 0".format(oid_field)
+        output_page = os.path.join(arcpy.env.scratchGDB, "{0}Page{1}".format(os.path.basename(analysis_output),
+                                                                              uuid.uuid4().hex))
+        arcpy.analysis.Select(analysis_output, output_page, where_clause)
+        next_offset = offset + len(page_oids)
+        if next_offset < len(oids):
+            self.logger.warning(u"Returning features {0} to {1} of {2} from {3}. Use a resultOffset of {4} in the "
+                                u"overrides to get the next page".format(offset + 1, next_offset, len(oids),
+                                                                         os.path.basename(analysis_output),
+                                                                         next_offset))
+        else:
+            self.logger.info(u"Returning features {0} to {1} of {2} from {3}".format(offset + 1, next_offset,
+                                                                                   len(oids),
+                                                                                   os.path.basename(analysis_output)))
+        return output_page
+
+    def _returnOutputPages(self):
+        '''Replace the outputs with more features than the maximum number of records that can be returned by the
+        service with a page of their features. The solved outputs are kept in the paged results folder so that
+        requests for the other pages are returned by _loadPagedResult without solving again.'''
+
+        if not self.pagedOutputs:
+            return
+        outputs = {}
+        for output_name in self.PAGED_RESULT_OUTPUTS:
+            output = getattr(self, output_name)
+            outputs[output_name] = (output, output in self.pagedOutputs)
+        kept_outputs = save_paged_result(self._getPagedResultSignature(), self.solveSucceeded, outputs)
+        for output_name, (output, is_paged) in kept_outputs.iteritems():
+            if is_paged:
+                setattr(self, output_name, self._getOutputPage(output))
+
+    def _loadPagedResult(self):
+        '''Return True and set the outputs to the pages starting at the result offset if the request was solved by an
+        earlier request for another page. Returns False if the request must be solved. Usage is not metered for the
+        pages returned from an earlier solve, as the solve was metered for the same user when it was performed.'''
+
+        if not self._isPagedOutputMode() or self.resultOffset is None:
+            return False
+        paged_result = load_paged_result(self._getPagedResultSignature())
+        if paged_result is None:
+            return False
+        self.logger.debug(u"Returning output pages from an earlier solve kept in {0}".format(
+                          get_paged_results_folder()))
+        for output_name, (output, is_paged) in paged_result["outputs"].iteritems():
+            setattr(self, output_name, self._getOutputPage(output) if is_paged else output)
+        self.solveSucceeded = paged_result["solveSucceeded"]
+        return True
+
+    def _getPagedResultSignature(self):
+        '''Return the signature identifying a result returned in pages. It is computed from all the parameters
+        except the result offset and from the org and the user making the request, so that a kept result is only
+        returned to the user it was solved and metered for.'''
+
+        if self.pagedResultSignature is None:
+            tool_parameters = dict(self.toolParameters)
+            tool_parameters["Overrides"] = self.overrides
+            self.pagedResultSignature = get_request_signature(self.__class__.__name__, tool_parameters,
+                                                              get_request_identity())
+        return self.pagedResultSignature
+
+    def _checkEstimatedOutputFeatures(self, estimated_count):
+        '''Log a warning before solving if estimated_count, the number of output features estimated from the inputs
+        assuming that all the inputs are located and reachable, is more than the maximum number of records that can be
+        returned by the service. The estimate is not certain, so only _checkMaxOutputFeatures fails the request after
+        the solve. No warning is logged in paged output mode as such outputs are returned in pages.'''
+
+        if estimated_count > self.maxFeatures and not self._isPagedOutputMode():
+            self.logger.warning(u"The analysis can return {0} features which is more than the maximum of {1} "
+                                u"features that can be returned by the service".format(estimated_count,
+                                                                                      self.maxFeatures))
+
+    def _hasFieldValues(self, analysis_input, field_names):
+        '''Return True if any feature in the analysis input has a value for one of the fields. These fields, such as
+        Cutoff, override the analysis settings for a feature.'''
+
+        input_field_names = set(field.name.lower() for field in arcpy.ListFields(analysis_input))
+        field_names = [field_name for field_name in field_names if field_name.lower() in input_field_names]
+        if not field_names:
+            return False
+        where_clause = u" OR ".join(u"{0} IS NOT NULL".format(arcpy.AddFieldDelimiters(analysis_input, field_name))
+                                    for field_name in field_names)
+        with arcpy.da.SearchCursor(analysis_input, field_names, where_clause) as cursor:
+            for row in cursor:
+                return True
+        return False
+
+    def _recordUsageMetering(self):
+        '''Record the usage metering records added while solving the request with the server'''
+
+        records = self.usageMeteringRecords
+        self.usageMeteringRecords = []
+        for code, name, num_objects in records:
+            log_usage_metering(code, name, num_objects)
+
     def  _logToolExecutionMessages(self):
-        '''Log messages from execution of remote tool or big button tool'''
+        '''Log messages from execution of remote tool or big button tool. When the inputs in each region are solved
+        separately, log the messages from the tool executed for every region.'''
+
+        tool_results = [region_output[1] for region_output in self.regionOutputs] or [self.toolResult]
+        for tool_result in tool_results:
+            self._logToolResultMessages(tool_result)
 
-        result_severity = self.toolResult.maxSeverity
-        warning_messages = self.toolResult.getMessages(1)
-        error_messages = self.toolResult.getMessages(2)
+    def _logToolResultMessages(self, tool_result):
+        '''Log messages from a tool result'''
+
+        result_severity = tool_result.maxSeverity
+        warning_messages = tool_result.getMessages(1)
+        error_messages = tool_result.getMessages(2)
         #for remote tools executed synchronously, maxSeverity and getMessages is determined using arcpy
         if result_severity == -1:
             result_severity = arcpy.GetMaxSeverity()
@@ -1525,7 +3755,7 @@ class NetworkAnalysisService(object):
                 self.logger.warning(warning_messages)
         elif result_severity == 0:
             if self.logger.DEBUG:
-                info_messages = self.toolResult.getMessages()
+                info_messages = tool_result.getMessages()
                 if not info_messages:
                     #For remote tool executed synchoronously, get messages from arcpy
                     info_messages = arcpy.GetMessages()
@@ -1573,6 +3803,36 @@ class NetworkAnalysisService(object):
         else:
             self.logger.error("A python error occurred.")
 
+    def _executeRemoteTool(self, remote_toolbox, remote_tool_name, task_params):
+        '''Execute the remote tool and return the tool result. Log the time taken by the remote tool and the
+        status checks.'''
+
+        poll_timings = []
+        try:
+            return execute_remote_tool(remote_toolbox, remote_tool_name, task_params, poll_timings=poll_timings)
+        finally:
+            if self.logger.DEBUG and poll_timings:
+                self.logger.debug(u"{0} finished in {1:.3f} seconds after {2} status checks".format(remote_tool_name,
+                                  poll_timings[-1][0], len(poll_timings)))
+                self.logger.debug(u"Remote tool status checks (seconds, status): {0}".format(
+                    ", ".join("({0:.3f}, {1})".format(*timing) for timing in poll_timings)))
+
+    def _getRemoteOutput(self, output_index, local_output, requires_copy=False, is_table=False):
+        '''Return the output at output_index from the remote tool result to use as a service output. When
+        PASS_THROUGH_REMOTE_OUTPUTS is True, the path to the remote output is returned as is unless requires_copy is
+        True because the output is modified after the solve, for example when it is generalized. Otherwise the remote
+        output is copied to local_output and local_output is returned. Outputs returned as record sets instead of
+        paths are always copied.'''
+
+        remote_output = self.toolResult.getOutput(output_index)
+        if PASS_THROUGH_REMOTE_OUTPUTS and not requires_copy and isinstance(remote_output, basestring):
+            return remote_output
+        if is_table:
+            arcpy.management.CopyRows(remote_output, local_output)
+        else:
+            arcpy.management.CopyFeatures(remote_output, local_output)
+        return local_output
+
     def _executeBigButtonTool(self, tool_parameters):
         '''Execute the big button tool and return the tool result as an instance attribute'''
         
@@ -1602,6 +3862,9 @@ class FindRoutes(NetworkAnalysisService):
     }
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] =  "GPRouteService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputRoutes", "outputRouteEdges", "outputDirections", "outputStops", "outputLayer",
+                            "outputRouteData")
     #MAX_FEATURES = 1000000
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 14
     
@@ -1653,6 +3916,10 @@ class FindRoutes(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -1709,6 +3976,11 @@ class FindRoutes(NetworkAnalysisService):
                 arcpy.AddIDMessage("ERROR", 30134)
                 raise InputError
     
+            #Warn before solving if the directions can exceed the maximum number of records returned by the
+            #service. Every stop on a route has at least one directions feature.
+            if self.populateDirections:
+                self._checkEstimatedOutputFeatures(stop_count)
+
             #Determine the network dataset to use. If analysis region is specified use that as
             #the network dataset layer name
             self._selectNetworkDataset(self.stops)
@@ -1731,12 +4003,10 @@ class FindRoutes(NetworkAnalysisService):
 
                 #remove any unsupported restriction parameters when using a custom travel mode
                 if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param,
-                                                                                                                self.restrictions)
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
 
                 #report errors and exit in case the remote tool failed.
                 if self.toolResult.maxSeverity == 2:
@@ -1747,10 +4017,10 @@ class FindRoutes(NetworkAnalysisService):
                     solve_status = self.toolResult.getOutput(0)
                     if solve_status.lower() == 'true':
                         self.solveSucceeded = True
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(1), self.outputRoutes)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(2), self.outputRouteEdges)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(3), self.outputDirections)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(4), self.outputStops)
+                    self.outputRoutes = self._getRemoteOutput(1, self.outputRoutes)
+                    self.outputRouteEdges = self._getRemoteOutput(2, self.outputRouteEdges, self.populateRouteEdges)
+                    self.outputDirections = self._getRemoteOutput(3, self.outputDirections, self.populateDirections)
+                    self.outputStops = self._getRemoteOutput(4, self.outputStops)
                     self.outputLayer = self.toolResult.getOutput(5)
                     self.outputRouteData = self.toolResult.getOutput(6)
             else:
@@ -1771,30 +4041,36 @@ class FindRoutes(NetworkAnalysisService):
                 #Update time attribute and distance attribute when using custom travel mode. 
                 self._checkWalkingExtent(self.stops)
 
-                #Call the big button tool
-                self._executeBigButtonTool(tool_parameters)
-                
-                #get outputs from the result
-                solve_status = self.toolResult.getOutput(0)
-                if solve_status.lower() == 'true':
-                    self.solveSucceeded = True
-                self.outputRoutes = self.toolResult.getOutput(1)
-                self.outputRouteEdges = self.toolResult.getOutput(2)
-                self.outputDirections = self.toolResult.getOutput(3)
-                self.outputStops = self.toolResult.getOutput(4)
-                self.outputLayer = self.toolResult.getOutput(5)
-                self.outputRouteData = self.toolResult.getOutput(6)
+                #Split the stops by route name into batches if there are more routes than the batch size
+                route_batches = self._getRouteBatches(service_limits)
+                if route_batches:
+                    #Solve the batches in a pool of processes and merge the outputs
+                    self._executeBatches(tool_parameters, route_batches)
+                else:
+                    #Call the big button tool
+                    self._executeBigButtonTool(tool_parameters)
+                    
+                    #get outputs from the result
+                    solve_status = self.toolResult.getOutput(0)
+                    if solve_status.lower() == 'true':
+                        self.solveSucceeded = True
+                    self.outputRoutes = self.toolResult.getOutput(1)
+                    self.outputRouteEdges = self.toolResult.getOutput(2)
+                    self.outputDirections = self.toolResult.getOutput(3)
+                    self.outputStops = self.toolResult.getOutput(4)
+                    self.outputLayer = self.toolResult.getOutput(5)
+                    self.outputRouteData = self.toolResult.getOutput(6)
     
             #Fail if the count of features in route edges or directions exceeds the maximum number of records
             #returned by the service
             if self.populateDirections:
                 self._checkMaxOutputFeatures(self.outputDirections)
                 #Generalize the directions features
-                arcpy.edit.Generalize(self.outputDirections, self.routeLineSimplicationTolerance)
+                generalize_lines(self.outputDirections, self.routeLineSimplicationTolerance)
             if self.populateRouteEdges:
                 self._checkMaxOutputFeatures(self.outputRouteEdges, 30143)
                 #Generalize the route edges
-                arcpy.edit.Generalize(self.outputRouteEdges, self.routeLineSimplicationTolerance)
+                generalize_lines(self.outputRouteEdges, self.routeLineSimplicationTolerance)
             
             #Log messages from execution of remote or big button tool
             self._logToolExecutionMessages()
@@ -1808,8 +4084,14 @@ class FindRoutes(NetworkAnalysisService):
             else:
                 metering_task_name = "simple::Route"
             if num_objects:
-                arcpy.gp._arc_object.LogUsageMetering(5555, metering_task_name, num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects)    
+                self.usageMeteringRecords.append((5555, metering_task_name, num_objects))
+                self.usageMeteringRecords.append((9999, self.outputNDS, num_objects))
+
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
 
         except InputError as ex:
             self._handleInputErrorException(ex)
@@ -1820,6 +4102,93 @@ class FindRoutes(NetworkAnalysisService):
 
         return
 
+    def _getRouteBatches(self, service_limits):
+        '''Return a list with the ObjectIDs of the stops in each batch of routes when solving the routes in batches.
+        The routes are added to the batches in the order of their first stop. Returns an empty list if the routes
+        are not solved in batches. As each batch is within the maximum stops supported by the service, raise
+        InputError if there are more stops than the maximum before splitting them into batches. The routes are not
+        solved in batches if the route data or the network analysis layer is saved as there is no single output for
+        all the batches.'''
+
+        if not FIND_ROUTES_BATCHING or self.saveRouteData or self.saveLayerFile:
+            return []
+        if not "routename" in [field.name.lower() for field in arcpy.ListFields(self.stops)]:
+            return []
+        route_stops = {}
+        with arcpy.da.SearchCursor(self.stops, ["OID@", "RouteName"]) as cursor:
+            for oid, route_name in cursor:
+                route_stops.setdefault(route_name, []).append(oid)
+        if len(route_stops) <= FIND_ROUTES_BATCH_ROUTES:
+            return []
+        maximum_stops = int(service_limits.get("Maximum_Stops") or 0)
+        stop_count = sum(len(oids) for oids in route_stops.itervalues())
+        if maximum_stops and stop_count > maximum_stops:
+            raise InputError(u"The number of stops {0} exceeds the maximum of {1} stops supported by the "
+                             u"service".format(stop_count, maximum_stops))
+        batches = []
+        batch = []
+        batch_route_count = 0
+        for oids in sorted(route_stops.itervalues(), key=min):
+            if batch and batch_route_count == FIND_ROUTES_BATCH_ROUTES:
+                batches.append(batch)
+                batch = []
+                batch_route_count = 0
+            batch.extend(oids)
+            batch_route_count += 1
+        batches.append(batch)
+        return batches if len(batches) > 1 else []
+
+    def _executeBatches(self, tool_parameters, route_batches):
+        '''Solve the stops in each batch of routes in a pool of processes against the same network dataset. The routes,
+        route edges, directions and stops from the batches are merged into the outputs in the order of the batches.
+        The ORIG_FID values of the output stops refer to the input stops and the RouteID and Route*OID values of the
+        other outputs refer to the merged routes.'''
+
+        with self._processPoolWorkspace() as (batches_folder, inputs_workspace):
+            stop_batches = write_feature_subsets(self.stops, inputs_workspace, "Stops", route_batches)
+            batch_workspaces = [os.path.join(batches_folder, "Batch{0}.gdb".format(index))
+                                for index in range(len(stop_batches))]
+            batch_parameters = [{"Stops": stop_batch, "Output_Geodatabase": batch_workspace}
+                                for stop_batch, batch_workspace in zip(stop_batches, batch_workspaces)]
+            self.logger.debug(u"Solving routes in {0} batches".format(len(stop_batches)))
+            batch_results = self._executeInProcessPool(tool_parameters, batch_parameters, inputs_workspace,
+                                                       batch_workspaces, FIND_ROUTES_BATCH_PROCESSES)
+            self.solveSucceeded = any(batch_result.getOutput(0).lower() == 'true' for batch_result in batch_results)
+
+            #The stops in a batch are stored in ObjectID order
+            for oids, batch_result in zip(route_batches, batch_results):
+                batch_stops = batch_result.getOutput(4)
+                if "ORIG_FID" in [field.name for field in arcpy.ListFields(batch_stops)]:
+                    oids = sorted(oids)
+                    with arcpy.da.UpdateCursor(batch_stops, ["ORIG_FID"]) as cursor:
+                        for row in cursor:
+                            if row[0]:
+                                cursor.updateRow([oids[row[0] - 1]])
+
+            outputs = [self.outputRoutes, self.outputRouteEdges, self.outputDirections, self.outputStops]
+            for output_index, output in enumerate(outputs, 1):
+                batch_outputs = [batch_result.getOutput(output_index) for batch_result in batch_results]
+                if all(batch_outputs):
+                    arcpy.management.Merge(batch_outputs, output)
+                else:
+                    outputs[output_index - 1] = ""
+            self.outputRoutes, self.outputRouteEdges, self.outputDirections, self.outputStops = outputs
+
+            #Offset the ObjectIDs of the routes stored in the other outputs by the number of routes in the previous
+            #batches
+            if self.outputRoutes:
+                batch_routes = [batch_result.getOutput(1) for batch_result in batch_results]
+                for output_index, output in enumerate(outputs[1:], 2):
+                    if not output:
+                        continue
+                    route_id_fields = [field.name for field in arcpy.ListFields(output)
+                                       if field.name.lower() == "routeid" or
+                                       fnmatch.fnmatch(field.name.lower(), "route*oid")]
+                    if route_id_fields:
+                        offset_merged_oid_fields(output, [batch_result.getOutput(output_index)
+                                                          for batch_result in batch_results],
+                                                 route_id_fields, self.outputRoutes, batch_routes)
+
 class FindClosestFacilities(NetworkAnalysisService):
     '''FindClosestFacilities geoprocessing service'''
 
@@ -1837,8 +4206,11 @@ class FindClosestFacilities(NetworkAnalysisService):
     }
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] = "GPClosestFacilityService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputRoutes", "outputDirections", "outputFacilities", "outputLayer", "outputRouteData")
     #MAX_FEATURES = 1000000
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 14
+    SUPPORTS_MULTI_REGION_FAN_OUT = True
     
     TOOL_NAME = "FindClosestFacilities_na"
     HELPER_SERVICES_KEY = "asyncClosestFacility"
@@ -1894,6 +4266,10 @@ class FindClosestFacilities(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -1908,15 +4284,10 @@ class FindClosestFacilities(NetworkAnalysisService):
             constant_params = [('Maximum_Snap_Tolerance', '20 Kilometers'),
                                ('Accumulate_Attributes', []),
                                ('Output_Geodatabase', self.outputGeodatabase),
-                               ('Output_Routes_Name', self.OUTPUT_ROUTES_NAME),
-                               ('Output_Directions_Name', self.OUTPUT_DIRECTIONS_NAME),
-                               ('Output_Closest_Facilities_Name', self.OUTPUT_FACILITIES_NAME),
                                ]
 
             #Create a list of user defined parameter names and their values
-            user_parameters = [('Facilities', self.facilities),
-                               ('Incidents', self.incidents),
-                               ('Measurement_Units', self.measurementUnits),
+            user_parameters = [('Measurement_Units', self.measurementUnits),
                                ('Number_of_Facilities_to_Find', self.facilitiesToFind),
                                ('Travel_Direction', self.TRAVEL_DIR_KEYWORDS[self.travelDirection]),
                                ('Default_Cutoff', self.cutoff),
@@ -1950,18 +4321,11 @@ class FindClosestFacilities(NetworkAnalysisService):
                 arcpy.AddIDMessage("ERROR", 30125)
                 raise InputError
 
-            #Determine the network dataset to use. If analysis region is specified use that as
-            #the network dataset layer name
-            self._selectNetworkDataset(self.incidents, self.facilities)
-
-            if self.connectionFile:
-                #Add remote tool
-                self.logger.debug(u"Adding remote service {0} from {1}".format(self.serviceName, self.connectionFile))
-                remote_tool_name, remote_toolbox = add_remote_toolbox(self.connectionFile, self.serviceName)
+            def get_task_params(remote_toolbox, remote_tool_name, incidents, facilities):
+                '''Return the parameter values for the remote tool'''
 
-                #specify parameter values for the remote tool
                 #need to pass boolean values for boolean parameters when calling the remote service
-                task_params = [self.incidents, self.facilities, self.measurementUnits, "#", self.facilitiesToFind,
+                task_params = [incidents, facilities, self.measurementUnits, "#", self.facilitiesToFind,
                                self.cutoff, self.travelDirection, self.useHierarchy, self.timeOfDay,
                                self.timeOfDayUsage, self.uTurnAtJunctions, self.pointBarriers, self.lineBarriers,
                                self.polygonBarriers, "#", self.attributeParameterValues, self.routeShape,
@@ -1972,12 +4336,58 @@ class FindClosestFacilities(NetworkAnalysisService):
 
                 #remove any unsupported restriction parameters when using a custom travel mode
                 if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param,
-                                                                                                                self.restrictions)
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
+                return task_params
+
+            def get_tool_parameters(network_dataset, incidents, facilities, output_suffix=""):
+                '''Return a dict with the big button tool parameters'''
+
+                #Add the network dataset that we wish to use.    
+                network_parameters = [("Network_Dataset", network_dataset), ("Facilities", facilities),
+                                      ("Incidents", incidents)]
+                output_names = [('Output_Routes_Name', self.OUTPUT_ROUTES_NAME + output_suffix),
+                                ('Output_Directions_Name', self.OUTPUT_DIRECTIONS_NAME + output_suffix),
+                                ('Output_Closest_Facilities_Name', self.OUTPUT_FACILITIES_NAME + output_suffix)]
+        
+                #Get the time attribute, distance attribute and feature locator where clause from config file
+                nds_property_values = self._getToolParametersFromNDSProperties(network_dataset)
+        
+                #Create a dict that contains all the tool parameters
+                tool_parameters = dict(nds_property_values + constant_params + user_parameters + network_parameters +
+                                       output_names)
+                tool_parameters.update(service_limits)
+                #Update time attribute and distance attribute when using custom travel mode. 
+                if self.isCustomTravelMode:
+                    tool_parameters["Time_Attribute"] = self.customTravelModeTimeAttribute
+                    tool_parameters["Distance_Attribute"] = self.customTravelModeDistanceAttribute
+                return tool_parameters
+
+            #Determine the network dataset to use. If analysis region is specified use that as
+            #the network dataset layer name
+            self._selectNetworkDataset(self.incidents, self.facilities)
+
+            #Warn before solving if the directions can exceed the maximum number of records returned by the
+            #service. Every route has at least a start and an end directions feature.
+            if self.populateDirections:
+                route_count = incident_count * min(str_to_int(self.facilitiesToFind) or 1, facility_count)
+                self._checkEstimatedOutputFeatures(2 * route_count)
+
+            if self.regionInputs:
+                #Solve the inputs in each region separately and merge the results
+                self._executeRegions(get_task_params, get_tool_parameters, [2, 0, 1, 3], [0, 1, 2, 3],
+                                     [self.outputRoutes, self.outputDirections, self.outputFacilities])
+
+            elif self.connectionFile:
+                #Add remote tool
+                self.logger.debug(u"Adding remote service {0} from {1}".format(self.serviceName, self.connectionFile))
+                remote_tool_name, remote_toolbox = add_remote_toolbox(self.connectionFile, self.serviceName)
+
+                #specify parameter values for the remote tool
+                task_params = get_task_params(remote_toolbox, remote_tool_name, self.incidents, self.facilities)
+
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
 
                 #report errors and exit in case the remote tool failed.
                 if self.toolResult.maxSeverity == 2:
@@ -1988,32 +4398,28 @@ class FindClosestFacilities(NetworkAnalysisService):
                     solve_status = self.toolResult.getOutput(2)
                     if solve_status.lower() == 'true':
                         self.solveSucceeded = True
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(0), self.outputRoutes)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(1), self.outputDirections)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(3), self.outputFacilities)
+                    self.outputRoutes = self._getRemoteOutput(0, self.outputRoutes)
+                    self.outputDirections = self._getRemoteOutput(1, self.outputDirections, self.populateDirections)
+                    self.outputFacilities = self._getRemoteOutput(3, self.outputFacilities)
                     self.outputLayer = self.toolResult.getOutput(4)
                     self.outputRouteData = self.toolResult.getOutput(5) 
             
             else:
         
-                #Add the network dataset that we wish to use.    
-                user_parameters.append(("Network_Dataset", self.outputNDS))
-        
-                #Get the time attribute, distance attribute and feature locator where clause from config file
-                nds_property_values = self._getToolParametersFromNDSProperties()
-        
-                #Create a dict that contains all the tool parameters and call the tool.
-                tool_parameters = dict(nds_property_values + constant_params + user_parameters)
-                tool_parameters.update(service_limits)
-                if self.isCustomTravelMode:
-                    tool_parameters["Time_Attribute"] = self.customTravelModeTimeAttribute
-                    tool_parameters["Distance_Attribute"] = self.customTravelModeDistanceAttribute
+                #Pass only the facilities that can be closest to an incident to the solver
+                facilities = self._getCandidateFacilities(facility_count)
+                try:
+                    tool_parameters = get_tool_parameters(self.outputNDS, self.incidents, facilities)
 
-                #Update time attribute and distance attribute when using custom travel mode. 
-                self._checkWalkingExtent(self.incidents, self.facilities)
+                    #enforce walking travel mode extent constraint
+                    self._checkWalkingExtent(self.incidents, self.facilities)
 
-                #Call the big button tool
-                self._executeBigButtonTool(tool_parameters)
+                    #Call the big button tool
+                    self._executeBigButtonTool(tool_parameters)
+                finally:
+                    #Delete the layer with the candidate facilities even if the solve failed
+                    if facilities is not self.facilities:
+                        arcpy.management.Delete(facilities)
                 
                 #get outputs from the result
                 solve_status = self.toolResult.getOutput(0)
@@ -2029,7 +4435,7 @@ class FindClosestFacilities(NetworkAnalysisService):
             if self.populateDirections:
                 self._checkMaxOutputFeatures(self.outputDirections)
                 #Generalize the directions features
-                arcpy.edit.Generalize(self.outputDirections, self.routeLineSimplicationTolerance)
+                generalize_lines(self.outputDirections, self.routeLineSimplicationTolerance)
             
             
             #Log messages from execution of remote or big button tool
@@ -2037,10 +4443,23 @@ class FindClosestFacilities(NetworkAnalysisService):
             
             #Add metering and royalty messages
             #numObjects = number of routes           
-            num_objects = int(arcpy.management.GetCount(self.outputRoutes).getOutput(0))            
+            if self.regionOutputs:
+                nds_objects = [(network_dataset, int(arcpy.management.GetCount(outputs[1]).getOutput(0)))
+                               for network_dataset, tool_result, outputs in self.regionOutputs]
+            else:
+                nds_objects = [(self.outputNDS, int(arcpy.management.GetCount(self.outputRoutes).getOutput(0)))]
+            num_objects = sum(nds_num_objects for network_dataset, nds_num_objects in nds_objects)
             if num_objects:
-                arcpy.gp._arc_object.LogUsageMetering(5555, self.__class__.__name__, num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects)
+                self.usageMeteringRecords.append((5555, self.__class__.__name__, num_objects))
+                for network_dataset, nds_num_objects in nds_objects:
+                    if nds_num_objects:
+                        self.usageMeteringRecords.append((9999, network_dataset, nds_num_objects))
+
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
 
         except InputError as ex:
             self._handleInputErrorException(ex)
@@ -2051,6 +4470,47 @@ class FindClosestFacilities(NetworkAnalysisService):
 
         return
 
+    def _getCandidateFacilities(self, facility_count):
+        '''Return a feature layer with the facilities that are among the nearest facilities by straight-line distance
+        to an incident and are within the cutoff from an incident. The facilities keep their ObjectIDs so that the
+        FacilityOID values in the outputs refer to the input facilities. Facilities that are not candidates are
+        missing from the output facilities. Returns the facilities if all of them are candidates or if the facilities
+        are not filtered.'''
+
+        if not CLOSEST_FACILITY_PREFILTER:
+            return self.facilities
+
+        #Use the largest number of facilities to find for any incident
+        facilities_to_find = str_to_int(self.facilitiesToFind) or 1
+        if self._hasFieldValues(self.incidents, ["TargetFacilityCount"]):
+            with arcpy.da.SearchCursor(self.incidents, ["TargetFacilityCount"]) as cursor:
+                facilities_to_find = max([facilities_to_find] + [row[0] for row in cursor if row[0]])
+        candidate_count = facilities_to_find * CLOSEST_FACILITY_PREFILTER_FACTOR
+
+        #The cutoff limits the straight-line distance only if it is not overridden for some incidents or facilities
+        max_distance = None
+        if self.cutoff and not (self._hasFieldValues(self.incidents, ["Cutoff"]) or
+                                self._hasFieldValues(self.facilities, ["Cutoff"])):
+            if self.measurementUnits.lower() in self.TIME_UNITS:
+                cutoff_hours = str_to_float(nau.convert_units(self.cutoff, self.measurementUnits, "Hours"))
+                max_distance = cutoff_hours * CLOSEST_FACILITY_PREFILTER_MAXIMUM_SPEED * 1000
+            else:
+                max_distance = str_to_float(nau.convert_units(self.cutoff, self.measurementUnits, "Meters"))
+        if max_distance is None and candidate_count >= facility_count:
+            return self.facilities
+
+        candidate_oids = nearest_point_candidates(self.incidents, self.facilities, candidate_count, max_distance)
+        if len(candidate_oids) == 0 or len(candidate_oids) == facility_count:
+            return self.facilities
+        self.logger.debug(u"Solving {0} of {1} facilities that are nearest to the incidents".format(
+                          len(candidate_oids), facility_count))
+        oid_field = arcpy.Describe(self.facilities).OIDFieldName
+        where_clause = u"{0} IN ({1})".format(arcpy.AddFieldDelimiters(self.facilities, oid_field),
+                                              ",".join(str(oid) for oid in candidate_oids))
+        candidate_facilities = "CandidateFacilities{0}".format(uuid.uuid4().hex)
+        arcpy.management.MakeFeatureLayer(self.facilities, candidate_facilities, where_clause)
+        return candidate_facilities
+
 class GenerateServiceAreas(NetworkAnalysisService):
     '''GenerateServiceAreas geoprocessing service'''
 
@@ -2065,6 +4525,8 @@ class GenerateServiceAreas(NetworkAnalysisService):
     }
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] = "GPServiceAreaService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputServiceAreas", "outputLayer")
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 16
     #Use this factor to convert max break time and max break distance to the max time and distance for detailed polygons
     MAX_DETAILED_POLYGONS_FACTOR = 0.05
@@ -2109,6 +4571,10 @@ class GenerateServiceAreas(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -2188,10 +4654,10 @@ class GenerateServiceAreas(NetworkAnalysisService):
                     raise InputError
                 #Find the largest break value.
                 if self.measurementUnits.lower() in self.TIME_UNITS:
-                    impedance_unit = self.parser.get(self.templateNDS, "time_attribute_units")
+                    impedance_unit = self.ndsProperties.get(self.templateNDS, "time_attribute_units")
                     is_impedance_time_based = True 
                 else:
-                    impedance_unit = self.parser.get(self.templateNDS, "distance_attribute_units")
+                    impedance_unit = self.ndsProperties.get(self.templateNDS, "distance_attribute_units")
                     is_impedance_time_based = False
                 converted_break_value_list = nau.convert_units(break_value_list, self.measurementUnits, impedance_unit)
                 convereted_end_break_value = max([str_to_float(val) for val in converted_break_value_list])
@@ -2230,12 +4696,10 @@ class GenerateServiceAreas(NetworkAnalysisService):
         
                 #remove any unsupported restriction parameters
                 if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param,
-                                                                                                                self.restrictions)
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
                 #report errors and exit in case the remote tool failed.
                 if self.toolResult.maxSeverity == 2:
                     self.solveSucceeded = False
@@ -2244,7 +4708,7 @@ class GenerateServiceAreas(NetworkAnalysisService):
                 else:
                     #Save the results
                     self.solveSucceeded = True
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(0), self.outputServiceAreas)
+                    self.outputServiceAreas = self._getRemoteOutput(0, self.outputServiceAreas)
                     self.outputLayer = self.toolResult.getOutput(2)
         
             else:
@@ -2263,8 +4727,14 @@ class GenerateServiceAreas(NetworkAnalysisService):
                     tool_parameters["Time_Attribute"] = self.customTravelModeTimeAttribute
                     tool_parameters["Distance_Attribute"] = self.customTravelModeDistanceAttribute
  
-                #Call the big button tool
-                self._executeBigButtonTool(tool_parameters)
+                #Split the facilities into chunks if there are more facilities than the chunk size
+                chunk_size = self._getChunkSize(facility_count, service_limits)
+                if chunk_size:
+                    #Solve the chunks in a pool of processes and merge the polygons
+                    self._executeChunks(tool_parameters, chunk_size)
+                else:
+                    #Call the big button tool
+                    self._executeBigButtonTool(tool_parameters)
     
             #Fail if the count of features in output service areas exceeds the maximum number of records returned by 
             #the service
@@ -2298,10 +4768,16 @@ class GenerateServiceAreas(NetworkAnalysisService):
             break_count = len(self.breakValues.strip().split())
             valid_facility_count = facility_count - invalid_facility_count
             num_objects = break_count * valid_facility_count
-            arcpy.gp._arc_object.LogUsageMetering(5555, self.__class__.__name__, num_objects)
-            arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects)
+            self.usageMeteringRecords.append((5555, self.__class__.__name__, num_objects))
+            self.usageMeteringRecords.append((9999, self.outputNDS, num_objects))
             self.solveSucceeded = True    
 
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
+
         except InputError as ex:
             self._handleInputErrorException(ex)
         except arcpy.ExecuteError:
@@ -2309,6 +4785,96 @@ class GenerateServiceAreas(NetworkAnalysisService):
         except Exception as ex:
             self._handleException()
 
+    def _getChunkSize(self, facility_count, service_limits):
+        '''Return the maximum number of facilities in a chunk when solving the facilities in chunks. Returns 0 if the
+        facilities are not solved in chunks. As each chunk is within the maximum facilities supported by the service,
+        raise InputError if there are more facilities than the maximum before splitting them into chunks. The
+        facilities are not solved in chunks if the network analysis layer is saved as there is no layer for all the
+        chunks.'''
+
+        if (not SERVICE_AREA_CHUNKING or self.saveLayerFile or
+            self.MERGE_POLYGONS_KEYWORDS[self.polygonType] == "NO_OVERLAP"):
+            return 0
+        maximum_facilities = int(service_limits.get("Maximum_Facilities") or 0)
+        if maximum_facilities and facility_count > maximum_facilities:
+            raise InputError(u"The number of facilities {0} exceeds the maximum of {1} facilities supported by the "
+                             u"service".format(facility_count, maximum_facilities))
+        if SERVICE_AREA_CHUNK_FACILITIES and SERVICE_AREA_CHUNK_FACILITIES < facility_count:
+            return SERVICE_AREA_CHUNK_FACILITIES
+        return 0
+
+    def _executeChunks(self, tool_parameters, chunk_size):
+        '''Split the facilities into chunks and solve the chunks in a pool of processes against the same network
+        dataset. Merge the polygons from the chunks into the output service areas. The FacilityID values refer to
+        the facilities in the order they are solved without chunks. Polygons merged by break value are merged again
+        across the chunks.'''
+
+        with self._processPoolWorkspace() as (chunks_folder, inputs_workspace):
+            facility_blocks = write_feature_blocks(self.facilities, inputs_workspace, "Facilities", chunk_size)
+            chunk_workspaces = [os.path.join(chunks_folder, "Chunk{0}.gdb".format(index))
+                                for index in range(len(facility_blocks))]
+            chunk_parameters = [{"Facilities": facility_block,
+                                 "Service_Areas": os.path.join(chunk_workspace, "ServiceAreas")}
+                                for facility_block, chunk_workspace in zip(facility_blocks, chunk_workspaces)]
+            self.logger.debug(u"Solving facilities in {0} chunks".format(len(facility_blocks)))
+            chunk_results = self._executeInProcessPool(tool_parameters, chunk_parameters, inputs_workspace,
+                                                       chunk_workspaces, SERVICE_AREA_CHUNK_PROCESSES)
+
+            #Offset the facility IDs in each chunk by the number of facilities in the previous chunks
+            chunk_outputs = [chunk_result.getOutput(0) for chunk_result in chunk_results]
+            facility_offset = 0
+            for facility_block, chunk_output in zip(facility_blocks, chunk_outputs):
+                if facility_offset and "FacilityID" in [field.name for field in arcpy.ListFields(chunk_output)]:
+                    with arcpy.da.UpdateCursor(chunk_output, ["FacilityID"]) as cursor:
+                        for row in cursor:
+                            if row[0] is not None:
+                                cursor.updateRow([row[0] + facility_offset])
+                facility_offset += int(arcpy.management.GetCount(facility_block).getOutput(0))
+            arcpy.management.Merge(chunk_outputs, self.outputServiceAreas)
+            if self.MERGE_POLYGONS_KEYWORDS[self.polygonType] == "MERGE":
+                self._mergeChunkPolygons()
+
+        #Use the same outputs as a result from the big button tool
+        solve_status = any(chunk_result.getOutput(1).lower() == 'true' for chunk_result in chunk_results)
+        self.toolResult = ProcessToolResult.combine(chunk_results, [self.outputServiceAreas,
+                                                                    "true" if solve_status else "false", ""])
+
+    def _mergeChunkPolygons(self):
+        '''Merge the polygons for the same break values from all the chunks into one polygon. For rings, remove the
+        area covered by the polygons for the smaller breaks from each polygon, as a location within a smaller break
+        from a facility in one chunk may be within a larger break from a facility in another chunk.'''
+
+        cursor_fields = ["FromBreak", "ToBreak", "SHAPE@"]
+        polygons = {}
+        with arcpy.da.SearchCursor(self.outputServiceAreas, cursor_fields) as cursor:
+            for from_break, to_break, polygon in cursor:
+                merged_polygon = polygons.get((from_break, to_break))
+                if polygon and merged_polygon:
+                    polygon = merged_polygon.union(polygon)
+                polygons[(from_break, to_break)] = polygon or merged_polygon
+        if self.overlapType.upper() == "RINGS":
+            covered_polygon = None
+            for break_values in sorted(polygons, key=lambda break_values: break_values[1]):
+                polygon = polygons[break_values]
+                if not polygon:
+                    continue
+                if covered_polygon:
+                    polygons[break_values] = polygon.difference(covered_polygon)
+                    covered_polygon = covered_polygon.union(polygon)
+                else:
+                    covered_polygon = polygon
+
+        #Keep the first feature for each break values with the merged polygon
+        merged_break_values = set()
+        with arcpy.da.UpdateCursor(self.outputServiceAreas, cursor_fields) as cursor:
+            for from_break, to_break, polygon in cursor:
+                break_values = (from_break, to_break)
+                if break_values in merged_break_values:
+                    cursor.deleteRow()
+                else:
+                    merged_break_values.add(break_values)
+                    cursor.updateRow([from_break, to_break, polygons[break_values]])
+
 class SolveVehicleRoutingProblem(NetworkAnalysisService):
     '''SolveVehicleRoutingProblem geoprocessing service'''
 
@@ -2318,6 +4884,9 @@ class SolveVehicleRoutingProblem(NetworkAnalysisService):
     OUTPUT_DIRECTIONS_NAME = "Directions"
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] = "GPVehicleRoutingProblemService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputUnassignedStops", "outputStops", "outputRoutes", "outputDirections", "outputLayer",
+                            "outputRouteData")
     NDS_PROPERTY_NAMES = ("time_attribute", "distance_attribute", "feature_locator_where_clause")
     #MAX_FEATURES = 2000000
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 19
@@ -2376,6 +4945,10 @@ class SolveVehicleRoutingProblem(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -2461,12 +5034,10 @@ class SolveVehicleRoutingProblem(NetworkAnalysisService):
                                self.timeZoneUsageForTimeFields, self.saveLayerFile, self.overrides, self.saveRouteData]
                 #remove any unsupported restriction parameters
                 if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param, 
-                                                                                                                self.restrictions)
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
                 result_severity =  self.toolResult.maxSeverity
                 if result_severity == -1:
                     result_severity = arcpy.GetMaxSeverity()
@@ -2476,10 +5047,10 @@ class SolveVehicleRoutingProblem(NetworkAnalysisService):
                     solve_status = self.toolResult.getOutput(4)
                     if solve_status.lower() == 'true':
                         self.solveSucceeded = True
-                    arcpy.management.CopyRows(self.toolResult.getOutput(0), self.outputUnassignedStops)
-                    arcpy.management.CopyRows(self.toolResult.getOutput(1), self.outputStops)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(2), self.outputRoutes)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(3), self.outputDirections)
+                    self.outputUnassignedStops = self._getRemoteOutput(0, self.outputUnassignedStops, is_table=True)
+                    self.outputStops = self._getRemoteOutput(1, self.outputStops, is_table=True)
+                    self.outputRoutes = self._getRemoteOutput(2, self.outputRoutes)
+                    self.outputDirections = self._getRemoteOutput(3, self.outputDirections, self.populateDirections)
                     self.outputLayer = self.toolResult.getOutput(5)
                     self.outputRouteData = self.toolResult.getOutput(6)
             else:
@@ -2518,20 +5089,23 @@ class SolveVehicleRoutingProblem(NetworkAnalysisService):
             if self.populateDirections:
                 self._checkMaxOutputFeatures(self.outputDirections)
                 #generalize directions features
-                arcpy.edit.Generalize(self.outputDirections, self.routeLineSimplicationTolerance)
+                generalize_lines(self.outputDirections, self.routeLineSimplicationTolerance)
             
             #Log messages from execution of remote tool or big button tool
             self._logToolExecutionMessages()   
             
             #Add metering and royalty messages
             #numObjects = number of routes with orders           
-            num_objects = 0
-            with arcpy.da.SearchCursor(self.outputRoutes, "OrderCount", "OrderCount IS NOT NULL") as cursor:
-                for row in cursor:
-                    num_objects += 1   
+            num_objects = TableStatistics(self.outputRoutes, count_fields=["OrderCount"]).nonNullCounts["OrderCount"]
             if num_objects:
-                arcpy.gp._arc_object.LogUsageMetering(5555, self.__class__.__name__, num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects) 
+                self.usageMeteringRecords.append((5555, self.__class__.__name__, num_objects))
+                self.usageMeteringRecords.append((9999, self.outputNDS, num_objects))
+
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
 
         except InputError as ex:
             self._handleInputErrorException(ex)
@@ -2573,6 +5147,8 @@ class SolveLocationAllocation(NetworkAnalysisService):
     }
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] = "GPLocationAllocationService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputAllocationLines", "outputFacilities", "outputDemandPoints", "outputLayer")
     #MAX_FEATURES = 1000000
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 19
     
@@ -2620,6 +5196,10 @@ class SolveLocationAllocation(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -2696,12 +5276,10 @@ class SolveLocationAllocation(NetworkAnalysisService):
 
                 #remove any unsupported restriction parameters when using a custom travel mode
                 if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param,
-                                                                                                                self.restrictions)
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
 
                 #report errors and exit in case the remote tool failed.
                 if self.toolResult.maxSeverity == 2:
@@ -2712,9 +5290,9 @@ class SolveLocationAllocation(NetworkAnalysisService):
                     solve_status = self.toolResult.getOutput(0)
                     if solve_status.lower() == 'true':
                         self.solveSucceeded = True
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(1), self.outputAllocationLines)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(2), self.outputFacilities)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(3), self.outputDemandPoints)
+                    self.outputAllocationLines = self._getRemoteOutput(1, self.outputAllocationLines)
+                    self.outputFacilities = self._getRemoteOutput(2, self.outputFacilities)
+                    self.outputDemandPoints = self._getRemoteOutput(3, self.outputDemandPoints)
                     self.outputLayer = self.toolResult.getOutput(4)
             
             else:
@@ -2752,18 +5330,21 @@ class SolveLocationAllocation(NetworkAnalysisService):
             
             #Fail if the count of features in output demand points exceeds the maximum number of records returned by 
             #the service
-            self._checkMaxOutputFeatures(self.outputDemandPoints, 30170) 
+            demand_point_statistics = TableStatistics(self.outputDemandPoints, count_fields=["FacilityOID"])
+            self._checkMaxOutputFeatures(self.outputDemandPoints, 30170, demand_point_statistics.count) 
 
             #Add metering and royalty messages
             #numObjects = number of allocated demand points
-            output_demand_points_layer = "OutputDemandPointsLayer"
-            allocated_demand_points_where_clause = "FacilityOID IS NOT NULL"
-            arcpy.management.MakeFeatureLayer(self.outputDemandPoints, output_demand_points_layer,
-                                              allocated_demand_points_where_clause)
-            num_objects = int(arcpy.management.GetCount(output_demand_points_layer).getOutput(0))                   
+            num_objects = demand_point_statistics.nonNullCounts["FacilityOID"]
             if num_objects:
-                arcpy.gp._arc_object.LogUsageMetering(5555, self.__class__.__name__, num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects)
+                self.usageMeteringRecords.append((5555, self.__class__.__name__, num_objects))
+                self.usageMeteringRecords.append((9999, self.outputNDS, num_objects))
+
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
 
         except InputError as ex:
             self._handleInputErrorException(ex)
@@ -2782,7 +5363,10 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
     OUTPUT_DESTINATIONS_NAME = "Destinations"
     EXTENT_FIELDS = NetworkAnalysisService.EXTENT_FIELDS[:]
     EXTENT_FIELDS[2] = "GPOriginDestinationCostMatrixService"
+    #Outputs that are kept when the outputs are returned in pages
+    PAGED_RESULT_OUTPUTS = ("outputODLines", "outputOrigins", "outputDestinations", "outputLayer")
     REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX = 15
+    SUPPORTS_MULTI_REGION_FAN_OUT = True
     
     TOOL_NAME = "GenerateOriginDestinationCostMatrix_na"
     HELPER_SERVICES_KEY = "asyncODCostMatrix"
@@ -2823,6 +5407,10 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
         try:
             arcpy.CheckOutExtension("network")
 
+            #Return the requested page from a result solved by an earlier request
+            if self._loadPagedResult():
+                return
+
             #Get the properties for all network datasets from a propeties file. 
             self._getNetworkDatasetProperties()
 
@@ -2837,15 +5425,10 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
             constant_params = [('Maximum_Snap_Tolerance', '20 Kilometers'),
                                ('Accumulate_Attributes', []),
                                ('Output_Geodatabase', self.outputGeodatabase),
-                               ('Output_Origin_Destination_Lines_Name', self.OUTPUT_OD_LINES_NAME),
-                               ('Output_Origins_Name', self.OUTPUT_ORIGINS_NAME),
-                               ('Output_Destinations_Name', self.OUTPUT_DESTINATIONS_NAME),
                                ]
 
             #Create a list of user defined parameter names and their values
-            user_parameters = [('Origins', self.origins),
-                               ('Destinations', self.destinations),
-                               ('Travel_Mode', self.portalTravelMode),
+            user_parameters = [('Travel_Mode', self.portalTravelMode),
                                ('Time_Units', self.timeUnits),
                                ('Distance_Units', self.distanceUnits),
                                ('Number_of_Destinations_to_Find', self.destinationsToFind),
@@ -2871,31 +5454,72 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
                 arcpy.AddIDMessage("ERROR", 30168)
                 raise InputError
 
+            def get_task_params(remote_toolbox, remote_tool_name, origins, destinations):
+                '''Return the parameter values for the remote tool'''
+
+                #need to pass boolean values for boolean parameters when calling the remote service
+                task_params = [origins, destinations, self.portalTravelMode, self.timeUnits,
+                               self.distanceUnits, "#", self.destinationsToFind, self.cutoff, self.timeOfDay,
+                               self.timeZoneUsage, self.pointBarriers, self.lineBarriers, self.polygonBarriers,
+                               self.uTurnAtJunctions, self.useHierarchy, "#", self.attributeParameterValues, 
+                               self.impedance, self.odLineShape, self.saveLayerFile, self.overrides]
+
+                #remove any unsupported restriction parameters when using a custom travel mode
+                if self.isCustomTravelMode:
+                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_service(
+                        remote_toolbox, remote_tool_name, self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX, self.restrictions)
+                return task_params
+
+            def get_tool_parameters(network_dataset, origins, destinations, output_suffix=""):
+                '''Return a dict with the big button tool parameters'''
+
+                #Add the network dataset that we wish to use.    
+                network_parameters = [("Network_Dataset", network_dataset), ("Origins", origins),
+                                      ("Destinations", destinations)]
+                output_names = [('Output_Origin_Destination_Lines_Name', self.OUTPUT_OD_LINES_NAME + output_suffix),
+                                ('Output_Origins_Name', self.OUTPUT_ORIGINS_NAME + output_suffix),
+                                ('Output_Destinations_Name', self.OUTPUT_DESTINATIONS_NAME + output_suffix)]
+        
+                #Get the time attribute, distance attribute and feature locator where clause from config file
+                nds_property_values = self._getToolParametersFromNDSProperties(network_dataset)
+        
+                #Create a dict that contains all the tool parameters
+                tool_parameters = dict(nds_property_values + constant_params + user_parameters + network_parameters +
+                                       output_names)
+                tool_parameters.update(service_limits)
+                #Update time attribute and distance attribute when using custom travel mode.
+                if self.isCustomTravelMode:
+                    tool_parameters["Time_Attribute"] = self.customTravelModeTimeAttribute
+                    tool_parameters["Distance_Attribute"] = self.customTravelModeDistanceAttribute
+                    tool_parameters["Impedance_Attribute"] = self.customTravelModeImpedanceAttribute
+                return tool_parameters
+
             #Determine the network dataset to use. If analysis region is specified use that as
             #the network dataset layer name
             self._selectNetworkDataset(self.origins, self.destinations)
 
-            if self.connectionFile:
+            #Warn before solving if the OD lines can exceed the maximum number of records returned by the service
+            od_lines_count = origin_count * min(str_to_int(self.destinationsToFind) or destination_count,
+                                                destination_count)
+            self._checkEstimatedOutputFeatures(od_lines_count)
+
+            if self.regionInputs:
+                #Solve the inputs in each region separately and merge the results. The origin and destination
+                #ObjectIDs in the OD lines refer to the output origins and destinations.
+                self._executeRegions(get_task_params, get_tool_parameters, [0, 1, 2, 3], [0, 1, 2, 3],
+                                     [self.outputODLines, self.outputOrigins, self.outputDestinations],
+                                     {0: [("OriginOID", 1), ("DestinationOID", 2)]})
+
+            elif self.connectionFile:
                 #Add remote tool
                 self.logger.debug(u"Adding remote service {0} from {1}".format(self.serviceName, self.connectionFile))
                 remote_tool_name, remote_toolbox = add_remote_toolbox(self.connectionFile, self.serviceName)
 
                 #specify parameter values for the remote tool
-                #need to pass boolean values for boolean parameters when calling the remote service
-                task_params = [self.origins, self.destinations, self.portalTravelMode, self.timeUnits,
-                               self.distanceUnits, "#", self.destinationsToFind, self.cutoff, self.timeOfDay,
-                               self.timeZoneUsage, self.pointBarriers, self.lineBarriers, self.polygonBarriers,
-                               self.uTurnAtJunctions, self.useHierarchy, "#", self.attributeParameterValues, 
-                               self.impedance, self.odLineShape, self.saveLayerFile, self.overrides]
+                task_params = get_task_params(remote_toolbox, remote_tool_name, self.origins, self.destinations)
 
-                #remove any unsupported restriction parameters when using a custom travel mode
-                if self.isCustomTravelMode:
-                    remote_tool_param_info = arcpy.GetParameterInfo(remote_tool_name)
-                    remote_tool_restriction_param = remote_tool_param_info[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX]
-                    task_params[self.REMOTE_TOOL_RESTRICTIONS_PARAM_INDEX] = get_valid_restrictions_remote_tool(remote_tool_restriction_param,
-                                                                                                                self.restrictions)
                 #execute the remote tool
-                self.toolResult = execute_remote_tool(remote_toolbox, remote_tool_name, task_params)
+                self.toolResult = self._executeRemoteTool(remote_toolbox, remote_tool_name, task_params)
 
                 #report errors and exit in case the remote tool failed.
                 if self.toolResult.maxSeverity == 2:
@@ -2906,72 +5530,62 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
                     solve_status = self.toolResult.getOutput(0)
                     if solve_status.lower() == 'true':
                         self.solveSucceeded = True
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(1), self.outputODLines)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(2), self.outputOrigins)
-                    arcpy.management.CopyFeatures(self.toolResult.getOutput(3), self.outputDestinations)
+                    self.outputODLines = self._getRemoteOutput(1, self.outputODLines)
+                    self.outputOrigins = self._getRemoteOutput(2, self.outputOrigins)
+                    self.outputDestinations = self._getRemoteOutput(3, self.outputDestinations)
                     self.outputLayer = self.toolResult.getOutput(4)
             
             else:
         
-                #Add the network dataset that we wish to use.    
-                user_parameters.append(("Network_Dataset", self.outputNDS))
-        
-                #Get the time attribute, distance attribute and feature locator where clause from config file
-                nds_property_values = self._getToolParametersFromNDSProperties()
-        
-                #Create a dict that contains all the tool parameters and call the tool.
-                tool_parameters = dict(nds_property_values + constant_params + user_parameters)
-                tool_parameters.update(service_limits)
-                #Update time attribute and distance attribute when using custom travel mode.
-                if self.isCustomTravelMode:
-                    tool_parameters["Time_Attribute"] = self.customTravelModeTimeAttribute
-                    tool_parameters["Distance_Attribute"] = self.customTravelModeDistanceAttribute
-                    tool_parameters["Impedance_Attribute"] = self.customTravelModeImpedanceAttribute
+                tool_parameters = get_tool_parameters(self.outputNDS, self.origins, self.destinations)
 
                 #enforce walking travel mode extent constraint
                 self._checkWalkingExtent(self.origins, self.destinations)
 
-                #Call the big button tool
-                self._executeBigButtonTool(tool_parameters)
-                
-                #get outputs from the result
-                solve_status = self.toolResult.getOutput(0)
-                if solve_status.lower() == 'true':
-                    self.solveSucceeded = True
-                self.outputODLines = self.toolResult.getOutput(1)
-                self.outputOrigins = self.toolResult.getOutput(2)
-                self.outputDestinations = self.toolResult.getOutput(3)
-                self.outputLayer = self.toolResult.getOutput(4)
+                #Split the origins and destinations into tiles if there are more of them than the tile sizes
+                origin_block_size, destination_block_size = self._getTileBlockSizes(origin_count, destination_count,
+                                                                                    service_limits)
+                if origin_block_size or destination_block_size:
+                    #Solve the tiles in a pool of processes and merge the results
+                    self._executeTiles(tool_parameters, origin_block_size, destination_block_size)
+                else:
+                    #Call the big button tool
+                    self._executeBigButtonTool(tool_parameters)
+                    
+                    #get outputs from the result
+                    solve_status = self.toolResult.getOutput(0)
+                    if solve_status.lower() == 'true':
+                        self.solveSucceeded = True
+                    self.outputODLines = self.toolResult.getOutput(1)
+                    self.outputOrigins = self.toolResult.getOutput(2)
+                    self.outputDestinations = self.toolResult.getOutput(3)
+                    self.outputLayer = self.toolResult.getOutput(4)
                     
             #Log messages from execution of remote or big button tool
             self._logToolExecutionMessages()
             
             #Fail if the count of features in output od lines exceeds the maximum number of records returned by 
             #the service
-            self._checkMaxOutputFeatures(self.outputODLines, 30171) 
+            odlines_count = int(arcpy.management.GetCount(self.outputODLines).getOutput(0))
+            self._checkMaxOutputFeatures(self.outputODLines, 30171, odlines_count) 
 
             #Add metering and royalty messages
             #numObjects = number of origins located on network * number of destinations located on network
-            #Get the counts of unlocated origins from excluded origins 
-            output_origins_layer = "OutputOriginsLayer"
-            unlocated_where_clause = "Status NOT IN (0,5)"
-            arcpy.management.MakeFeatureLayer(self.outputOrigins, output_origins_layer, unlocated_where_clause)
-            unlocated_origin_count = int(arcpy.management.GetCount(output_origins_layer).getOutput(0))
-            #Get the counts of unlocated destinations from excluded destinations
-            output_destinations_layer = "OutputDestinationsLayer"
-            arcpy.management.MakeFeatureLayer(self.outputDestinations, output_destinations_layer, 
-                                              unlocated_where_clause)
-            unlocated_destination_count = int(arcpy.management.GetCount(output_destinations_layer).getOutput(0))
-
-            #Calculate numObjects 
-            num_objects = (origin_count - unlocated_origin_count) * (destination_count - unlocated_destination_count)
+            #When the inputs in each region are solved separately, only origins and destinations in the same region
+            #are used
+            if self.regionOutputs:
+                nds_objects = [(network_dataset, self._getLocatedCount(outputs[2]) * self._getLocatedCount(outputs[3]))
+                               for network_dataset, tool_result, outputs in self.regionOutputs]
+            else:
+                nds_objects = [(self.outputNDS, (self._getLocatedCount(self.outputOrigins, origin_count) *
+                                                 self._getLocatedCount(self.outputDestinations, destination_count)))]
+            num_objects = sum(nds_num_objects for network_dataset, nds_num_objects in nds_objects)
             
-            #Get usage parameters to report
-            odlines_count = int(arcpy.management.GetCount(self.outputODLines).getOutput(0))
-            origins_extent = arcpy.Describe(self.origins).extent
-            destinations_extent = arcpy.Describe(self.destinations).extent            
+            #Report usage parameters
             if num_objects:
                 task_name = self.__class__.__name__
+                origins_extent = arcpy.Describe(self.origins).extent
+                destinations_extent = arcpy.Describe(self.destinations).extent
                 usage_metrics = {
                     "originCount" : origin_count,
                     "originExtent" : json.loads(origins_extent.JSON),
@@ -2981,9 +5595,17 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
                     "cutoff" : self.cutoff,
                     "odLinesCount" : odlines_count,
                 }
-                arcpy.gp._arc_object.LogUsageMetering(5555, task_name , num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(9999, self.outputNDS, num_objects)
-                arcpy.gp._arc_object.LogUsageMetering(7777, task_name + json.dumps(usage_metrics), num_objects)
+                self.usageMeteringRecords.append((5555, task_name, num_objects))
+                for network_dataset, nds_num_objects in nds_objects:
+                    if nds_num_objects:
+                        self.usageMeteringRecords.append((9999, network_dataset, nds_num_objects))
+                self.usageMeteringRecords.append((7777, task_name + json.dumps(usage_metrics), num_objects))
+
+            #Return outputs with more than the maximum number of records in pages
+            self._returnOutputPages()
+
+            #Record the usage metering messages
+            self._recordUsageMetering()
 
         except InputError as ex:
             self._handleInputErrorException(ex)
@@ -2994,6 +5616,139 @@ class GenerateOriginDestinationCostMatrix(NetworkAnalysisService):
 
         return
 
+    def _isPagedOutputMode(self):
+        '''Return True if outputs with more features than the maximum number of records that can be returned by the
+        service are returned in pages. OD lines from inputs solved in tiles usually have more features than can be
+        returned at once, so they are returned in pages when OD_TILING is used.'''
+
+        return PAGED_OUTPUT_MODE or OD_TILING
+
+    def _getTileBlockSizes(self, origin_count, destination_count, service_limits):
+        '''Return the maximum number of origins and destinations in a tile when solving the inputs in tiles. A size
+        of 0 means that the inputs are not split. Returns (0, 0) if the inputs are not solved in tiles. The inputs
+        are not solved in tiles if the network analysis layer is saved as there is no layer for all the tiles.'''
+
+        block_sizes = [0, 0]
+        if OD_TILING and not self.saveLayerFile:
+            for index, (tile_size, limit_name, input_count) in enumerate((
+                    (OD_TILE_ORIGINS, "Maximum_Origins", origin_count),
+                    (OD_TILE_DESTINATIONS, "Maximum_Destinations", destination_count))):
+                sizes = [int(size) for size in (tile_size, service_limits.get(limit_name)) if size]
+                if sizes and min(sizes) < input_count:
+                    block_sizes[index] = min(sizes)
+        return tuple(block_sizes)
+
+    def _executeTiles(self, tool_parameters, origin_block_size, destination_block_size):
+        '''Split the origins and destinations into blocks and solve every pair of an origin block and a destination
+        block as a tile in a pool of processes against the same network dataset. Merge the OD lines, origins and
+        destinations from the tiles into the outputs. The origin and destination ObjectIDs in the merged OD lines
+        refer to the merged origins and destinations. When the destinations are split, the destination ranks and the
+        number of destinations to find for each origin are applied across all the tiles.'''
+
+        with self._processPoolWorkspace() as (tiles_folder, inputs_workspace):
+            origin_blocks = write_feature_blocks(self.origins, inputs_workspace, "Origins", origin_block_size)
+            destination_blocks = write_feature_blocks(self.destinations, inputs_workspace, "Destinations",
+                                                      destination_block_size)
+            tile_parameters = []
+            tile_workspaces = []
+            for origin_index, origin_block in enumerate(origin_blocks):
+                for destination_index, destination_block in enumerate(destination_blocks):
+                    tile_workspace = os.path.join(tiles_folder, "Tile{0}_{1}.gdb".format(origin_index,
+                                                                                       destination_index))
+                    tile_workspaces.append(tile_workspace)
+                    tile_parameters.append({"Origins": origin_block, "Destinations": destination_block,
+                                            "Output_Geodatabase": tile_workspace})
+            self.logger.debug(u"Solving {0} origin blocks and {1} destination blocks as {2} tiles".format(
+                              len(origin_blocks), len(destination_blocks), len(tile_parameters)))
+            tile_results = self._executeInProcessPool(tool_parameters, tile_parameters, inputs_workspace,
+                                                      tile_workspaces, OD_TILE_PROCESSES)
+            self.solveSucceeded = any(tile_result.getOutput(0).lower() == 'true' for tile_result in tile_results)
+
+            #Every origin block is solved with the first destination block and every destination block with the first
+            #origin block. Merge the origins and destinations from these tiles in block order.
+            destination_block_count = len(destination_blocks)
+            tile_outputs = [tile_result.outputs for tile_result in tile_results]
+            origin_outputs = [outputs[2] for outputs in tile_outputs[::destination_block_count]]
+            destination_outputs = [outputs[3] for outputs in tile_outputs[:destination_block_count]]
+            arcpy.management.Merge([outputs[1] for outputs in tile_outputs], self.outputODLines)
+            arcpy.management.Merge(origin_outputs, self.outputOrigins)
+            arcpy.management.Merge(destination_outputs, self.outputDestinations)
+            self._offsetTileIDs([outputs[1] for outputs in tile_outputs], origin_outputs, destination_outputs)
+
+    def _offsetTileIDs(self, od_lines_outputs, origin_outputs, destination_outputs):
+        '''Update the OriginOID and DestinationOID values in the merged OD lines to refer to the merged origins and
+        destinations. If the destinations are split into more than one block, rank the destinations for each origin
+        by the impedance across all the tiles and delete the OD lines beyond the number of destinations to find.'''
+
+        #The origin and destination ObjectIDs from a tile are offset by the number of origins and destinations in the
+        #previous blocks, which requires the merged ObjectIDs to start at 1 without gaps
+        check_merged_oids(self.outputOrigins, origin_outputs, ["SHAPE@XY"])
+        check_merged_oids(self.outputDestinations, destination_outputs, ["SHAPE@XY"])
+        get_count = lambda dataset: int(arcpy.management.GetCount(dataset).getOutput(0))
+        origin_offsets = np.cumsum([0] + [get_count(origins) for origins in origin_outputs[:-1]])
+        destination_offsets = np.cumsum([0] + [get_count(destinations) for destinations in destination_outputs[:-1]])
+        destination_block_count = len(destination_outputs)
+        rank_destinations = destination_block_count > 1
+
+        if self.isCustomTravelMode:
+            is_impedance_time_based = self.impedance != "Travel Distance"
+        else:
+            is_impedance_time_based = self.travelModeObject.impedance == self.travelModeObject.timeAttributeName
+        cost_field = "Total_Time" if is_impedance_time_based else "Total_Distance"
+        oid_field = arcpy.Describe(self.outputODLines).OIDFieldName
+        sql_clause = (None, "ORDER BY {0}".format(oid_field))
+        origin_oids = []
+        costs = []
+        cursor_fields = ["OriginOID", "DestinationOID", cost_field]
+        with arcpy.da.UpdateCursor(self.outputODLines, cursor_fields, sql_clause=sql_clause) as cursor:
+            for tile, oid, row in iter_merged_rows(cursor, od_lines_outputs, cursor_fields):
+                origin_oid = row[0] + int(origin_offsets[tile // destination_block_count])
+                destination_oid = row[1] + int(destination_offsets[tile % destination_block_count])
+                cursor.updateRow([origin_oid, destination_oid, row[2]])
+                if rank_destinations:
+                    origin_oids.append(origin_oid)
+                    costs.append(row[2])
+        if not rank_destinations or not origin_oids:
+            return
+
+        #Rank the OD lines for each origin by cost. Lines with the same cost keep the order of the tiles.
+        origin_oids = np.array(origin_oids, dtype=np.int64)
+        costs = np.array(costs, dtype=np.float64)
+        line_count = len(origin_oids)
+        order = np.lexsort((np.arange(line_count), costs, origin_oids))
+        sorted_origin_oids = origin_oids[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_origin_oids[1:] != sorted_origin_oids[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, line_count])
+        ranks = np.empty(line_count, dtype=np.int64)
+        ranks[order] = np.arange(line_count) - np.repeat(group_starts, group_sizes) + 1
+
+        #The number of destinations to find for an origin can be overridden by the TargetDestinationCount field
+        destinations_to_find = np.empty(int(origin_oids.max()) + 1, dtype=np.int64)
+        destinations_to_find.fill(str_to_int(self.destinationsToFind) or 0)
+        if "TargetDestinationCount" in [field.name for field in arcpy.ListFields(self.outputOrigins)]:
+            with arcpy.da.SearchCursor(self.outputOrigins, ["OID@", "TargetDestinationCount"]) as cursor:
+                for oid, target_destination_count in cursor:
+                    if target_destination_count and oid < len(destinations_to_find):
+                        destinations_to_find[oid] = target_destination_count
+        line_destinations_to_find = destinations_to_find[origin_oids]
+        keep = (line_destinations_to_find == 0) | (ranks <= line_destinations_to_find)
+        with arcpy.da.UpdateCursor(self.outputODLines, ["DestinationRank"], sql_clause=sql_clause) as cursor:
+            for feature_index, row in enumerate(cursor):
+                if keep[feature_index]:
+                    cursor.updateRow([int(ranks[feature_index])])
+                else:
+                    cursor.deleteRow()
+
+    def _getLocatedCount(self, output_points, input_count=None):
+        '''Return the number of output origins or destinations that are located on the network. The count of the
+        inputs is used as the total count if it is given.'''
+
+        #Get the counts of unlocated points from excluded points, which have a status other than 0 or 5
+        output_statistics = TableStatistics(output_points, ["Status"])
+        if input_count is None:
+            input_count = output_statistics.count
+        return input_count - output_statistics.count_values("Status", (0, 5), exclude=True)
+
 class Utilities(object):
     '''Utilities geprocessing service'''
 
@@ -3121,26 +5876,7 @@ class GetTravelModes(Utilities):
             hgp = init_hostedgp()
             portal_self_response = get_portal_self(hgp)
 
-            if "id" in portal_self_response:
-                #OAuth and non-OAuth based user logins should have id property in portal self response
-                org_id = portal_self_response.get("id", "")
-                #Get the language defined for the user
-                if "user" in portal_self_response:
-                    culture = portal_self_response["user"].get("culture","en")
-                    #Some users in orgs can have null cultures. Use the culture defined for the org in such cases.
-                    if not culture:
-                        culture = portal_self_response.get("culture", "en")
-
-            elif "appInfo" in portal_self_response:
-                #This block should be executed only when app logins are used
-                app_info = portal_self_response["appInfo"] 
-                org_id = app_info.get("orgId", "")
-                #If appInfo does not have a culture, use default en culture
-                culture = app_info.get("culture", "en")
-
-            #If for some reason we get a null culture, use en
-            if not culture:
-                culture = "en" 
+            org_id, culture = get_portal_org_and_culture(portal_self_response)
             if not org_id:
                 self.logger.error("Failed to get organization ID")
                 raise arcpy.ExecuteError
@@ -3213,12 +5949,10 @@ class GetToolInfo(Utilities):
                 raise InputError
 
             #Read the tool info from the JSON file
-            with open(self.toolInfoFile, "r") as ti_fp:
-                tool_info_json = json.load(ti_fp)
-            network_dataset_props = tool_info_json["networkDataset"]
+            tool_info_json = TOOL_INFO_CACHE.get(self.toolInfoFile)
             #do not include supported travel modes as we have a separate tool to get travel modes
-            if "supportedTravelModes" in network_dataset_props:
-                network_dataset_props.pop("supportedTravelModes")
+            network_dataset_props = {k: v for k, v in tool_info_json["networkDataset"].iteritems()
+                                     if k != "supportedTravelModes"}
             tool_info = {
                 "networkDataset": network_dataset_props,
                 "serviceLimits": tool_info_json["serviceLimits"][self.serviceName][self.toolName]
@@ -0,0 +1,747 @@
+'''Unit tests for the network analysis services module. The tests need arcpy and are skipped when arcpy cannot be
+imported. Run the tests from the folder containing nas.py using python -m unittest discover tests
+
+The integration tests solve with the network analyst tools in a pool of processes. They run only if the
+NAS_TEST_NETWORK_DATASET environment variable is set to the catalog path of a network dataset and
+NAS_TEST_ORIGINS and NAS_TEST_DESTINATIONS are set to point feature classes within its extent.'''
+
+import os
+import sys
+import math
+import shutil
+import socket
+import time
+import httplib
+import urllib2
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import nas
+except ImportError:
+    nas = None
+
+class StandInRecorder(object):
+    '''Records usage metering messages in a list instead of recording them with the server. Fails for the names in
+    fail_names.'''
+
+    def __init__(self, fail_names=()):
+        self.records = []
+        self.failNames = fail_names
+
+    def __call__(self, code, name, num_objects):
+        if name in self.failNames:
+            raise RuntimeError("Failed to record {0}".format(name))
+        self.records.append((code, name, num_objects))
+
+class StandInLogger(object):
+    '''Keeps the logged warnings in a list'''
+
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestUsageMetering(unittest.TestCase):
+    '''Tests for recording the usage metering records of a request'''
+
+    def setUp(self):
+        self.logUsageMetering = nas.log_usage_metering
+        self.service = nas.FindRoutes.__new__(nas.FindRoutes)
+        self.service.usageMeteringRecords = [(5555, "FindRoutes", 3), (9999, "Routing_ND", 3)]
+
+    def tearDown(self):
+        nas.log_usage_metering = self.logUsageMetering
+
+    def test_records_are_recorded_in_order_once(self):
+        recorder = StandInRecorder()
+        nas.log_usage_metering = recorder
+        self.service._recordUsageMetering()
+        self.service._recordUsageMetering()
+        self.assertEqual(recorder.records, [(5555, "FindRoutes", 3), (9999, "Routing_ND", 3)])
+
+    def test_failures_are_raised(self):
+        recorder = StandInRecorder(fail_names=("FindRoutes",))
+        nas.log_usage_metering = recorder
+        self.assertRaises(RuntimeError, self.service._recordUsageMetering)
+        self.assertEqual(recorder.records, [])
+
+class StandInResponse(object):
+    '''HTTP response with an empty body'''
+
+    reason = "OK"
+    status = 200
+    msg = {}
+    will_close = False
+
+    def read(self, amt=None):
+        return ""
+
+    def isclosed(self):
+        return True
+
+class StandInConnection(object):
+    '''HTTP connection that keeps the methods of the requests sent and fails with send_error when sending a
+    request or with response_error when reading the response'''
+
+    def __init__(self, send_error=None, response_error=None):
+        self.sendError = send_error
+        self.responseError = response_error
+        self.requests = []
+        self.closed = False
+
+    def request(self, method, selector, data=None, headers=None):
+        if self.sendError:
+            raise self.sendError
+        self.requests.append(method)
+
+    def getresponse(self):
+        if self.responseError:
+            raise self.responseError
+        return StandInResponse()
+
+    def close(self):
+        self.closed = True
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestHTTPConnectionPool(unittest.TestCase):
+    '''Tests for retrying requests on a pooled connection closed by the server'''
+
+    KEY = ("http", "example.com", None, True)
+    URL = "http://example.com/arcgis/rest/info"
+
+    def send(self, method, idle_connection):
+        '''Send a request using the idle connection from the pool. Return the new connection created by the
+        pool.'''
+
+        pool = nas.HTTPConnectionPool()
+        new_connection = StandInConnection()
+        pool._connect = lambda key: new_connection
+        pool._idle[self.KEY] = [idle_connection]
+        data = None if method == "GET" else "f=json"
+        try:
+            pool._send(self.KEY, method, "/arcgis/rest/info", data, {}, self.URL)
+        finally:
+            self.assertTrue(idle_connection.closed)
+        return new_connection
+
+    def test_get_is_retried_after_the_response_fails(self):
+        idle_connection = StandInConnection(response_error=httplib.BadStatusLine(""))
+        self.assertEqual(self.send("GET", idle_connection).requests, ["GET"])
+
+    def test_post_is_not_retried_after_it_was_sent(self):
+        idle_connection = StandInConnection(response_error=httplib.BadStatusLine(""))
+        self.assertRaises(urllib2.URLError, self.send, "POST", idle_connection)
+        self.assertEqual(idle_connection.requests, ["POST"])
+
+    def test_post_is_retried_if_it_was_not_sent(self):
+        idle_connection = StandInConnection(send_error=socket.error(32, "Broken pipe"))
+        self.assertEqual(self.send("POST", idle_connection).requests, ["POST"])
+
+    def test_timeout_is_not_retried(self):
+        idle_connection = StandInConnection(response_error=socket.timeout("timed out"))
+        self.assertRaises(urllib2.URLError, self.send, "GET", idle_connection)
+
+def create_points(workspace, name, coordinates, field_values=None):
+    '''Create a point feature class with a feature for each (x, y) in coordinates. field_values is an optional
+    dict of field name -> list of integer or string values for each feature.'''
+
+    points = nas.arcpy.management.CreateFeatureclass(workspace, name, "POINT",
+                                                     spatial_reference=nas.arcpy.SpatialReference(4326)).getOutput(0)
+    field_values = field_values or {}
+    for field_name, values in field_values.iteritems():
+        is_text = any(isinstance(value, basestring) for value in values)
+        nas.arcpy.management.AddField(points, field_name, "TEXT" if is_text else "LONG")
+    with nas.arcpy.da.InsertCursor(points, ["SHAPE@XY"] + list(field_values)) as cursor:
+        for i, xy in enumerate(coordinates):
+            cursor.insertRow([xy] + [values[i] for values in field_values.itervalues()])
+    return points
+
+def straight_line_od(origins, destinations, destinations_to_find=0):
+    '''Return a list of (origin ObjectID, destination ObjectID, destination rank, cost) tuples for the destinations
+    nearest to each origin by straight-line distance. A TargetDestinationCount field on the origins overrides
+    destinations_to_find. Destinations with the same cost are ranked by ObjectID.'''
+
+    with nas.arcpy.da.SearchCursor(destinations, ["OID@", "SHAPE@XY"]) as cursor:
+        destination_points = [(oid, xy) for oid, xy in cursor]
+    origin_fields = ["OID@", "SHAPE@XY"]
+    if "TargetDestinationCount" in [field.name for field in nas.arcpy.ListFields(origins)]:
+        origin_fields.append("TargetDestinationCount")
+    od_lines = []
+    with nas.arcpy.da.SearchCursor(origins, origin_fields) as cursor:
+        for row in cursor:
+            origin_oid, (x, y) = row[:2]
+            count = (row[2] if len(row) > 2 else None) or destinations_to_find or len(destination_points)
+            costs = sorted((math.hypot(x - dx, y - dy), oid) for oid, (dx, dy) in destination_points)
+            for rank, (cost, destination_oid) in enumerate(costs[:count], 1):
+                od_lines.append((origin_oid, destination_oid, rank, cost))
+    return od_lines
+
+def straight_line_od_pool(tool_name, tool_parameters_list, output_workspaces, processes=0):
+    '''Stand-in for nas.execute_tools_in_process_pool that solves each tile by straight-line distance in the
+    current process and writes the outputs like the OD cost matrix tool'''
+
+    results = []
+    for tool_parameters, workspace in zip(tool_parameters_list, output_workspaces):
+        nas.arcpy.management.CreateFileGDB(*os.path.split(workspace))
+        origins = nas.arcpy.management.CopyFeatures(tool_parameters["Origins"],
+                                                    os.path.join(workspace, "Origins")).getOutput(0)
+        destinations = nas.arcpy.management.CopyFeatures(tool_parameters["Destinations"],
+                                                         os.path.join(workspace, "Destinations")).getOutput(0)
+        od_lines = nas.arcpy.management.CreateTable(workspace, "ODLines").getOutput(0)
+        field_names = ["OriginOID", "DestinationOID", "DestinationRank", "Total_Time", "Total_Distance"]
+        for field_name, field_type in zip(field_names, ["LONG", "LONG", "LONG", "DOUBLE", "DOUBLE"]):
+            nas.arcpy.management.AddField(od_lines, field_name, field_type)
+        destinations_to_find = int(tool_parameters.get("Number_of_Destinations_to_Find") or 0)
+        with nas.arcpy.da.InsertCursor(od_lines, field_names) as cursor:
+            for origin_oid, destination_oid, rank, cost in straight_line_od(origins, destinations,
+                                                                           destinations_to_find):
+                cursor.insertRow([origin_oid, destination_oid, rank, cost, cost])
+        results.append(nas.ProcessToolResult([(0, "Succeeded")], ["true", od_lines, origins, destinations, ""]))
+    return results
+
+class StandInJob(object):
+    '''Remote job that finishes after the given number of status checks. Keeps the number of requests executing the
+    tool whenever the status is checked.'''
+
+    def __init__(self, registry, tool_name, checks):
+        self.registry = registry
+        self.toolName = tool_name
+        self.checks = checks
+        self.inUse = []
+        self.cancelled = False
+
+    @property
+    def status(self):
+        self.inUse.append(self.registry._inUse.get(self.toolName, 0))
+        self.checks -= 1
+        return 4 if self.checks <= 0 else 2
+
+    def cancel(self):
+        self.cancelled = True
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestExecuteRemoteTool(unittest.TestCase):
+    '''Tests for executing remote tools using the remote toolbox registry'''
+
+    TBX = "server.ags;Routing/NetworkAnalysis"
+    TOOL_NAME = "FindRoutes_NetworkAnalysis"
+
+    def setUp(self):
+        self.registry = nas.RemoteToolboxRegistry(60)
+        self.registry._owners[self.TOOL_NAME] = self.TBX
+        self.registry._toolboxes[self.TBX] = {"toolName": self.TOOL_NAME, "checkedAt": time.time(), "stale": False}
+        self.savedRegistry = nas.REMOTE_TOOLBOX_REGISTRY
+        self.savedPollInterval = nas.REMOTE_TOOL_INITIAL_POLL_INTERVAL
+        nas.REMOTE_TOOLBOX_REGISTRY = self.registry
+        nas.REMOTE_TOOL_INITIAL_POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        nas.REMOTE_TOOLBOX_REGISTRY = self.savedRegistry
+        nas.REMOTE_TOOL_INITIAL_POLL_INTERVAL = self.savedPollInterval
+        if hasattr(nas.arcpy.gp, self.TOOL_NAME):
+            delattr(nas.arcpy.gp, self.TOOL_NAME)
+
+    def execute(self, checks, timeout):
+        '''Execute a remote tool whose job finishes after the given number of status checks. Return the job.'''
+
+        job = StandInJob(self.registry, self.TOOL_NAME, checks)
+        setattr(nas.arcpy.gp, self.TOOL_NAME, lambda *args: job)
+        try:
+            nas.execute_remote_tool(self.TBX, self.TOOL_NAME, [], timeout)
+        finally:
+            self.assertEqual(self.registry._inUse[self.TOOL_NAME], 0)
+        return job
+
+    def test_lease_is_released_while_waiting_for_the_job(self):
+        job = self.execute(3, 10)
+        self.assertEqual(job.inUse, [0, 0, 0])
+        self.assertFalse(job.cancelled)
+
+    def test_timeout_cancels_the_job_without_marking_the_toolbox_stale(self):
+        self.assertRaises(nas.arcpy.ExecuteError, self.execute, 1000, 0.05)
+        self.assertFalse(self.registry._toolboxes[self.TBX]["stale"])
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestWorkspaceSignature(unittest.TestCase):
+    '''Tests for get_workspace_signature'''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.workspace = os.path.join(self.folder, "extents.gdb")
+        os.mkdir(self.workspace)
+        self.writeFile("a00000001.gdbtable", "rows")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def writeFile(self, name, contents):
+        with open(os.path.join(self.workspace, name), "w") as output_file:
+            output_file.write(contents)
+
+    def test_lock_files_do_not_change_the_signature(self):
+        catalog_path = os.path.join(self.workspace, "ExtentPolygons")
+        signature = nas.get_workspace_signature(catalog_path)
+        self.writeFile("_gdb.host.1234.1234.sr.lock", "")
+        self.assertEqual(nas.get_workspace_signature(catalog_path), signature)
+        self.writeFile("a00000001.gdbtablx", "index")
+        self.assertNotEqual(nas.get_workspace_signature(catalog_path), signature)
+
+    def test_files_removed_after_listing_are_ignored(self):
+        self.writeFile("a00000002.gdbtable", "rows")
+        os_stat = os.stat
+        def stat(path):
+            if path.endswith("a00000002.gdbtable"):
+                raise OSError(2, "No such file or directory")
+            return os_stat(path)
+        os.stat = stat
+        try:
+            signature = nas.get_workspace_signature(os.path.join(self.workspace, "ExtentPolygons"))
+        finally:
+            os.stat = os_stat
+        self.assertEqual(signature[0], 1)
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestEstimatedOutputFeatures(unittest.TestCase):
+    '''Tests for checking the output features estimated before solving'''
+
+    def setUp(self):
+        self.savedPagedOutputMode = nas.PAGED_OUTPUT_MODE
+        nas.PAGED_OUTPUT_MODE = False
+        self.service = nas.FindRoutes.__new__(nas.FindRoutes)
+        self.service.maxFeatures = 10
+        self.service.logger = StandInLogger()
+
+    def tearDown(self):
+        nas.PAGED_OUTPUT_MODE = self.savedPagedOutputMode
+
+    def test_estimate_over_the_limit_only_warns(self):
+        self.service._checkEstimatedOutputFeatures(11)
+        self.assertEqual(len(self.service.logger.warnings), 1)
+
+    def test_estimate_within_the_limit_does_not_warn(self):
+        self.service._checkEstimatedOutputFeatures(10)
+        self.assertEqual(self.service.logger.warnings, [])
+
+    def test_estimate_is_not_checked_in_paged_output_mode(self):
+        nas.PAGED_OUTPUT_MODE = True
+        self.service._checkEstimatedOutputFeatures(11)
+        self.assertEqual(self.service.logger.warnings, [])
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestODTiles(unittest.TestCase):
+    '''Tests for solving OD cost matrix inputs in tiles using a stand-in for the process pool'''
+
+    ORIGIN_COORDINATES = [(0.3 * i, 0.7 * (i % 4)) for i in range(11)]
+    DESTINATION_COORDINATES = [(0.25 + 0.45 * i, 0.5 * (i % 3) + 0.1) for i in range(7)]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.scratchFolder = nas.arcpy.env.scratchFolder
+        nas.arcpy.env.scratchFolder = self.folder
+        self.executeToolsInProcessPool = nas.execute_tools_in_process_pool
+        nas.execute_tools_in_process_pool = straight_line_od_pool
+        self.workspace = nas.arcpy.management.CreateFileGDB(self.folder, "Test.gdb").getOutput(0)
+        self.destinations = create_points(self.workspace, "Destinations", self.DESTINATION_COORDINATES)
+
+    def tearDown(self):
+        nas.execute_tools_in_process_pool = self.executeToolsInProcessPool
+        nas.arcpy.env.scratchFolder = self.scratchFolder
+        nas.arcpy.management.Delete(self.workspace)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def solve_tiles(self, origins, origin_block_size, destination_block_size, destinations_to_find=None):
+        '''Solve the inputs in tiles and return the OD lines as sorted (origin ObjectID, destination ObjectID,
+        destination rank, cost) tuples'''
+
+        service = nas.GenerateOriginDestinationCostMatrix.__new__(nas.GenerateOriginDestinationCostMatrix)
+        service.logger = nas.Logger(nas.LOG_LEVEL)
+        service.origins = origins
+        service.destinations = self.destinations
+        #The number of destinations to find is passed to the service as a string
+        service.destinationsToFind = str(destinations_to_find) if destinations_to_find else None
+        service.isCustomTravelMode = True
+        service.impedance = "Travel Time"
+        service.saveLayerFile = False
+        service.outputODLines = os.path.join(self.workspace, "ODLines")
+        service.outputOrigins = os.path.join(self.workspace, "OutputOrigins")
+        service.outputDestinations = os.path.join(self.workspace, "OutputDestinations")
+        tool_parameters = {"Network_Dataset": self.workspace,
+                           "Number_of_Destinations_to_Find": destinations_to_find}
+        service._executeTiles(tool_parameters, origin_block_size, destination_block_size)
+        self.assertTrue(service.solveSucceeded)
+        self.assertEqual(nas.arcpy.management.GetCount(service.outputOrigins).getOutput(0),
+                         nas.arcpy.management.GetCount(origins).getOutput(0))
+        self.assertEqual(nas.arcpy.management.GetCount(service.outputDestinations).getOutput(0),
+                         nas.arcpy.management.GetCount(self.destinations).getOutput(0))
+        with nas.arcpy.da.SearchCursor(service.outputODLines, ["OriginOID", "DestinationOID", "DestinationRank",
+                                                                "Total_Time"]) as cursor:
+            return sorted(row[:3] + (round(row[3], 9),) for row in cursor)
+
+    def expected_od_lines(self, origins, destinations_to_find=None):
+        '''Return the OD lines from solving all the inputs together'''
+
+        return sorted((origin_oid, destination_oid, rank, round(cost, 9)) for origin_oid, destination_oid, rank, cost
+                      in straight_line_od(origins, self.destinations, destinations_to_find or 0))
+
+    def test_origin_blocks_refer_to_merged_origins(self):
+        origins = create_points(self.workspace, "Origins", self.ORIGIN_COORDINATES)
+        self.assertEqual(self.solve_tiles(origins, 4, 0), self.expected_od_lines(origins))
+
+    def test_destination_ranks_are_merged_across_tiles(self):
+        origins = create_points(self.workspace, "Origins", self.ORIGIN_COORDINATES)
+        self.assertEqual(self.solve_tiles(origins, 4, 3, 2), self.expected_od_lines(origins, 2))
+
+    def test_all_destinations_are_kept_without_destinations_to_find(self):
+        origins = create_points(self.workspace, "Origins", self.ORIGIN_COORDINATES)
+        self.assertEqual(self.solve_tiles(origins, 5, 2), self.expected_od_lines(origins))
+
+    def test_target_destination_count_overrides_destinations_to_find(self):
+        target_destination_counts = [None, 1, 5, None, 3, 7, None, 2, 1, None, 4]
+        origins = create_points(self.workspace, "Origins", self.ORIGIN_COORDINATES,
+                                {"TargetDestinationCount": target_destination_counts})
+        self.assertEqual(self.solve_tiles(origins, 3, 2, 2), self.expected_od_lines(origins, 2))
+
+    def test_inputs_are_not_tiled_when_the_layer_is_saved(self):
+        od_tiling = nas.OD_TILING
+        nas.OD_TILING = True
+        try:
+            service = nas.GenerateOriginDestinationCostMatrix.__new__(nas.GenerateOriginDestinationCostMatrix)
+            service.saveLayerFile = False
+            self.assertEqual(service._getTileBlockSizes(11, 7, {"Maximum_Origins": 5}), (5, 0))
+            service.saveLayerFile = True
+            self.assertEqual(service._getTileBlockSizes(11, 7, {"Maximum_Origins": 5}), (0, 0))
+        finally:
+            nas.OD_TILING = od_tiling
+
+def square(x, y, size):
+    '''Return a square polygon with sides of 2 * size centered on (x, y)'''
+
+    corners = [(x - size, y - size), (x + size, y - size), (x + size, y + size), (x - size, y + size)]
+    return nas.arcpy.Polygon(nas.arcpy.Array([nas.arcpy.Point(*corner) for corner in corners]),
+                             nas.arcpy.SpatialReference(4326))
+
+def union_polygons(polygons):
+    '''Return the union of the polygons'''
+
+    merged_polygon = polygons[0]
+    for polygon in polygons[1:]:
+        merged_polygon = merged_polygon.union(polygon)
+    return merged_polygon
+
+def square_service_area_pool(tool_name, tool_parameters_list, output_workspaces, processes=0):
+    '''Stand-in for nas.execute_tools_in_process_pool that solves each chunk in the current process. The service
+    area for a break around a facility is a square with sides of twice the break value. Writes the outputs like the
+    service area tool.'''
+
+    results = []
+    for tool_parameters, workspace in zip(tool_parameters_list, output_workspaces):
+        nas.arcpy.management.CreateFileGDB(*os.path.split(workspace))
+        service_areas = nas.arcpy.management.CreateFeatureclass(*os.path.split(tool_parameters["Service_Areas"]),
+                                                                geometry_type="POLYGON").getOutput(0)
+        for field_name, field_type in (("FacilityID", "LONG"), ("FromBreak", "DOUBLE"), ("ToBreak", "DOUBLE")):
+            nas.arcpy.management.AddField(service_areas, field_name, field_type)
+        with nas.arcpy.da.SearchCursor(tool_parameters["Facilities"], ["OID@", "SHAPE@XY"]) as cursor:
+            facilities = [(oid, xy) for oid, xy in cursor]
+        breaks = sorted(float(value) for value in tool_parameters["Break_Values"].split())
+        rings = tool_parameters["Polygon_Overlap_Type"] == "RINGS"
+        if tool_parameters["Polygons_for_Multiple_Facilities"] == "MERGE":
+            facility_groups = [(None, [xy for oid, xy in facilities])]
+        else:
+            facility_groups = [(oid, [xy]) for oid, xy in facilities]
+        with nas.arcpy.da.InsertCursor(service_areas, ["FacilityID", "FromBreak", "ToBreak", "SHAPE@"]) as cursor:
+            for facility_id, points in facility_groups:
+                from_break = 0
+                covered_polygon = None
+                for to_break in breaks:
+                    polygon = union_polygons([square(x, y, to_break) for x, y in points])
+                    if rings and covered_polygon:
+                        cursor.insertRow([facility_id, from_break, to_break, polygon.difference(covered_polygon)])
+                    else:
+                        cursor.insertRow([facility_id, 0, to_break, polygon])
+                    covered_polygon = polygon
+                    from_break = to_break
+        results.append(nas.ProcessToolResult([(0, "Succeeded")], [service_areas, "true", ""]))
+    return results
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestServiceAreaChunks(unittest.TestCase):
+    '''Tests for solving service area facilities in chunks using a stand-in for the process pool'''
+
+    FACILITY_COORDINATES = [(0, 0), (3, 1), (5, 5), (1, 4), (8, 2), (6, 7), (2, 9)]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.scratchFolder = nas.arcpy.env.scratchFolder
+        nas.arcpy.env.scratchFolder = self.folder
+        self.executeToolsInProcessPool = nas.execute_tools_in_process_pool
+        nas.execute_tools_in_process_pool = square_service_area_pool
+        self.serviceAreaChunking = (nas.SERVICE_AREA_CHUNKING, nas.SERVICE_AREA_CHUNK_FACILITIES)
+        nas.SERVICE_AREA_CHUNKING, nas.SERVICE_AREA_CHUNK_FACILITIES = True, 3
+        self.workspace = nas.arcpy.management.CreateFileGDB(self.folder, "Test.gdb").getOutput(0)
+        self.facilities = create_points(self.workspace, "Facilities", self.FACILITY_COORDINATES)
+
+    def tearDown(self):
+        nas.execute_tools_in_process_pool = self.executeToolsInProcessPool
+        nas.SERVICE_AREA_CHUNKING, nas.SERVICE_AREA_CHUNK_FACILITIES = self.serviceAreaChunking
+        nas.arcpy.env.scratchFolder = self.scratchFolder
+        nas.arcpy.management.Delete(self.workspace)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def create_service(self, polygon_type, overlap_type):
+        '''Return a service area service that solves the facilities with the polygon and overlap types'''
+
+        service = nas.GenerateServiceAreas.__new__(nas.GenerateServiceAreas)
+        service.logger = nas.Logger(nas.LOG_LEVEL)
+        service.facilities = self.facilities
+        service.polygonType = polygon_type
+        service.overlapType = overlap_type
+        service.saveLayerFile = False
+        service.outputServiceAreas = os.path.join(self.workspace, "ServiceAreas")
+        return service
+
+    def read_service_areas(self, service_areas):
+        '''Return a dict of (FacilityID, FromBreak, ToBreak) -> polygon'''
+
+        with nas.arcpy.da.SearchCursor(service_areas, ["FacilityID", "FromBreak", "ToBreak", "SHAPE@"]) as cursor:
+            return dict((tuple(row[:3]), row[3]) for row in cursor)
+
+    def assert_chunks_match_single_solve(self, polygon_type, overlap_type, chunk_size):
+        service = self.create_service(polygon_type, overlap_type)
+        tool_parameters = {"Network_Dataset": self.workspace, "Break_Values": "1 2 3",
+                           "Polygons_for_Multiple_Facilities": service.MERGE_POLYGONS_KEYWORDS[polygon_type],
+                           "Polygon_Overlap_Type": overlap_type.upper()}
+        service._executeChunks(tool_parameters, chunk_size)
+        expected_result = square_service_area_pool(service.TOOL_NAME, [dict(tool_parameters,
+            Facilities=self.facilities, Service_Areas=os.path.join(self.folder, "Expected.gdb", "ServiceAreas"))],
+            [os.path.join(self.folder, "Expected.gdb")])[0]
+        expected_service_areas = self.read_service_areas(expected_result.getOutput(0))
+        service_areas = self.read_service_areas(service.outputServiceAreas)
+        self.assertEqual(sorted(service_areas), sorted(expected_service_areas))
+        for key, polygon in service_areas.iteritems():
+            self.assertTrue(polygon.equals(expected_service_areas[key]), key)
+        self.assertEqual(service.toolResult.getOutput(1), "true")
+
+    def test_merged_disks_are_unioned_across_chunks(self):
+        self.assert_chunks_match_single_solve("Merge by Break Value", "Disks", 3)
+
+    def test_merged_rings_exclude_smaller_breaks_from_other_chunks(self):
+        self.assert_chunks_match_single_solve("Merge by Break Value", "Rings", 3)
+
+    def test_overlapping_disks_refer_to_facilities(self):
+        self.assert_chunks_match_single_solve("Overlapping", "Disks", 2)
+
+    def test_overlapping_rings_are_kept_for_each_facility(self):
+        self.assert_chunks_match_single_solve("Overlapping", "Rings", 2)
+
+    def test_maximum_facilities_is_enforced_before_chunking(self):
+        service = self.create_service("Merge by Break Value", "Disks")
+        self.assertRaises(nas.InputError, service._getChunkSize, 7, {"Maximum_Facilities": 5})
+        self.assertEqual(service._getChunkSize(7, {"Maximum_Facilities": 7}), 3)
+        self.assertEqual(service._getChunkSize(3, {}), 0)
+
+    def test_facilities_are_not_chunked_when_the_layer_is_saved(self):
+        service = self.create_service("Merge by Break Value", "Disks")
+        service.saveLayerFile = True
+        self.assertEqual(service._getChunkSize(7, {"Maximum_Facilities": 7}), 0)
+
+def route_batch_pool(tool_name, tool_parameters_list, output_workspaces, processes=0):
+    '''Stand-in for nas.execute_tools_in_process_pool that solves each batch of stops in the current process.
+    Writes a route for each route name, two route edges and two directions for each route and the stops like the
+    find routes tool. The route shapes are the first stop of the route.'''
+
+    results = []
+    for tool_parameters, workspace in zip(tool_parameters_list, output_workspaces):
+        nas.arcpy.management.CreateFileGDB(*os.path.split(workspace))
+        with nas.arcpy.da.SearchCursor(tool_parameters["Stops"], ["OID@", "RouteName", "SHAPE@XY"]) as cursor:
+            stops = [row for row in cursor]
+        create_output = lambda name: nas.arcpy.management.CreateFeatureclass(workspace, name, "POINT").getOutput(0)
+        outputs = [create_output("Routes"), nas.arcpy.management.CreateTable(workspace, "RouteEdges").getOutput(0),
+                   nas.arcpy.management.CreateTable(workspace, "Directions").getOutput(0), create_output("Stops")]
+        routes, route_edges, directions, output_stops = outputs
+        nas.arcpy.management.AddField(routes, "Name", "TEXT")
+        for output in outputs[1:]:
+            nas.arcpy.management.AddField(output, "RouteID", "LONG")
+            nas.arcpy.management.AddField(output, "RouteName", "TEXT")
+        nas.arcpy.management.AddField(output_stops, "ORIG_FID", "LONG")
+        route_ids = {}
+        with nas.arcpy.da.InsertCursor(routes, ["Name", "SHAPE@XY"]) as cursor:
+            for oid, route_name, xy in stops:
+                if not route_name in route_ids:
+                    route_ids[route_name] = cursor.insertRow([route_name, xy])
+        for output in (route_edges, directions):
+            with nas.arcpy.da.InsertCursor(output, ["RouteID", "RouteName"]) as cursor:
+                for route_name, route_id in sorted(route_ids.iteritems(), key=lambda item: item[1]):
+                    cursor.insertRow([route_id, route_name])
+                    cursor.insertRow([route_id, route_name])
+        with nas.arcpy.da.InsertCursor(output_stops, ["RouteID", "RouteName", "ORIG_FID", "SHAPE@XY"]) as cursor:
+            for oid, route_name, xy in stops:
+                cursor.insertRow([route_ids[route_name], route_name, oid, xy])
+        results.append(nas.ProcessToolResult([(0, "Succeeded")], ["true"] + outputs + ["", ""]))
+    return results
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestRouteBatches(unittest.TestCase):
+    '''Tests for solving routes in batches using a stand-in for the process pool'''
+
+    STOP_COORDINATES = [(i, i % 3) for i in range(11)]
+    ROUTE_NAMES = [u"A", u"B", u"A", u"C", u"B", u"C", u"D", u"A", u"D", u"E", u"E"]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.scratchFolder = nas.arcpy.env.scratchFolder
+        nas.arcpy.env.scratchFolder = self.folder
+        self.executeToolsInProcessPool = nas.execute_tools_in_process_pool
+        nas.execute_tools_in_process_pool = route_batch_pool
+        self.findRoutesBatching = (nas.FIND_ROUTES_BATCHING, nas.FIND_ROUTES_BATCH_ROUTES)
+        nas.FIND_ROUTES_BATCHING, nas.FIND_ROUTES_BATCH_ROUTES = True, 2
+        self.workspace = nas.arcpy.management.CreateFileGDB(self.folder, "Test.gdb").getOutput(0)
+        self.stops = create_points(self.workspace, "Stops", self.STOP_COORDINATES, {"RouteName": self.ROUTE_NAMES})
+        self.service = nas.FindRoutes.__new__(nas.FindRoutes)
+        self.service.logger = nas.Logger(nas.LOG_LEVEL)
+        self.service.stops = self.stops
+        self.service.saveLayerFile = False
+        self.service.saveRouteData = False
+        self.service.outputRoutes = os.path.join(self.workspace, "Routes")
+        self.service.outputRouteEdges = os.path.join(self.workspace, "RouteEdges")
+        self.service.outputDirections = os.path.join(self.workspace, "Directions")
+        self.service.outputStops = os.path.join(self.workspace, "OutputStops")
+
+    def tearDown(self):
+        nas.execute_tools_in_process_pool = self.executeToolsInProcessPool
+        nas.FIND_ROUTES_BATCHING, nas.FIND_ROUTES_BATCH_ROUTES = self.findRoutesBatching
+        nas.arcpy.env.scratchFolder = self.scratchFolder
+        nas.arcpy.management.Delete(self.workspace)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_route_ids_refer_to_merged_routes(self):
+        route_batches = self.service._getRouteBatches({})
+        self.assertEqual(len(route_batches), 3)
+        self.service._executeBatches({"Network_Dataset": self.workspace}, route_batches)
+        self.assertTrue(self.service.solveSucceeded)
+        with nas.arcpy.da.SearchCursor(self.service.outputRoutes, ["OID@", "Name"]) as cursor:
+            route_names = dict(row for row in cursor)
+        self.assertEqual(sorted(route_names.values()), sorted(set(self.ROUTE_NAMES)))
+        for output in (self.service.outputRouteEdges, self.service.outputDirections, self.service.outputStops):
+            with nas.arcpy.da.SearchCursor(output, ["RouteID", "RouteName"]) as cursor:
+                for route_id, route_name in cursor:
+                    self.assertEqual(route_names[route_id], route_name)
+
+    def test_stop_orig_fid_refers_to_input_stops(self):
+        self.service._executeBatches({"Network_Dataset": self.workspace}, self.service._getRouteBatches({}))
+        with nas.arcpy.da.SearchCursor(self.stops, ["OID@", "SHAPE@XY"]) as cursor:
+            stop_coordinates = dict(row for row in cursor)
+        with nas.arcpy.da.SearchCursor(self.service.outputStops, ["ORIG_FID", "SHAPE@XY"]) as cursor:
+            output_stops = [row for row in cursor]
+        self.assertEqual(len(output_stops), len(self.STOP_COORDINATES))
+        for orig_fid, xy in output_stops:
+            self.assertEqual(stop_coordinates[orig_fid], xy)
+
+    def test_routes_are_not_batched_when_route_data_is_saved(self):
+        self.service.saveRouteData = True
+        self.assertEqual(self.service._getRouteBatches({}), [])
+
+    def test_routes_are_not_batched_when_the_layer_is_saved(self):
+        self.service.saveLayerFile = True
+        self.assertEqual(self.service._getRouteBatches({}), [])
+
+    def test_maximum_stops_is_enforced_before_batching(self):
+        self.assertRaises(nas.InputError, self.service._getRouteBatches, {"Maximum_Stops": 10})
+        self.assertEqual(len(self.service._getRouteBatches({"Maximum_Stops": 11})), 3)
+
+@unittest.skipIf(nas is None, "arcpy is not available")
+class TestKDTree(unittest.TestCase):
+    '''Compare KDTree queries with a brute-force search'''
+
+    def setUp(self):
+        random_state = nas.np.random.RandomState(7)
+        self.points = random_state.uniform(-1000, 1000, (500, 3))
+        self.queries = random_state.uniform(-1200, 1200, (40, 3))
+
+    def brute_force_query(self, points, point, k, max_distance=float("inf")):
+        distances = nas.np.sqrt(((points - point) ** 2).sum(axis=1))
+        order = [index for index in nas.np.argsort(distances, kind="mergesort") if distances[index] <= max_distance]
+        return order[:k], distances
+
+    def assert_query_matches_brute_force(self, points, queries, k, max_distance=float("inf"), leaf_size=16):
+        tree = nas.KDTree(points, leaf_size)
+        for point in queries:
+            expected, distances = self.brute_force_query(points, point, k, max_distance)
+            nearest = tree.query(point, k, max_distance)
+            #Points at the same distance can be returned in any order
+            self.assertEqual([round(distances[index], 9) for index in nearest],
+                             [round(distances[index], 9) for index in expected])
+            self.assertEqual(len(set(nearest)), len(nearest))
+
+    def test_nearest_points(self):
+        for k in (1, 5, 32):
+            self.assert_query_matches_brute_force(self.points, self.queries, k)
+
+    def test_max_distance(self):
+        self.assert_query_matches_brute_force(self.points, self.queries, 10, 150.0)
+        self.assert_query_matches_brute_force(self.points, self.queries, 10, 0.0)
+
+    def test_leaf_sizes(self):
+        for leaf_size in (1, 2, 600):
+            self.assert_query_matches_brute_force(self.points, self.queries, 7, leaf_size=leaf_size)
+
+    def test_more_neighbours_than_points(self):
+        self.assert_query_matches_brute_force(self.points[:20], self.queries, 50)
+
+    def test_duplicate_points(self):
+        points = nas.np.vstack([self.points[:50]] * 3)
+        self.assert_query_matches_brute_force(points, self.queries[:10], 9, leaf_size=4)
+
+    def test_empty_tree(self):
+        self.assertEqual(nas.KDTree(nas.np.empty((0, 3))).query([0, 0, 0], 5), [])
+
+@unittest.skipIf(nas is None or not os.environ.get("NAS_TEST_NETWORK_DATASET"),
+                 "NAS_TEST_NETWORK_DATASET is not set")
+class TestODTilesIntegration(unittest.TestCase):
+    '''Compare the OD lines solved in tiles in a pool of processes with the OD lines solved in one tool execution
+    using the network dataset from NAS_TEST_NETWORK_DATASET'''
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.scratchFolder = nas.arcpy.env.scratchFolder
+        nas.arcpy.env.scratchFolder = self.folder
+        self.workspace = nas.arcpy.management.CreateFileGDB(self.folder, "Test.gdb").getOutput(0)
+        self.toolParameters = {"Network_Dataset": os.environ["NAS_TEST_NETWORK_DATASET"],
+                               "Number_of_Destinations_to_Find": 3}
+
+    def tearDown(self):
+        nas.arcpy.env.scratchFolder = self.scratchFolder
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def read_od_lines(self, od_lines):
+        with nas.arcpy.da.SearchCursor(od_lines, ["OriginOID", "DestinationOID", "DestinationRank",
+                                                  "Total_Time"]) as cursor:
+            return sorted(row[:3] + (round(row[3], 6),) for row in cursor)
+
+    def test_tiles_match_single_solve(self):
+        origins = os.environ["NAS_TEST_ORIGINS"]
+        destinations = os.environ["NAS_TEST_DESTINATIONS"]
+        nas.arcpy.CheckOutExtension("network")
+        result = nas.arcpy.GenerateOriginDestinationCostMatrix_na(Origins=origins, Destinations=destinations,
+                                                                  Output_Geodatabase=self.workspace,
+                                                                  **self.toolParameters)
+        service = nas.GenerateOriginDestinationCostMatrix.__new__(nas.GenerateOriginDestinationCostMatrix)
+        service.logger = nas.Logger(nas.LOG_LEVEL)
+        service.origins = origins
+        service.destinations = destinations
+        service.destinationsToFind = str(self.toolParameters["Number_of_Destinations_to_Find"])
+        service.isCustomTravelMode = True
+        service.impedance = "Travel Time"
+        service.saveLayerFile = False
+        service.outputODLines = os.path.join(self.workspace, "TiledODLines")
+        service.outputOrigins = os.path.join(self.workspace, "TiledOrigins")
+        service.outputDestinations = os.path.join(self.workspace, "TiledDestinations")
+        count = lambda dataset: int(nas.arcpy.management.GetCount(dataset).getOutput(0))
+        service._executeTiles(self.toolParameters, max(count(origins) // 3, 1), max(count(destinations) // 2, 1))
+        self.assertEqual(self.read_od_lines(service.outputODLines), self.read_od_lines(result.getOutput(1)))
+
+if __name__ == "__main__":
+    unittest.main()
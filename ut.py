@@ -244,6 +244,7 @@ class CreateSupportingFiles(object):
 
         #Initialize derived outputs
         self.ndsPropertiesFile = os.path.join(self.supportingFilesFolder, "NetworkDatasetProperties.ini")
+        self.ndsPropertiesJSONFile = nas.get_nds_properties_json_file(self.ndsPropertiesFile)
         self.travelModesFile = os.path.join(self.supportingFilesFolder, "DefaultTravelModes.json")
         self.localizedTravelModesFile = os.path.join(self.supportingFilesFolder, "DefaultTravelModesLocalized.json")
         self.toolInfoFile = os.path.join(self.supportingFilesFolder, "ToolInfo.json")
@@ -265,6 +266,12 @@ class CreateSupportingFiles(object):
         with open(self.ndsPropertiesFile, "w", 0) as config_file:
             parser.write(config_file)
 
+        #Write the same properties as a JSON document that is faster to load than the ini file. The services use the
+        #ini file only if the JSON document does not exist.
+        self.logger.info(u"Writing network dataset properties to {0}".format(self.ndsPropertiesJSONFile))
+        nds_properties = nas.NetworkDatasetProperties.from_config_file(self.ndsPropertiesFile)
+        nds_properties.save(self.ndsPropertiesJSONFile)
+
         #Store the default travel modes
         self._getTravelModes()
 
@@ -1293,6 +1300,10 @@ class PublishRoutingServices(object):
     def cleanup(self):
         '''Delete intermidiate files and folders'''
 
+        #Close the connections kept open for the admin and sharing requests
+        self.logger.debug("HTTP connections: {}".format(nas.HTTP_CONNECTION_POOL.stats()))
+        nas.HTTP_CONNECTION_POOL.close()
+
         #skip cleanup if log level is DEBUG
         if self.logger.DEBUG:
             return